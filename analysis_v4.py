@@ -0,0 +1,664 @@
+# Load-time analysis passes over the parsed Element AST.
+# Results are stored as plain attributes on the Element nodes (never in node.dict, so printing
+# an AST is unchanged) and are read back by interpreterv4.
+
+from intbase import InterpreterBase, ErrorType
+
+
+def analyze_program(ast):
+    link_program(ast)
+    for func in ast.dict['functions']:
+        for statement in func.dict['statements']:
+            annotate_statement(statement)
+        resolve_function(func)
+        annotate_declared_strict(func)
+        annotate_strictness(func)
+    annotate_purity(ast)
+
+
+## LINKING ##
+# Resolves every user function call once, up front, instead of searching the function list on every
+# call: fcall.target is the func node it calls (the first one with that name and argument count),
+# or None when there isn't one. Then fcall.link_error is the (ErrorType, message) the call raises if
+# it's ever reached, and the same problem goes in ast.link_diagnostics ("caller/arity: message"),
+# so it's known before anything runs. ast.main is the first function named main (or None).
+def link_program(ast):
+    funcs = {}
+    names = set()
+    for func in ast.dict['functions']:
+        funcs.setdefault((func.dict['name'], len(func.dict['args'])), func)
+        names.add(func.dict['name'])
+    diagnostics = []
+    for func in ast.dict['functions']:
+        for expression in walk_expressions(func.dict['statements']):
+            if expression.elem_type != InterpreterBase.FCALL_NODE or expression.dict['name'] in BUILTIN_FUNCS:
+                continue
+            name, arity = expression.dict['name'], len(expression.dict['args'])
+            expression.target = funcs.get((name, arity))
+            expression.link_error = None
+            if expression.target is None:
+                if name not in names:
+                    expression.link_error = (ErrorType.NAME_ERROR, f"Function {name} was not found")
+                else:
+                    expression.link_error = (ErrorType.NAME_ERROR, f"Incorrect amount of arguments given: {arity} ")
+                diagnostics.append(f"{func.dict['name']}/{len(func.dict['args'])}: {expression.link_error[1]}")
+    ast.link_diagnostics = diagnostics
+    ast.main = next((func for func in ast.dict['functions'] if func.dict['name'] == "main"), None)
+
+
+# Walks a statement and annotates every expression found under it.
+def annotate_statement(statement_node):
+    if statement_node.elem_type == "=":
+        statement_node.dict['expression'].site_kind = "assignment"
+        statement_node.dict['expression'].site_label = f"{statement_node.dict['name']} = ..."
+    elif statement_node.elem_type == InterpreterBase.RETURN_NODE:
+        annotate_tail_call(statement_node)
+    for expression in statement_expressions(statement_node):
+        annotate_site_kind(expression)
+        annotate_free_vars(expression)
+        annotate_leading(expression)
+        annotate_cost(expression)
+        annotate_fold(expression)
+    for block in statement_blocks(statement_node):
+        for statement in block:
+            annotate_statement(statement)
+
+
+# The expressions a statement evaluates directly (not the ones inside its nested blocks).
+def statement_expressions(statement_node):
+    elem = statement_node.elem_type
+    if elem == "=":
+        return [statement_node.dict['expression']]
+    elif elem == InterpreterBase.RETURN_NODE:
+        expression = statement_node.dict['expression']
+        return [expression] if expression else []
+    elif elem == InterpreterBase.IF_NODE:
+        return [statement_node.dict['condition']]
+    elif elem == InterpreterBase.FOR_NODE:
+        return [statement_node.dict['condition']]
+    elif elem == InterpreterBase.RAISE_NODE:
+        return [statement_node.dict['exception_type']]
+    elif elem in (InterpreterBase.VAR_DEF_NODE, InterpreterBase.TRY_NODE):
+        return []
+    # expression statements (fcall, or a bare expression the interpreter ignores)
+    return [statement_node]
+
+
+# The statement lists nested directly under a statement.
+# for init/update are single assignments, so they are handed back as one-statement blocks.
+def statement_blocks(statement_node):
+    elem = statement_node.elem_type
+    if elem == InterpreterBase.IF_NODE:
+        blocks = [statement_node.dict['statements']]
+        if statement_node.dict['else_statements']:
+            blocks.append(statement_node.dict['else_statements'])
+        return blocks
+    elif elem == InterpreterBase.FOR_NODE:
+        return [[statement_node.dict['init']], statement_node.dict['statements'], [statement_node.dict['update']]]
+    elif elem == InterpreterBase.TRY_NODE:
+        blocks = [statement_node.dict['statements']]
+        for catcher in statement_node.dict['catchers']:
+            blocks.append(catcher.dict['statements'])
+        return blocks
+    return []
+
+
+# Sets return_node.tail_call: whether it returns a call to a user function, so once the call's
+# arguments are bound the caller has nothing left to do and the callee can run in its place
+# (see Interpreter.run_func). That includes returns inside try/catch: a return leaves the try
+# without the catchers ever looking at the value, whatever the callee comes back with.
+def annotate_tail_call(return_node):
+    expression = return_node.dict['expression']
+    return_node.tail_call = (expression is not None and expression.elem_type == InterpreterBase.FCALL_NODE
+                             and expression.dict['name'] not in BUILTIN_FUNCS)
+
+
+# Marks the arguments of user function calls under expression_node with .site_kind = "argument"
+# (assigned expressions get "assignment"); the places the interpreter may make a Thunk.
+# .site_label says which one it is in source terms, e.g. "x = ..." or "f(arg 2)".
+def annotate_site_kind(expression_node):
+    if expression_node.elem_type == InterpreterBase.FCALL_NODE and expression_node.dict['name'] not in BUILTIN_FUNCS:
+        for i, arg in enumerate(expression_node.dict['args']):
+            arg.site_kind = "argument"
+            arg.site_label = f"{expression_node.dict['name']}(arg {i + 1})"
+    for child in sub_expressions(expression_node):
+        annotate_site_kind(child)
+
+
+# Sets expression_node.free_vars on the node and all of its sub-expressions: the variable names
+# the expression can read, in the order they first appear. A Thunk only has to capture these.
+def annotate_free_vars(expression_node):
+    elem = expression_node.elem_type
+    if elem == InterpreterBase.VAR_NODE:
+        free_vars = (expression_node.dict['name'],)
+    else:
+        # literals, nil and new have no sub-expressions, so no free variables
+        free_vars = merge_names(annotate_free_vars(child) for child in sub_expressions(expression_node))
+    expression_node.free_vars = free_vars
+    return free_vars
+
+
+def merge_names(groups):
+    merged = []
+    for group in groups:
+        for name in group:
+            if name not in merged:
+                merged.append(name)
+    return tuple(merged)
+
+
+## COST ##
+# Sets expression_node.cheap on every node, for expressions that cost less to evaluate than to wrap
+# in a Thunk:
+#   "literal" - int/string/bool/nil, the value is known without an environment
+#   "var"     - a plain variable read, the binding itself can be passed along
+#   "arith"   - a few int literals and variables under +, -, *, /, neg and comparisons. That can't
+#               fail (division by zero is an error value), provided every variable is already an int.
+# Anything else is None.
+CHEAP_ARITH_NODES = 7
+ARITH_OPS = ("+", "-", "*", "/", InterpreterBase.NEG_NODE, "==", "!=", "<", "<=", ">", ">=")
+LITERAL_NODES = (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE)
+
+def annotate_cost(expression_node):
+    elem = expression_node.elem_type
+    if elem in LITERAL_NODES:
+        cheap = "literal"
+    elif elem == InterpreterBase.VAR_NODE:
+        cheap = "var"
+    else:
+        size = arith_size(expression_node)
+        cheap = "arith" if size is not None and size <= CHEAP_ARITH_NODES else None
+    expression_node.cheap = cheap
+    for child in sub_expressions(expression_node):
+        annotate_cost(child)
+
+
+# node count of an int-only arithmetic tree, or None if it's anything else
+def arith_size(expression_node):
+    elem = expression_node.elem_type
+    if elem in (InterpreterBase.INT_NODE, InterpreterBase.VAR_NODE):
+        return 1
+    if elem not in ARITH_OPS:
+        return None
+    size = 1
+    for child in sub_expressions(expression_node):
+        child_size = arith_size(child)
+        if child_size is None:
+            return None
+        size += child_size
+    return size
+
+
+def sub_expressions(expression_node):
+    if expression_node.elem_type == InterpreterBase.FCALL_NODE:
+        return expression_node.dict['args']
+    return [expression_node.dict[op] for op in ('op1', 'op2') if op in expression_node.dict]
+
+
+## STRICTNESS ##
+# A binding can be evaluated eagerly (no Thunk) when the very next thing that could be observed
+# is that binding being forced: nothing in between can print, read input, raise or fail, so
+# evaluating it early can't be told apart from evaluating it on demand.
+#
+# "Leading" variables are the ones an expression forces before it applies any operator or calls
+# anything, i.e. before anything that can fail or have a side effect. For `b + a * 2` that is
+# [b, a]; for `f(x) + y` it is [] because the call comes first.
+
+BUILTIN_FUNCS = ("print", "inputi", "inputs")
+
+# returns (names, complete): complete is True when nothing but variable reads and literals ran.
+def leading_vars(expression_node):
+    elem = expression_node.elem_type
+    if elem == InterpreterBase.VAR_NODE:
+        return [expression_node.dict['name']], True
+    if elem in (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE):
+        return [], True
+    if elem in ("+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">="):
+        names, complete = leading_vars(expression_node.dict['op1'])
+        if complete:
+            names = names + leading_vars(expression_node.dict['op2'])[0]
+        return names, False
+    if elem in ("&&", "||", InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+        return leading_vars(expression_node.dict['op1'])[0], False
+    return [], False  # fcall, new
+
+
+# Sets expression_node.leading_index on the node and its sub-expressions: where its (distinct)
+# leading variables sit in free_vars, in the order they get forced. Thunk forcing uses it to force
+# those dependencies first without recursing. Needs annotate_free_vars first.
+def annotate_leading(expression_node):
+    indexes = []
+    for name in leading_vars(expression_node)[0]:
+        index = expression_node.free_vars.index(name)
+        if index not in indexes:
+            indexes.append(index)
+    expression_node.leading_index = tuple(indexes)
+    for child in sub_expressions(expression_node):
+        annotate_leading(child)
+
+
+# Sets expression_node.fold on +, -, *, / nodes whose operands are both variables or int/string
+# literals: one (kind, x) pair per operand, ("var", index into free_vars) or ("literal", value).
+# A chain of Thunks for such a node can be folded in one loop when forced (Thunk.fusable_chain).
+# Needs annotate_free_vars first.
+def annotate_fold(expression_node):
+    fold = None
+    if expression_node.elem_type in ("+", "-", "*", "/"):
+        operands = [fold_operand(expression_node, expression_node.dict[op]) for op in ('op1', 'op2')]
+        if None not in operands:
+            fold = tuple(operands)
+    expression_node.fold = fold
+    for child in sub_expressions(expression_node):
+        annotate_fold(child)
+
+
+def fold_operand(expression_node, operand):
+    if operand.elem_type == InterpreterBase.VAR_NODE:
+        return ("var", expression_node.free_vars.index(operand.dict['name']))
+    if operand.elem_type in (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE):
+        return ("literal", operand.dict['val'])
+    return None
+
+
+## LEXICAL ADDRESSING ##
+# Gives every variable access a fixed place in env_v4.Frames, so nothing gets looked up by name
+# scope by scope at run time. Level 0 holds a call's parameters, level 1 the function body, and
+# every nested if/else/for/try block is one more level (a catch block shares its try block's).
+# Slots are numbered per block in the order the block declares them.
+#   - var nodes and assignments get .address: (level, slot) candidates, innermost first. There is
+#     exactly one unless a catch block uses a name its try block declares (it can't know how far
+#     the try block got), in which case the outer declarations follow. () means undeclared.
+#   - vardefs get .slot, and .redefinition: True if the block certainly declared the name already
+#     (so running it is a NAME_ERROR), None if it only maybe did (catch again), otherwise False.
+#   - slot names per block: func .param_names and .block_names, if .block_names and
+#     .else_block_names, for and try .block_names. A block that declares nothing gets no level
+#     at all (block_names None), so the interpreter doesn't push a frame for it.
+#   - every expression gets .free_addresses (lined up with free_vars) and .capture_shape, the
+#     frame sizes needed to evaluate it from a capture (env_v4.captured_frames).
+class Block:
+    def __init__(self, names, declared):
+        self.names = names # slot -> name; a try block shares this list with its catchers
+        self.declared = declared # name -> True if certainly declared by now, False if maybe
+
+    def slot(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return last_index(self.names, name)
+
+
+# Where name is in names, counting from the end: a repeated parameter name refers to the last one,
+# the same as binding the arguments left to right into one scope did
+def last_index(names, name):
+    return len(names) - 1 - names[::-1].index(name)
+
+
+def resolve_function(func_node):
+    params = [arg.dict['name'] for arg in func_node.dict['args']]
+    func_node.param_names = tuple(params)
+    func_node.block_names = resolve_nested_block(func_node.dict['statements'], [Block(params, {name: True for name in params})])
+
+
+def resolve_block(statements, blocks):
+    for statement in statements:
+        resolve_statement(statement, blocks)
+
+
+def resolve_statement(statement_node, blocks):
+    elem = statement_node.elem_type
+    for expression in statement_expressions(statement_node):
+        resolve_expression(expression, blocks)
+    if elem == InterpreterBase.VAR_DEF_NODE:
+        block = blocks[-1]
+        name = statement_node.dict['name']
+        state = block.declared.get(name)
+        statement_node.redefinition = None if state is False else state is True
+        block.declared[name] = True
+        statement_node.slot = block.slot(name)
+    elif elem == "=":
+        statement_node.address = resolve_name(statement_node.dict['name'], blocks)
+    elif elem == InterpreterBase.IF_NODE:
+        statement_node.block_names = resolve_nested_block(statement_node.dict['statements'], blocks)
+        statement_node.else_block_names = resolve_nested_block(statement_node.dict['else_statements'] or [], blocks)
+    elif elem == InterpreterBase.FOR_NODE:
+        resolve_statement(statement_node.dict['init'], blocks)
+        resolve_statement(statement_node.dict['update'], blocks)
+        statement_node.block_names = resolve_nested_block(statement_node.dict['statements'], blocks)
+    elif elem == InterpreterBase.TRY_NODE:
+        catchers = statement_node.dict['catchers']
+        if not any(declares_vars(block) for block in [statement_node.dict['statements']] + [c.dict['statements'] for c in catchers]):
+            statement_node.block_names = None
+            resolve_block(statement_node.dict['statements'], blocks)
+            for catcher in catchers:
+                resolve_block(catcher.dict['statements'], blocks)
+            return
+        block = Block([], {})
+        resolve_block(statement_node.dict['statements'], blocks + [block])
+        for catcher in catchers:
+            # whatever the try block declares may or may not have happened by the time it raised
+            resolve_block(catcher.dict['statements'], blocks + [Block(block.names, {name: False for name in block.declared})])
+        statement_node.block_names = tuple(block.names)
+
+
+# resolves a block nested in blocks and returns its slot names (None if it declares nothing and so
+# doesn't get a level of its own)
+def resolve_nested_block(statements, blocks):
+    if not declares_vars(statements):
+        resolve_block(statements, blocks)
+        return None
+    block = Block([], {})
+    resolve_block(statements, blocks + [block])
+    return tuple(block.names)
+
+
+def declares_vars(statements):
+    return any(statement.elem_type == InterpreterBase.VAR_DEF_NODE for statement in statements)
+
+
+def resolve_name(name, blocks):
+    address = []
+    for level in reversed(range(len(blocks))):
+        state = blocks[level].declared.get(name)
+        if state is not None:
+            address.append((level, blocks[level].slot(name)))
+            if state:
+                break
+    return tuple(address)
+
+
+def resolve_expression(expression_node, blocks):
+    addresses = {}
+    for node in walk_expression(expression_node):
+        if node.elem_type == InterpreterBase.VAR_NODE:
+            name = node.dict['name']
+            if name not in addresses:
+                addresses[name] = resolve_name(name, blocks)
+            node.address = addresses[name]
+    for node in walk_expression(expression_node):
+        node.free_addresses = tuple(addresses[name] for name in node.free_vars)
+        sizes = []
+        for address in node.free_addresses:
+            for level, slot in address:
+                sizes += [0] * (level + 1 - len(sizes))
+                sizes[level] = max(sizes[level], slot + 1)
+        node.capture_shape = tuple(sizes)
+
+
+## DECLARED STRICTNESS ##
+# `func f(!x)` and `var !x;` opt a binding out of laziness. Sets func_node.bang_params, the
+# (name, index) of its ! parameters, and .declared_strict on every assignment in it: whether the
+# declaration it assigns to (innermost one in scope, found the same way resolve_name does) is a ! one.
+# Such assignments are also marked .strict with no .strict_owner, so they are evaluated right away
+# without counting as something annotate_strictness worked out.
+def annotate_declared_strict(func_node):
+    args = func_node.dict['args']
+    func_node.bang_params = tuple((arg.dict['name'], i) for i, arg in enumerate(args) if arg.dict['strict'])
+    params = {arg.dict['name']: arg.dict['strict'] for arg in args}
+    annotate_block_declared_strict(func_node.dict['statements'], [params, {}])
+
+
+# scopes: one dict per enclosing block, name -> declared strict, innermost last
+def annotate_block_declared_strict(statements, scopes):
+    for statement in statements:
+        elem = statement.elem_type
+        if elem == InterpreterBase.VAR_DEF_NODE:
+            scopes[-1][statement.dict['name']] = statement.dict['strict']
+        elif elem == "=":
+            annotate_assign_declared_strict(statement, scopes)
+        elif elem == InterpreterBase.IF_NODE:
+            annotate_block_declared_strict(statement.dict['statements'], scopes + [{}])
+            if statement.dict['else_statements']:
+                annotate_block_declared_strict(statement.dict['else_statements'], scopes + [{}])
+        elif elem == InterpreterBase.FOR_NODE:
+            annotate_assign_declared_strict(statement.dict['init'], scopes)
+            annotate_assign_declared_strict(statement.dict['update'], scopes)
+            annotate_block_declared_strict(statement.dict['statements'], scopes + [{}])
+        elif elem == InterpreterBase.TRY_NODE:
+            try_scope = {}
+            annotate_block_declared_strict(statement.dict['statements'], scopes + [try_scope])
+            for catcher in statement.dict['catchers']:
+                # catchers run in the scope the try block left behind
+                annotate_block_declared_strict(catcher.dict['statements'], scopes + [dict(try_scope)])
+
+
+def annotate_assign_declared_strict(assign_node, scopes):
+    declared_strict = False
+    for scope in reversed(scopes):
+        if assign_node.dict['name'] in scope:
+            declared_strict = scope[assign_node.dict['name']]
+            break
+    assign_node.declared_strict = declared_strict
+    if declared_strict:
+        assign_node.strict = True
+        assign_node.strict_owner = None
+
+
+# Annotates every assignment in func_node with .strict and the func node with .strict_params,
+# the parameters its body forces first, in the order it forces them.
+def annotate_strictness(func_node):
+    params = [arg.dict['name'] for arg in func_node.dict['args']]
+    owner = f"{func_node.dict['name']}/{len(params)}"
+    func_node.strict_owner = owner
+    statements = func_node.dict['statements']
+    annotate_block_strictness(statements, set(params), set(), owner)
+
+    strict_params = []
+    for name in first_forced(statements, 0, set(params), set(params), set()):
+        if name not in params:
+            break
+        if name not in strict_params:
+            strict_params.append(name)
+    func_node.strict_params = tuple((name, last_index(params, name)) for name in strict_params)
+
+
+# visible: names certainly declared when the block starts (outside it)
+# maybe_declared: names that might already be in the block's own scope (a catch block runs in
+# the scope its try block left behind)
+def annotate_block_strictness(statements, visible, maybe_declared, owner):
+    declared_before = []
+    declared = set()
+    for statement in statements:
+        declared_before.append(set(declared))
+        if statement.elem_type == InterpreterBase.VAR_DEF_NODE:
+            declared.add(statement.dict['name'])
+
+    # backwards, so a later assignment's strictness is known when an earlier one scans past it
+    for i in reversed(range(len(statements))):
+        statement = statements[i]
+        inner_visible = visible | declared_before[i]
+        if statement.elem_type == "=":
+            if statement.declared_strict:
+                continue
+            statement.strict_owner = owner
+            target = statement.dict['name']
+            forced = first_forced(statements, i + 1, visible | declared_before[i], {target},
+                                  maybe_declared | declared_before[i])
+            statement.strict = bool(forced) and forced[0] == target
+        elif statement.elem_type == InterpreterBase.IF_NODE:
+            annotate_block_strictness(statement.dict['statements'], inner_visible, set(), owner)
+            if statement.dict['else_statements']:
+                annotate_block_strictness(statement.dict['else_statements'], inner_visible, set(), owner)
+        elif statement.elem_type == InterpreterBase.FOR_NODE:
+            # init and update both run right before the condition
+            first = leading_vars(statement.dict['condition'])[0]
+            for assign in (statement.dict['init'], statement.dict['update']):
+                if assign.declared_strict:
+                    continue
+                assign.strict_owner = owner
+                assign.strict = bool(first) and first[0] == assign.dict['name']
+            annotate_block_strictness(statement.dict['statements'], inner_visible, set(), owner)
+        elif statement.elem_type == InterpreterBase.TRY_NODE:
+            try_statements = statement.dict['statements']
+            annotate_block_strictness(try_statements, inner_visible, set(), owner)
+            try_names = {s.dict['name'] for s in try_statements if s.elem_type == InterpreterBase.VAR_DEF_NODE}
+            for catcher in statement.dict['catchers']:
+                annotate_block_strictness(catcher.dict['statements'], inner_visible, try_names, owner)
+
+
+# Scans statements[start:] for the first one that does something observable and returns the
+# leading variables it forces. Returns [] if a watched name is redeclared or reassigned first.
+def first_forced(statements, start, visible, watched, maybe_declared):
+    visible = set(visible)
+    maybe_declared = set(maybe_declared)
+    for statement in statements[start:]:
+        elem = statement.elem_type
+        if elem == InterpreterBase.VAR_DEF_NODE:
+            name = statement.dict['name']
+            if name in watched or name in maybe_declared:
+                return []  # shadows what we're watching, or is a redefinition error
+            visible.add(name)
+            maybe_declared.add(name)
+        elif elem == "=":
+            if statement.dict['name'] in watched or statement.dict['name'] not in visible:
+                return []  # rebinds what we're watching, or is an undeclared-variable error
+            if statement.strict:
+                return leading_vars(statement.dict['expression'])[0]
+        elif elem == InterpreterBase.FCALL_NODE:
+            return leading_args(statement)
+        elif elem == InterpreterBase.RETURN_NODE:
+            if not statement.dict['expression']:
+                return []
+            return leading_vars(statement.dict['expression'])[0]
+        elif elem == InterpreterBase.IF_NODE:
+            return leading_vars(statement.dict['condition'])[0]
+        elif elem == InterpreterBase.FOR_NODE:
+            init = statement.dict['init']
+            if init.dict['name'] in watched or init.dict['name'] not in visible:
+                return []
+            if init.strict:
+                return leading_vars(init.dict['expression'])[0]
+            return leading_vars(statement.dict['condition'])[0]
+        elif elem == InterpreterBase.RAISE_NODE:
+            return leading_vars(statement.dict['exception_type'])[0]
+        elif elem == InterpreterBase.TRY_NODE:
+            return []
+        # anything else is a bare expression statement, which the interpreter never evaluates
+    return []
+
+
+# print/inputi/inputs evaluate their arguments left to right before doing anything observable
+def leading_args(fcall_node):
+    args = fcall_node.dict['args']
+    if fcall_node.dict['name'] not in BUILTIN_FUNCS:
+        return []  # user function: arguments are lazy and the call itself is a barrier
+    if fcall_node.dict['name'] != "print" and len(args) > 1:
+        return []  # inputi/inputs with too many args is an error before anything is evaluated
+    names = []
+    for arg in args:
+        arg_names, complete = leading_vars(arg)
+        names += arg_names
+        if not complete:
+            break
+    return names
+
+
+## PURITY ##
+# A function is pure when nothing it can run prints, reads input or raises: no print/inputi/inputs
+# or raise anywhere in its body, and every user function it calls (by name and argument count,
+# which is how calls are resolved) is pure as well. Calling a function that doesn't exist is impure.
+# Sets func.pure on every function, and gives every call to a pure function with effect-free arguments
+# (expression.effect_free, see below) a .site_id indexing ast.speculable_sites (same numbering for
+# the same program text, so another process can find it).
+# Also sets func.terminates: pure, no for loops, and only calls functions that terminate (so no
+# recursion either), i.e. calling it always finishes; and expression.eager_safe (see below).
+def annotate_purity(ast):
+    funcs = {}
+    for func in ast.dict['functions']:
+        funcs.setdefault((func.dict['name'], len(func.dict['args'])), func) # first match wins, like get_func_def
+
+    callees = {}
+    pure = {}
+    loops = set()
+    for key, func in funcs.items():
+        callees[key] = set()
+        pure[key] = True
+        for statement in walk_statements(func.dict['statements']):
+            if statement.elem_type == InterpreterBase.RAISE_NODE:
+                pure[key] = False
+            elif statement.elem_type == InterpreterBase.FOR_NODE:
+                loops.add(key)
+        for expression in walk_expressions(func.dict['statements']):
+            if expression.elem_type == InterpreterBase.FCALL_NODE:
+                if expression.dict['name'] in BUILTIN_FUNCS:
+                    pure[key] = False
+                else:
+                    callees[key].add((expression.dict['name'], len(expression.dict['args'])))
+
+    changed = True
+    while changed:
+        changed = False
+        for key in funcs:
+            if pure[key] and any(not pure.get(callee, False) for callee in callees[key]):
+                pure[key] = False
+                changed = True
+
+    # grows from nothing, so functions on a call cycle never make it in
+    terminates = {key: False for key in funcs}
+    changed = True
+    while changed:
+        changed = False
+        for key in funcs:
+            if not terminates[key] and pure[key] and key not in loops and all(terminates.get(callee, False) for callee in callees[key]):
+                terminates[key] = True
+                changed = True
+
+    sites = []
+    for func in ast.dict['functions']:
+        key = (func.dict['name'], len(func.dict['args']))
+        func.pure = pure[key]
+        func.terminates = terminates[key]
+        for statement in walk_statements(func.dict['statements']):
+            for expression in statement_expressions(statement):
+                annotate_eager_safe(expression, terminates)
+                annotate_effect_free(expression, pure)
+        for expression in walk_expressions(func.dict['statements']):
+            # the arguments run on the worker too, so they can't have effects either
+            if expression.elem_type == InterpreterBase.FCALL_NODE and expression.effect_free:
+                expression.site_id = len(sites)
+                sites.append(expression)
+    ast.speculable_sites = sites
+
+
+# Sets expression_node.eager_safe on the node and all of its sub-expressions: evaluating it early
+# can't be observed, because it has no effects and always finishes (only calls functions that
+# terminate). It can still fail with an error, which the interpreter has to be ready for.
+def annotate_eager_safe(expression_node, terminates):
+    safe = True
+    for child in sub_expressions(expression_node):
+        safe = annotate_eager_safe(child, terminates) and safe
+    if expression_node.elem_type == InterpreterBase.FCALL_NODE:
+        key = (expression_node.dict['name'], len(expression_node.dict['args']))
+        safe = safe and terminates.get(key, False)
+    expression_node.eager_safe = safe
+    return safe
+
+
+# Sets expression_node.effect_free on the node and all of its sub-expressions: evaluating it calls
+# no builtins and only pure functions, so nobody could tell where (or whether) it ran.
+def annotate_effect_free(expression_node, pure):
+    free = True
+    for child in sub_expressions(expression_node):
+        free = annotate_effect_free(child, pure) and free
+    if expression_node.elem_type == InterpreterBase.FCALL_NODE:
+        key = (expression_node.dict['name'], len(expression_node.dict['args']))
+        free = free and key[0] not in BUILTIN_FUNCS and pure.get(key, False)
+    expression_node.effect_free = free
+    return free
+
+
+def walk_statements(statements):
+    for statement in statements:
+        yield statement
+        for block in statement_blocks(statement):
+            yield from walk_statements(block)
+
+
+def walk_expressions(statements):
+    for statement in walk_statements(statements):
+        for expression in statement_expressions(statement):
+            yield from walk_expression(expression)
+
+
+def walk_expression(expression_node):
+    yield expression_node
+    for child in sub_expressions(expression_node):
+        yield from walk_expression(child)
@@ -0,0 +1,517 @@
+# Micro-benchmarks for the lazy interpreter.
+# Usage: python bench_v4.py [name ...]   (no names runs everything)
+
+import copy
+import resource
+import sys
+import time
+import timeit
+
+import analysis_v4
+import bytecode_v4
+import transpile_v4
+from brewparse import parse_program
+from env_v4 import Frames
+from interpreterv4 import Interpreter, nil
+from element import Element
+from intbase import ErrorType
+
+
+# Cost of capturing the environment for one Thunk, as the scope stack gets deeper.
+# "deepcopy" is what Thunk.__init__ used to do (copy every scope dict), "capture" is what it does
+# now: read the expression's free variables (here one from the outermost and one from the
+# innermost block) straight out of their frames into a tuple.
+def bench_capture(depths=(1, 2, 4, 8, 16, 32), vars_per_scope=4, number=50):
+    expr = Element("+")
+    print(f"{'depth':>6} {'deepcopy (us)':>14} {'capture (us)':>14}")
+    for depth in depths:
+        env = Frames()
+        old_env = []
+        for d in range(depth):
+            names = tuple(f"v{d}_{v}" for v in range(vars_per_scope))
+            env.push_block(names)
+            old_env.append({})
+            for v, name in enumerate(names):
+                env.frames[-1][v] = v
+                old_env[-1][name] = v
+        expr.free_addresses = (((1, 0),), ((depth, vars_per_scope - 1),))
+
+        def deepcopy_capture():
+            return [copy.deepcopy(scope) for scope in old_env]
+
+        def frames_capture():
+            return env.capture(expr)
+
+        old = timeit.timeit(deepcopy_capture, number=number) / number * 1e6
+        new = timeit.timeit(frames_capture, number=number) / number * 1e6
+        print(f"{depth:>6} {old:>14.1f} {new:>14.1f}")
+
+
+# Variable access inside nested blocks: a loop at nesting depth d reading a variable declared in
+# the function body. With lexical addressing this should cost the same at any depth.
+def bench_lookup(depths=(1, 4, 16, 64), iterations=20000):
+    for depth in depths:
+        program = "func main() {\n var x; var s; var i; x = 1; s = 0;\n"
+        program += "if (true) { var pad; " * depth
+        program += f"for (i = 0; i < {iterations}; i = i + 1) {{ s = s + x; }}"
+        program += " }" * depth
+        program += "\n print(s);\n}"
+        interpreter = Interpreter(console_output=False)
+        start = time.perf_counter()
+        interpreter.run(program)
+        elapsed = time.perf_counter() - start
+        print(f"depth {depth:>3}: {elapsed / iterations * 1e6:.2f} us per iteration -> {interpreter.get_output()}")
+
+
+# Per-iteration cost of a loop whose body (and an if inside it) declares nothing, with and without
+# scope-push elision. "always push" makes analysis_v4 treat every block as declaring something,
+# which is what the interpreter did before.
+def bench_elide(iterations=100000):
+    program = f"""
+func main() {{
+  var s; var i;
+  s = 0;
+  for (i = 0; i < {iterations}; i = i + 1) {{ if (i > 0) {{ s = s + 1; }} }}
+  print(s);
+}}
+"""
+    declares_vars = analysis_v4.declares_vars
+    for label, patch in (("always push", lambda statements: True), ("elided", declares_vars)):
+        analysis_v4.declares_vars = patch
+        try:
+            interpreter = Interpreter(console_output=False)
+            start = time.perf_counter()
+            interpreter.run(program)
+            elapsed = time.perf_counter() - start
+        finally:
+            analysis_v4.declares_vars = declares_vars
+        print(f"{label:>12}: {elapsed / iterations * 1e6:.2f} us per iteration -> {interpreter.get_output()}")
+
+
+# Call-heavy recursion with and without the frame pool: time, and frames/Frames objects that had
+# to be allocated per call (the rest were recycled).
+def bench_pool(n=20):
+    program = f"""
+func fib(n) {{ var a; var b; if (n < 2) {{ return n; }} a = fib(n - 1); b = fib(n - 2); return a + b; }}
+func main() {{ print(fib({n})); }}
+"""
+    for pool_frames in (False, True):
+        interpreter = Interpreter(console_output=False, pool_frames=pool_frames)
+        start = time.perf_counter()
+        interpreter.run(program)
+        elapsed = time.perf_counter() - start
+        report = interpreter.frame_report()
+        print(f"pool_frames={pool_frames!s:>5}: {elapsed:.2f}s, {report['calls']} calls, "
+              f"{report['allocations_per_call']:.3f} allocations per call -> {interpreter.get_output()}")
+
+
+# The two environment engines on a deeply nested program (a loop reading a variable from 64
+# blocks out) and a deeply recursive one.
+def bench_engines(depth=64, iterations=20000, n=20):
+    nested = "func main() {\n var x; var s; var i; x = 1; s = 0;\n"
+    nested += "if (true) { var pad; " * depth
+    nested += f"for (i = 0; i < {iterations}; i = i + 1) {{ s = s + x; }}"
+    nested += " }" * depth
+    nested += "\n print(s);\n}"
+    recursive = f"""
+func fib(n) {{ var a; var b; if (n < 2) {{ return n; }} a = fib(n - 1); b = fib(n - 2); return a + b; }}
+func main() {{ print(fib({n})); }}
+"""
+    for name, program in (("nested", nested), ("recursive", recursive)):
+        for environment in ("frames", "shallow"):
+            interpreter = Interpreter(console_output=False, environment=environment)
+            start = time.perf_counter()
+            interpreter.run(program)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10} {environment:>8}: {elapsed:.2f}s -> {interpreter.get_output()}")
+
+
+# How deep plain recursion gets before the stack runs out, with and without deep_recursion,
+# and how long the deepest run that fit took.
+def bench_deep(depths=(100, 1000, 10000, 100000)):
+    program = """
+func down(n) {{ if (n == 0) {{ return 0; }} return 1 + down(n - 1); }}
+func main() {{ print(down({n})); }}
+"""
+    for deep_recursion in (False, True):
+        for n in depths:
+            interpreter = Interpreter(console_output=False, deep_recursion=deep_recursion)
+            start = time.perf_counter()
+            try:
+                interpreter.run(program.format(n=n))
+                status = interpreter.get_output()
+            except Exception as e:
+                status = str(e)
+            elapsed = time.perf_counter() - start
+            print(f"deep_recursion={deep_recursion!s:>5} n={n:>6}: {elapsed:.2f}s, "
+                  f"max call depth {interpreter.frame_report()['max_call_depth']} -> {status}")
+
+
+# engine="stack" on plain recursion up to 10^6 calls deep, next to the tree walker (which needs
+# deep_recursion for anything past ~140). Memory is the process's peak RSS so far.
+def bench_stack(depths=(10000, 100000, 1000000)):
+    program = """
+func down(n) {{ if (n == 0) {{ return 0; }} return 1 + down(n - 1); }}
+func main() {{ print(down({n})); }}
+"""
+    for engine in ("tree", "stack"):
+        for n in depths:
+            if engine == "tree" and n > 100000:
+                continue # past what DEEP_STACK_SIZE allows
+            interpreter = Interpreter(console_output=False, engine=engine, deep_recursion=engine == "tree")
+            start = time.perf_counter()
+            interpreter.run(program.format(n=n))
+            elapsed = time.perf_counter() - start
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+            print(f"{engine:>5} n={n:>7}: {elapsed:.2f}s, max call depth {interpreter.frame_report()['max_call_depth']}, "
+                  f"peak {peak} MB -> {interpreter.get_output()}")
+
+
+# An accumulator loop written as tail recursion, with and without tail calls. "no tail calls" makes
+# analysis_v4 mark no return as a tail call (and needs deep_recursion to get anywhere).
+def bench_tail(depths=(10000, 100000, 1000000)):
+    program = """
+func sum(n, acc) {{ if (n == 0) {{ return acc; }} return sum(n - 1, acc + n); }}
+func main() {{ print(sum({n}, 0)); }}
+"""
+    annotate_tail_call = analysis_v4.annotate_tail_call
+    for label, patch in (("no tail calls", lambda return_node: setattr(return_node, "tail_call", False)),
+                         ("tail calls", annotate_tail_call)):
+        analysis_v4.annotate_tail_call = patch
+        try:
+            for n in depths:
+                if patch is not annotate_tail_call and n > 100000:
+                    continue # past what DEEP_STACK_SIZE allows
+                interpreter = Interpreter(console_output=False, deep_recursion=True)
+                start = time.perf_counter()
+                interpreter.run(program.format(n=n))
+                elapsed = time.perf_counter() - start
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+                print(f"{label:>13} n={n:>7}: {elapsed:.2f}s, max call depth {interpreter.frame_report()['max_call_depth']}, "
+                      f"peak {peak} MB -> {interpreter.get_output()}")
+        finally:
+            analysis_v4.annotate_tail_call = annotate_tail_call
+
+
+# Per-node dispatch cost: evaluate_expression/run_statement and the operator helpers (handler
+# tables) next to the if/elif chains they replaced, copied below as old_*. Every node is one its
+# handler finishes right away (a variable already holding a value, arithmetic on those), so most of
+# what's measured is getting to the handler.
+def old_evaluate_expression(interpreter, expression_node, env):
+    elem = expression_node.elem_type
+    if elem in ["int", "string", "bool", "nil"]:
+        return interpreter.get_value(expression_node)
+    elif elem == "var":
+        return interpreter.get_value_of_variable(expression_node,env)
+    elif elem in ["+", "-", "*", "/"]:
+        return interpreter.evaluate_binary_operator(expression_node,env)
+    elif elem in ["neg", "!"]:
+        return interpreter.evaluate_unary_operator(expression_node,env)
+    elif elem in ['==', '<', '<=', '>', '>=', '!=']:
+        return interpreter.evaluate_comparison_operator(expression_node, env)
+    elif elem in ['&&', '||']:
+        return interpreter.evaluate_binary_boolean_operator(expression_node, env)
+    elif elem == "fcall":
+        return interpreter.do_func_call(expression_node, env)
+
+def old_run_statement(interpreter, statement_node, env):
+    elem = statement_node.elem_type
+    if elem == "vardef":
+        interpreter.do_definition(statement_node, env)
+    elif elem == "=":
+        interpreter.do_assignment(statement_node,env)
+    elif elem == "fcall":
+        return interpreter.do_func_call(statement_node, env)
+    elif elem == "return":
+        return interpreter.do_return_statement(statement_node, env)
+    elif elem == "if":
+        return interpreter.do_if_statement(statement_node, env)
+    elif elem == "for":
+        return interpreter.do_for_loop(statement_node, env)
+    elif elem == "raise":
+        return interpreter.do_raise_statement(statement_node, env)
+    elif elem == "try":
+        return interpreter.do_try_block(statement_node,env)
+    return nil
+
+def old_apply_binary_operator(interpreter, op, eval1, eval2):
+    if (op != "+") and not (type(eval1) == int and type(eval2) == int):
+        interpreter.error(ErrorType.TYPE_ERROR, "Arguments must be of type 'int'.",)
+    if (op == "+") and not ((type(eval1) == int and type(eval2) == int) or (type(eval1) == str and type(eval2) == str)):
+        interpreter.error(ErrorType.TYPE_ERROR, "Types for + must be both of type int or string.",)
+    if op == "+":
+        return (eval1 + eval2)
+    elif op == "-":
+        return (eval1 - eval2)
+    elif op == "*":
+        return (eval1 * eval2)
+    elif op == "/":
+        if eval2 == 0:
+            return("div0", "error")
+        return (eval1 // eval2)
+
+def old_apply_comparison_operator(interpreter, op, eval1, eval2):
+    if (op not in ["!=", "=="]) and not (type(eval1) == int and type(eval2) == int):
+        interpreter.error(ErrorType.TYPE_ERROR, f"Comparison args for {op} must be of same type int.",)
+    match op:
+        case '<':
+            return (eval1 < eval2)
+        case '<=':
+            return (eval1 <= eval2)
+        case '==':
+            if not (type(eval1) == type(eval2)):
+                return False
+            else:
+                return (eval1 == eval2)
+        case '>=':
+            return (eval1 >= eval2)
+        case '>':
+            return (eval1 > eval2)
+        case '!=':
+            if not (type(eval1) == type(eval2)):
+                return True
+            else:
+                return (eval1 != eval2)
+
+def bench_dispatch(number=100000):
+    program = """
+func main() {
+  var x;
+  x = 1;
+  print(1, "s", nil, x, x + 1, x / 1, -x, x == 1, x >= 1, x != 1, true && false);
+  return x;
+}
+"""
+    ast = parse_program(program)
+    analysis_v4.analyze_program(ast)
+    main = ast.dict['functions'][0]
+    interpreter = Interpreter(console_output=False)
+    env = interpreter.env_engine.base()
+    env.push_block(main.block_names)
+    vardef, assign, print_call, return_statement = main.dict['statements']
+    interpreter.run_statement(vardef, env)
+    interpreter.run_statement(assign, env)
+
+    def per_call(function, *args):
+        return min(timeit.repeat(lambda: function(*args), number=number, repeat=9)) / number * 1e9
+
+    print(f"{'node':>8} {'old (ns)':>9} {'table (ns)':>11}")
+    for node in print_call.dict['args']:
+        old = per_call(old_evaluate_expression, interpreter, node, env)
+        new = per_call(interpreter.evaluate_expression, node, env)
+        print(f"{node.elem_type:>8} {old:>9.0f} {new:>11.0f}")
+    for node in (assign, return_statement):
+        old = per_call(old_run_statement, interpreter, node, env)
+        new = per_call(interpreter.run_statement, node, env)
+        print(f"{node.elem_type:>8} {old:>9.0f} {new:>11.0f}")
+    for op in ("+", "-", "*", "/"):
+        old = per_call(old_apply_binary_operator, interpreter, op, 7, 3)
+        new = per_call(interpreter.apply_binary_operator, op, 7, 3)
+        print(f"{'op ' + op:>8} {old:>9.0f} {new:>11.0f}")
+    for op in ("<", "<=", "==", ">=", ">", "!="):
+        old = per_call(old_apply_comparison_operator, interpreter, op, 7, 3)
+        new = per_call(interpreter.apply_comparison_operator, op, 7, 3)
+        print(f"{'op ' + op:>8} {old:>9.0f} {new:>11.0f}")
+
+
+# Cost of a call as the program defines more functions. Calls are resolved once by
+# analysis_v4.link_program, so this should stay flat; before that every call scanned the function
+# list (twice) for the callee, which is defined last here. The call is an if condition so it runs
+# right away, and a run with no iterations is subtracted to leave out parsing and analysis.
+def bench_link(counts=(10, 100, 1000), iterations=20000):
+    for count in counts:
+        elapsed = []
+        for n in (0, iterations):
+            program = "".join(f"func f{i}(x) {{ return x + {i}; }}\n" for i in range(count))
+            program += f"""
+func main() {{
+  var i;
+  for (i = 0; i < {n}; i = i + 1) {{ if (f{count - 1}(i) < 0) {{ print("negative"); }} }}
+  print(i);
+}}
+"""
+            interpreter = Interpreter(console_output=False)
+            start = time.perf_counter()
+            interpreter.run(program)
+            elapsed.append(time.perf_counter() - start)
+        print(f"{count:>5} functions: {(elapsed[1] - elapsed[0]) / iterations * 1e6:.2f} us per call -> {interpreter.get_output()}")
+
+
+# The tree walker against closure compilation (closure_v4), best of repeat runs each, compiling included.
+def bench_closure(repeat=3):
+    programs = {
+        "fib": """
+func fib(n) { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+func main() { print(fib(20)); }
+""",
+        "loop": """
+func main() { var s; var i; s = 0; for (i = 0; i < 100000; i = i + 1) { if (i - (i / 3) * 3 == 0) { s = s + i; } } print(s); }
+""",
+        "lazy": """
+func pick(a, b, c) { if (a > 0) { return b; } return c; }
+func main() { var s; var i; s = 0; for (i = 0; i < 30000; i = i + 1) { s = s + pick(i + 1, i * 2, i / 0); } print(s); }
+""",
+    }
+    for name, program in programs.items():
+        for engine in ("tree", "closure"):
+            best = None
+            for _ in range(repeat):
+                interpreter = Interpreter(console_output=False, engine=engine)
+                start = time.perf_counter()
+                interpreter.run(program)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:>5} {engine:>7}: {best:.3f}s -> {interpreter.get_output()}")
+
+
+# The bytecode VM (bytecode_v4) next to the tree walker, best of repeat runs each, and how big the
+# compiled program is: instructions and bytes of code, for every function and Thunk expression.
+def bench_bytecode(repeat=3):
+    programs = {
+        "fib": """
+func fib(n) { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+func main() { print(fib(20)); }
+""",
+        "loop": """
+func main() { var s; var i; s = 0; for (i = 0; i < 100000; i = i + 1) { if (i - (i / 3) * 3 == 0) { s = s + i; } } print(s); }
+""",
+        "try": """
+func check(i) { if (i - (i / 7) * 7 == 0) { raise "seven"; } return i; }
+func main() { var s; var i; s = 0; for (i = 0; i < 30000; i = i + 1) { try { if (check(i) >= 0) { s = s + 1; } } catch "seven" { s = s - 1; } } print(s); }
+""",
+    }
+    for name, program in programs.items():
+        for engine in ("tree", "bytecode"):
+            best = None
+            for _ in range(repeat):
+                interpreter = Interpreter(console_output=False, engine=engine)
+                start = time.perf_counter()
+                interpreter.run(program)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{name:>5} {engine:>8}: {best:.3f}s -> {interpreter.get_output()}")
+        ast = parse_program(program)
+        analysis_v4.analyze_program(ast)
+        bytecode_v4.compile_program(ast)
+        listing = bytecode_v4.disassemble_program(ast)
+        instructions = sum(int(line.split(": ")[1].split()[0]) for line in listing.splitlines() if line.startswith("code "))
+        print(f"{name:>5} compiled: {instructions} instructions, {instructions * 3 * 4} bytes of code")
+
+
+# The Python transpiler (transpile_v4) next to the tree walker. "cold" is the first run of a program
+# (parse, analyze, generate and compile()), "cached" the best of the repeat runs after it, which only
+# exec the cached code object. "short" is a program too small for anything but parsing to matter.
+def bench_transpile(repeat=3):
+    programs = {
+        "fib": """
+func fib(n) { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+func main() { print(fib(20)); }
+""",
+        "loop": """
+func main() { var s; var i; s = 0; for (i = 0; i < 100000; i = i + 1) { if (i - (i / 3) * 3 == 0) { s = s + i; } } print(s); }
+""",
+        "short": """
+func main() { var x; x = 2; print(x * 21); }
+""",
+    }
+    transpile_v4.CODE_CACHE.clear()
+    for name, program in programs.items():
+        best = None
+        for _ in range(repeat):
+            interpreter = Interpreter(console_output=False)
+            start = time.perf_counter()
+            interpreter.run(program)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name:>5}   tree: {best * 1000:.2f} ms -> {interpreter.get_output()}")
+        times = []
+        for _ in range(repeat + 1):
+            interpreter = Interpreter(console_output=False, engine="python")
+            start = time.perf_counter()
+            interpreter.run(program)
+            times.append(time.perf_counter() - start)
+        print(f"{name:>5} python: {times[0] * 1000:.2f} ms cold, {min(times[1:]) * 1000:.2f} ms cached -> {interpreter.get_output()}")
+
+
+# Stress test for forcing a long Thunk chain: s starts out unforced (inputi), so every
+# `s = s + i` becomes a Thunk leading with the previous one and print(s) forces all of them at once.
+# This used to hit the recursion limit after a few hundred links.
+def bench_chain(links=1000000):
+    program = f"""
+func main() {{
+  var s; var i;
+  s = inputi();
+  for (i = 0; i < {links}; i = i + 1) {{ s = s + i; }}
+  print(s);
+}}
+"""
+    interpreter = Interpreter(console_output=False, inp=["0"])
+    start = time.perf_counter()
+    interpreter.run(program)
+    elapsed = time.perf_counter() - start
+    expected = str(links * (links - 1) // 2)
+    status = "ok" if interpreter.get_output() == [expected] else f"WRONG {interpreter.get_output()}"
+    print(f"{links} links: {elapsed:.2f}s, recursion limit {sys.getrecursionlimit()} ({status})")
+
+
+# Speculative forcing on recursive workloads: the same program with speculate=0 and speculate=N.
+# Only the Thunks the main process creates get speculated, so the programs bind a few expensive
+# pure calls lazily and only need them at the end. No speedup is possible on a single core.
+def bench_speculate(workers=(0, 2, 4)):
+    programs = {
+        "fib": """
+func fib(n) { if (n < 2) { return n; } return fib(n - 1) + fib(n - 2); }
+func main() {
+  var a; var b; var c; var d;
+  a = fib(18); b = fib(18); c = fib(18); d = fib(18);
+  print(a + b + c + d);
+}
+""",
+        "tree sum": """
+func tree(lo, hi) {
+  var mid; var left; var right;
+  if (lo == hi) { return lo; }
+  mid = (lo + hi) / 2;
+  left = tree(lo, mid);
+  right = tree(mid + 1, hi);
+  return left + right;
+}
+func main() {
+  var x; var y;
+  x = tree(1, 3000); y = tree(3001, 6000);
+  print(x + y);
+}
+""",
+    }
+    for name, program in programs.items():
+        for n in workers:
+            interpreter = Interpreter(console_output=False, speculate=n)
+            start = time.perf_counter()
+            interpreter.run(program)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10} speculate={n}: {elapsed:.2f}s -> {interpreter.get_output()}")
+
+
+BENCHMARKS = {
+    "capture": bench_capture,
+    "lookup": bench_lookup,
+    "elide": bench_elide,
+    "pool": bench_pool,
+    "engines": bench_engines,
+    "deep": bench_deep,
+    "stack": bench_stack,
+    "tail": bench_tail,
+    "dispatch": bench_dispatch,
+    "link": bench_link,
+    "closure": bench_closure,
+    "bytecode": bench_bytecode,
+    "transpile": bench_transpile,
+    "chain": bench_chain,
+    "speculate": bench_speculate,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
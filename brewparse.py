@@ -80,9 +80,18 @@ def p_formal_arg(p):
     """formal_arg : NAME COLON NAME
     | NAME"""
     if len(p) == 2:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = None)
+      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = None, strict = False)
     else:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = p[3])
+      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = p[3], strict = False)
+
+# Bang parameter: !x is evaluated at the call instead of being passed lazily
+def p_formal_arg_strict(p):
+    """formal_arg : NOT NAME COLON NAME
+    | NOT NAME"""
+    if len(p) == 3:
+      p[0] = Element(InterpreterBase.ARG_NODE, name=p[2], var_type = None, strict = True)
+    else:
+      p[0] = Element(InterpreterBase.ARG_NODE, name=p[2], var_type = p[4], strict = True)
 
 def p_statements(p):
     """statements : statements statement
@@ -102,9 +111,18 @@ def p_statement___var(p):
     """statement : VAR variable COLON NAME SEMI
     | VAR variable SEMI"""
     if len(p) == 6:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=p[4])
+      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=p[4], strict=False)
+    else:
+      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=None, strict=False)
+
+# Strict variable: every assignment to var !x is evaluated right away
+def p_statement___var_strict(p):
+    """statement : VAR NOT variable COLON NAME SEMI
+    | VAR NOT variable SEMI"""
+    if len(p) == 7:
+      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[3], var_type=p[5], strict=True)
     else:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=None)
+      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[3], var_type=None, strict=True)
 
 def p_variable(p):
     "variable : NAME"
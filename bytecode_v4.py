@@ -0,0 +1,716 @@
+# Bytecode: Interpreter(engine="bytecode") compiles every func Element, once per run, into a flat
+# instruction stream (CodeObject) and runs it in BytecodeVM, one loop over the instructions of
+# every call in progress instead of a Python call per node. disassemble() prints a CodeObject.
+#
+# An instruction is three ints in code (an array('i')): opcode, a, b. What a and b mean depends on the
+# opcode (see OPCODE_NAMES): a const index, a name index, a slot, or a jump target (an offset into code).
+#   consts: literals, block name tuples, call sites, catcher tables, error messages
+#   names:  the var/vardef/= nodes the instructions read and write (env_v4 addresses variables by node)
+#
+# Errors are values here just like on the tree walker: expressions pass an error tuple along
+# (JUMP_IF_ERROR skips the rest of an expression once it has one), and only statements raise it.
+# A raised error goes to the innermost entry of the code's exception table covering the instruction:
+#   (start, end, handler, depth): a try body; unwind to depth blocks and jump to its CATCH at handler
+#   (start, end, -1, 0): a catch block, where an error is returned from the function like a value
+# and with no entry covering it, it is returned from the function too (run_body's break).
+# Expressions that may end up in a Thunk get a CodeObject of their own (node.code), which
+# Interpreter.evaluate_node runs on a nested VM loop.
+
+from array import array
+
+from intbase import ErrorType
+from element import Element
+from env_v4 import UNDECLARED
+
+# interpreterv4 imports this module, so these are filled in by load_interpreter_names() instead
+nil = None
+Thunk = None
+BINARY_OPERATORS = None
+COMPARISON_OPERATORS = None
+
+def load_interpreter_names():
+    global nil, Thunk, BINARY_OPERATORS, COMPARISON_OPERATORS, INT_OPERATORS
+    from interpreterv4 import nil, Thunk, BINARY_OPERATORS, COMPARISON_OPERATORS
+    INT_OPERATORS = tuple(None if op == "/" else BINARY_OPERATORS.get(op, COMPARISON_OPERATORS.get(op)) for op in OPERATORS)
+
+
+OPCODE_NAMES = (
+    "LOAD_CONST",       # a: const
+    "LOAD_VAR",         # a: name (forces a Thunk and writes the value back, like get_value_of_variable)
+    "BINARY",           # a: OPERATORS index; op1 is below op2, and the first error of the two is the result
+    "COMPARE",          # a: OPERATORS index
+    "UNARY",            # a: OPERATORS index
+    "JUMP",             # a: target
+    "JUMP_IF_ERROR",    # a: target; leaves the value on the stack either way
+    "CHECK_BOOL",       # top of the stack must be a bool (&&, ||)
+    "JUMP_IF_FALSE_OR_POP", # a: target
+    "JUMP_IF_TRUE_OR_POP",  # a: target
+    "CONDITION",        # a: target if false; raises an error, type-checks the rest (if, for)
+    "PUSH_BLOCK",       # a: const (block names)
+    "POP_BLOCK",
+    "DECLARE",          # a: name (a vardef analysis_v4 knows isn't a redefinition)
+    "DEFINE",           # a: name (Interpreter.do_definition)
+    "CHECK_DECLARED",   # a: name (a strict assignment checks before evaluating its source)
+    "STORE_STRICT",     # a: name, b: const (strict owner or None)
+    "STORE_LAZY",       # a: name (Interpreter.lazy_value of the node's expression)
+    "RAISE",
+    "CATCH",            # a: const ({exception: target}), b: 1 if the try pushed a block
+    "STATEMENT_RESULT", # a call statement inside a block: nil goes on, an error is raised, anything else returned
+    "POP_RESULT",       # a call statement in the function body that isn't the last one
+    "POP",              # a call statement whose value nothing looks at (for init/update)
+    "RETURN_VALUE",
+    "NEW_ARGS",         # a: argument count
+    "SET_BANG",         # a: slot, b: target (past the call) if the argument is an error
+    "SET_STRICT",       # a: const ((slot, strict owner)), b: target (the call) if the argument is an error
+    "CALL",             # a: const (CallSite)
+    "TAIL_CALL",        # a: const (CallSite)
+    "PRINT_ARG",        # a: target if the argument is an error
+    "PRINT",
+    "INPUT",            # a: 1 if there is a prompt, b: 1 for inputs
+    "ERROR",            # a: const ((ErrorType, message))
+)
+for opcode, opcode_name in enumerate(OPCODE_NAMES):
+    globals()[opcode_name] = opcode
+
+OPERATORS = ("+", "-", "*", "/", "neg", "!", "==", "!=", "<", "<=", ">", ">=")
+# the operator itself by OPERATORS index, where int op int needs no checks (None: always check)
+INT_OPERATORS = None
+JUMPS = {JUMP, JUMP_IF_ERROR, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, CONDITION}
+
+
+class CodeObject:
+    __slots__ = ("name", "code", "consts", "names", "exceptions", "statement_starts")
+
+    def __init__(self, name):
+        self.name = name
+        self.code = array('i')
+        self.consts = []
+        self.names = []
+        self.exceptions = [] # innermost first
+        self.statement_starts = set() # offsets where a statement begins (snapshot requests are taken there)
+
+
+class CallSite:
+    __slots__ = ("func_def", "args", "param_names", "count")
+
+    def __init__(self, func_def, args):
+        self.func_def = func_def
+        self.args = args
+        self.param_names = func_def.param_names
+        self.count = len(args)
+
+
+# Compiles every function of an analyzed ast (analysis_v4.analyze_program) to func.code
+def compile_program(ast):
+    load_interpreter_names()
+    for func in ast.dict['functions']:
+        func.code = Compiler(f"{func.dict['name']}/{len(func.dict['args'])}").function(func)
+
+
+class Compiler:
+    def __init__(self, name):
+        self.code_object = CodeObject(name)
+        self.code = self.code_object.code
+        self.depth = 0 # blocks pushed at this point of the code
+
+    def emit(self, opcode, a=0, b=0):
+        self.code.extend((opcode, a, b))
+        return len(self.code) - 3
+
+    def here(self):
+        return len(self.code)
+
+    def patch(self, at, target):
+        if self.code[at] in (SET_BANG, SET_STRICT):
+            self.code[at + 2] = target
+        else:
+            self.code[at + 1] = target
+
+    def const(self, value):
+        self.code_object.consts.append(value)
+        return len(self.code_object.consts) - 1
+
+    def name(self, node):
+        self.code_object.names.append(node)
+        return len(self.code_object.names) - 1
+
+    def function(self, func_node):
+        if func_node.block_names is not None:
+            self.emit(PUSH_BLOCK, self.const(func_node.block_names))
+            self.depth += 1
+        statements = func_node.dict['statements']
+        for i, statement in enumerate(statements):
+            self.statement(statement, "last" if i == len(statements) - 1 else "body")
+        self.emit(LOAD_CONST, self.const(nil)) # the body ran off the end without returning
+        self.emit(RETURN_VALUE)
+        return self.code_object
+
+    # A CodeObject that evaluates expression_node and returns it, for when it is in a Thunk
+    def thunk(self, expression_node):
+        if not hasattr(expression_node, "code"):
+            compiler = Compiler(getattr(expression_node, "site_label", expression_node.elem_type))
+            compiler.expression(expression_node)
+            compiler.emit(RETURN_VALUE)
+            expression_node.code = compiler.code_object
+
+    def block(self, statements, names):
+        if names is not None:
+            self.emit(PUSH_BLOCK, self.const(names))
+            self.depth += 1
+        for statement in statements:
+            self.statement(statement, "block")
+        if names is not None:
+            self.emit(POP_BLOCK)
+            self.depth -= 1
+
+    ## STATEMENTS ##
+
+    # context is where a call statement's value goes: "body" (function body), "last" (the last
+    # statement of one, whose value the function returns), "block" (if/for/try) or "discard" (for init/update)
+    def statement(self, statement_node, context):
+        self.code_object.statement_starts.add(self.here())
+        elem_type = statement_node.elem_type
+        if elem_type == "vardef":
+            self.emit(DEFINE if statement_node.redefinition is not False else DECLARE, self.name(statement_node))
+        elif elem_type == "=":
+            source_node = statement_node.dict['expression']
+            if statement_node.strict:
+                name = self.name(statement_node)
+                self.emit(CHECK_DECLARED, name)
+                self.expression(source_node)
+                if statement_node.declared_strict:
+                    # an error assigned to a `var !x` is raised, like a bang argument's error
+                    to_raise = self.emit(JUMP_IF_ERROR)
+                    self.emit(STORE_STRICT, name, self.const(None))
+                    to_end = self.emit(JUMP)
+                    self.patch(to_raise, self.here())
+                    self.emit(RAISE)
+                    self.patch(to_end, self.here())
+                else:
+                    self.emit(STORE_STRICT, name, self.const(statement_node.strict_owner))
+            else:
+                self.thunk(source_node)
+                self.emit(STORE_LAZY, self.name(statement_node))
+        elif elem_type == "fcall":
+            self.call(statement_node)
+            self.emit({"body": POP_RESULT, "last": RETURN_VALUE, "block": STATEMENT_RESULT, "discard": POP}[context])
+        elif elem_type == "return":
+            self.return_statement(statement_node)
+        elif elem_type == "if":
+            self.if_statement(statement_node)
+        elif elem_type == "for":
+            self.for_loop(statement_node)
+        elif elem_type == "raise":
+            self.expression(statement_node.dict['exception_type'])
+            self.emit(RAISE)
+        elif elem_type == "try":
+            self.try_block(statement_node)
+        # anything else is a bare expression statement, which is never evaluated
+
+    def return_statement(self, statement_node):
+        expression_node = statement_node.dict['expression']
+        if not expression_node:
+            self.emit(LOAD_CONST, self.const(nil))
+            self.emit(RETURN_VALUE)
+        elif statement_node.tail_call:
+            self.call(expression_node, tail=True)
+            self.emit(RETURN_VALUE) # only reached if a bang argument was an error
+        else:
+            self.expression(expression_node)
+            self.emit(RETURN_VALUE)
+
+    def if_statement(self, statement_node):
+        self.expression(statement_node.dict['condition'])
+        to_else = self.emit(CONDITION)
+        self.block(statement_node.dict['statements'], statement_node.block_names)
+        if statement_node.dict['else_statements'] is None:
+            self.patch(to_else, self.here())
+            return
+        to_end = self.emit(JUMP)
+        self.patch(to_else, self.here())
+        self.block(statement_node.dict['else_statements'], statement_node.else_block_names)
+        self.patch(to_end, self.here())
+
+    def for_loop(self, statement_node):
+        self.statement(statement_node.dict['init'], "discard")
+        start = self.here()
+        self.expression(statement_node.dict['condition'])
+        to_end = self.emit(CONDITION)
+        self.block(statement_node.dict['statements'], statement_node.block_names)
+        self.statement(statement_node.dict['update'], "discard")
+        self.emit(JUMP, start)
+        self.patch(to_end, self.here())
+
+    def try_block(self, statement_node):
+        names = statement_node.block_names
+        if names is not None:
+            self.emit(PUSH_BLOCK, self.const(names))
+            self.depth += 1
+        start = self.here()
+        for statement in statement_node.dict['statements']:
+            self.statement(statement, "block")
+        end = self.here()
+        if names is not None:
+            self.emit(POP_BLOCK)
+        to_end = [self.emit(JUMP)]
+        handler = self.here()
+        catchers = {} # exception -> target; the first catcher for it wins
+        self.emit(CATCH, self.const(catchers), 1 if names is not None else 0)
+        self.code_object.exceptions.append((start, end, handler, self.depth))
+        for catcher in statement_node.dict['catchers']:
+            if catcher.dict['exception_type'] in catchers:
+                continue
+            catchers[catcher.dict['exception_type']] = self.here()
+            catch_start = self.here()
+            for statement in catcher.dict['statements']:
+                self.statement(statement, "block")
+            self.code_object.exceptions.append((catch_start, self.here(), -1, 0))
+            if names is not None:
+                self.emit(POP_BLOCK)
+            to_end.append(self.emit(JUMP))
+        if names is not None:
+            self.depth -= 1
+        for at in to_end:
+            self.patch(at, self.here())
+
+    ## EXPRESSIONS ##
+
+    def expression(self, expression_node):
+        elem_type = expression_node.elem_type
+        if elem_type in ("int", "string", "bool"):
+            self.emit(LOAD_CONST, self.const(expression_node.dict['val']))
+        elif elem_type == "nil":
+            self.emit(LOAD_CONST, self.const(nil))
+        elif elem_type == "var":
+            self.emit(LOAD_VAR, self.name(expression_node))
+        elif elem_type in ("+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">="):
+            op1, op2 = expression_node.dict['op1'], expression_node.dict['op2']
+            self.expression(op1)
+            # op2 mustn't run after an error in op1, unless it can't do anything (a literal), or op1
+            # can't be an error (also a literal); then the operator itself picks the error
+            skip = self.emit(JUMP_IF_ERROR) if op1.cheap != "literal" and op2.cheap != "literal" else None
+            self.expression(op2)
+            self.emit(BINARY if elem_type in ("+", "-", "*", "/") else COMPARE, OPERATORS.index(elem_type))
+            if skip is not None:
+                self.patch(skip, self.here())
+        elif elem_type in ("neg", "!"):
+            self.expression(expression_node.dict['op1'])
+            self.emit(UNARY, OPERATORS.index(elem_type))
+        elif elem_type in ("&&", "||"):
+            self.expression(expression_node.dict['op1'])
+            skips = [self.emit(JUMP_IF_ERROR)]
+            self.emit(CHECK_BOOL)
+            skips.append(self.emit(JUMP_IF_FALSE_OR_POP if elem_type == "&&" else JUMP_IF_TRUE_OR_POP))
+            self.expression(expression_node.dict['op2'])
+            skips.append(self.emit(JUMP_IF_ERROR))
+            self.emit(CHECK_BOOL)
+            for at in skips:
+                self.patch(at, self.here())
+        elif elem_type == "fcall":
+            self.call(expression_node)
+        else:
+            self.emit(LOAD_CONST, self.const(None)) # new (structs aren't part of this version)
+
+    # Leaves the call's value on the stack (with tail=True, the function ends at TAIL_CALL instead)
+    def call(self, expression_node, tail=False):
+        name = expression_node.dict['name']
+        args = expression_node.dict['args']
+        if name == "print":
+            self.emit(LOAD_CONST, self.const(""))
+            skips = []
+            for arg in args:
+                self.expression(arg)
+                skips.append(self.emit(PRINT_ARG))
+            self.emit(PRINT)
+            for at in skips:
+                self.patch(at, self.here())
+            return
+        elif name == "inputi" or name == "inputs":
+            if len(args) > 1:
+                self.emit(ERROR, self.const((ErrorType.NAME_ERROR, f"No {name}() function found that takes > 1 parameter")))
+                return
+            if args:
+                self.expression(args[0])
+            self.emit(INPUT, 1 if args else 0, 1 if name == "inputs" else 0)
+            return
+        func_def = expression_node.target
+        if func_def is None:
+            self.emit(ERROR, self.const(expression_node.link_error))
+            return
+        # the same order as Interpreter.bind_call: bang arguments, strict ones, then the rest lazily
+        self.emit(NEW_ARGS, len(args))
+        failed = []
+        bang = set()
+        for param_name, i in func_def.bang_params:
+            self.expression(args[i])
+            failed.append(self.emit(SET_BANG, i))
+            bang.add(i)
+        to_call = []
+        for param_name, i in func_def.strict_params:
+            if i in bang:
+                continue
+            self.expression(args[i])
+            to_call.append(self.emit(SET_STRICT, self.const((i, func_def.strict_owner))))
+        for at in to_call:
+            self.patch(at, self.here())
+        for arg in args:
+            self.thunk(arg)
+        self.emit(TAIL_CALL if tail else CALL, self.const(CallSite(func_def, args)))
+        for at in failed:
+            self.patch(at, self.here())
+
+
+class Frame:
+    __slots__ = ("code_object", "func_node", "env", "call_env", "tail_env", "stack", "pc", "blocks")
+
+    def __init__(self, code_object, func_node, env, call_env):
+        self.code_object = code_object
+        self.func_node = func_node # None for a Thunk's expression
+        self.env = env
+        self.call_env = call_env # released when the call returns (None for main and Thunks)
+        self.tail_env = False # env came from a tail call, and is released when it's done too
+        self.stack = []
+        self.pc = 0
+        self.blocks = 0
+
+
+class BytecodeVM:
+    def __init__(self, interpreter):
+        load_interpreter_names()
+        self.interpreter = interpreter
+        self.max_frames = 0 # most VM frames one execute() loop had at once
+
+    def run_func(self, func_node, env):
+        return self.execute(Frame(func_node.code, func_node, env, None))
+
+    def evaluate(self, expression_node, env):
+        return self.execute(Frame(expression_node.code, None, env, None))
+
+    def enter(self, func_node, env):
+        interpreter = self.interpreter
+        interpreter.active_frames.append((func_node, env))
+        if len(interpreter.active_frames) > interpreter.max_call_depth:
+            interpreter.max_call_depth = len(interpreter.active_frames)
+
+    def execute(self, frame):
+        interpreter = self.interpreter
+        engine = interpreter.env_engine
+        active_frames = interpreter.active_frames
+        requests = interpreter.snapshot_requests
+        lazy_value = interpreter.lazy_value
+        apply_binary_operator = interpreter.apply_binary_operator
+        apply_comparison_operator = interpreter.apply_comparison_operator
+        if frame.func_node is not None:
+            self.enter(frame.func_node, frame.env)
+        frames = [frame]
+        code_object = frame.code_object
+        code, consts, names = code_object.code, code_object.consts, code_object.names
+        stack, env, pc = frame.stack, frame.env, 0
+        while True:
+            if requests and pc in code_object.statement_starts:
+                interpreter.take_requested_snapshots()
+            op = code[pc]
+            a = code[pc + 1]
+            pc += 3
+            if op == LOAD_VAR:
+                node = names[a]
+                val = env.read(node)
+                if val is UNDECLARED:
+                    interpreter.error(ErrorType.NAME_ERROR, f"variable '{node.dict['name']}' used and not declared",)
+                if val is None:
+                    interpreter.error(ErrorType.NAME_ERROR, f"variable '{node.dict['name']}' declared but not defined",)
+                if isinstance(val, Thunk):
+                    val = val.value()
+                    env.write(node, val) # later reads skip the Thunk
+                stack.append(val)
+                continue
+            elif op == LOAD_CONST:
+                stack.append(consts[a])
+                continue
+            elif op == BINARY or op == COMPARE:
+                eval2 = stack.pop()
+                eval1 = stack[-1]
+                if type(eval1) is int and type(eval2) is int and INT_OPERATORS[a] is not None:
+                    stack[-1] = INT_OPERATORS[a](eval1, eval2)
+                elif type(eval1) is tuple and eval1[1] == "error":
+                    pass
+                elif type(eval2) is tuple and eval2[1] == "error":
+                    stack[-1] = eval2
+                elif op == BINARY:
+                    stack[-1] = apply_binary_operator(OPERATORS[a], eval1, eval2)
+                else:
+                    stack[-1] = apply_comparison_operator(OPERATORS[a], eval1, eval2)
+                continue
+            elif op == JUMP_IF_ERROR:
+                val = stack[-1]
+                if type(val) is tuple and val[1] == "error":
+                    pc = a
+                continue
+            elif op == CONDITION:
+                cond = stack.pop()
+                if isinstance(cond, Thunk):
+                    cond = cond.value()
+                if type(cond) is tuple and cond[1] == "error":
+                    value, returning = cond, False
+                elif type(cond) is not bool:
+                    interpreter.error(ErrorType.TYPE_ERROR, "Condition is not of type bool",)
+                else:
+                    if not cond:
+                        pc = a
+                    continue
+            elif op == JUMP:
+                pc = a
+                continue
+            elif op == STORE_LAZY:
+                node = names[a]
+                if not env.write(node, lazy_value(node.dict['expression'], env)):
+                    interpreter.error(ErrorType.NAME_ERROR, f"variable used and not declared: {node.dict['name']}",)
+                continue
+            elif op == CHECK_DECLARED:
+                if env.read(names[a]) is UNDECLARED:
+                    interpreter.error(ErrorType.NAME_ERROR, f"variable used and not declared: {names[a].dict['name']}",)
+                continue
+            elif op == STORE_STRICT:
+                env.write(names[a], stack.pop())
+                owner = consts[code[pc - 1]]
+                if owner is not None:
+                    interpreter.count_avoided_thunk(owner)
+                continue
+            elif op == PUSH_BLOCK:
+                env.push_block(consts[a])
+                frame.blocks += 1
+                continue
+            elif op == POP_BLOCK:
+                env.pop_block()
+                frame.blocks -= 1
+                continue
+            elif op == DECLARE:
+                env.declare(names[a])
+                continue
+            elif op == DEFINE:
+                interpreter.do_definition(names[a], env)
+                continue
+            elif op == NEW_ARGS:
+                stack.append(engine.frame(a))
+                continue
+            elif op == SET_BANG:
+                arg_value = stack.pop()
+                if type(arg_value) is tuple and arg_value[1] == "error":
+                    engine.release(stack[-1])
+                    stack[-1] = arg_value # what the call gives
+                    pc = code[pc - 1]
+                else:
+                    stack[-1][a] = arg_value
+                continue
+            elif op == SET_STRICT:
+                arg_value = stack.pop()
+                slot, owner = consts[a]
+                stack[-1][slot] = arg_value
+                interpreter.count_avoided_thunk(owner)
+                if type(arg_value) is tuple and arg_value[1] == "error":
+                    pc = code[pc - 1] # the rest are bound lazily
+                continue
+            elif op == CALL or op == TAIL_CALL:
+                site = consts[a]
+                processed_args = stack.pop()
+                for i in range(site.count):
+                    if processed_args[i] is UNDECLARED:
+                        processed_args[i] = lazy_value(site.args[i], env)
+                call_env = engine.call_frames(processed_args, site.param_names)
+                if op == CALL:
+                    frame.pc = pc
+                    frame = Frame(site.func_def.code, site.func_def, call_env, call_env)
+                    frames.append(frame)
+                    if len(frames) > self.max_frames:
+                        self.max_frames = len(frames)
+                else:
+                    # this body is done, as if it had returned: the next one runs in the same frame
+                    while frame.blocks:
+                        env.pop_block()
+                        frame.blocks -= 1
+                    active_frames.pop()
+                    if frame.tail_env:
+                        engine.release_call(env)
+                    frame.code_object = site.func_def.code
+                    frame.func_node = site.func_def
+                    frame.env = call_env
+                    frame.tail_env = True
+                self.enter(site.func_def, call_env)
+                code_object = frame.code_object
+                code, consts, names = code_object.code, code_object.consts, code_object.names
+                stack, env, pc = frame.stack, call_env, 0
+                continue
+            elif op == RETURN_VALUE:
+                value, returning = stack.pop(), True
+            elif op == STATEMENT_RESULT:
+                value = stack.pop()
+                if value is nil:
+                    continue
+                returning = not (type(value) is tuple and value[1] == "error")
+            elif op == POP_RESULT:
+                value = stack.pop()
+                if not (type(value) is tuple and value[1] == "error"):
+                    continue
+                returning = False
+            elif op == POP:
+                stack.pop()
+                continue
+            elif op == CHECK_BOOL:
+                interpreter.check_boolean_operand(stack[-1])
+                continue
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1] is False:
+                    pc = a
+                else:
+                    stack.pop()
+                continue
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1] is True:
+                    pc = a
+                else:
+                    stack.pop()
+                continue
+            elif op == UNARY:
+                val = stack[-1]
+                if not (type(val) is tuple and val[1] == "error"):
+                    stack[-1] = interpreter.apply_unary_operator(OPERATORS[a], val)
+                continue
+            elif op == RAISE:
+                exception = stack.pop()
+                if not (type(exception) is tuple and exception[1] == "error"):
+                    if not isinstance(exception, str):
+                        interpreter.error(ErrorType.TYPE_ERROR, f"Exception '{exception}' does not evaluate to a string.",)
+                    exception = (exception, "error")
+                value, returning = exception, False
+            elif op == CATCH:
+                value = stack.pop()
+                target = consts[a].get(value[0])
+                if target is not None:
+                    pc = target # the catcher runs in the try's scope
+                    continue
+                if code[pc - 1]:
+                    env.pop_block()
+                    frame.blocks -= 1
+                returning = False # not caught here: on to an enclosing try
+            elif op == PRINT_ARG:
+                val = stack.pop()
+                if isinstance(val, Thunk):
+                    val = val.value()
+                if type(val) is tuple and val[1] == "error":
+                    stack[-1] = val
+                    pc = a
+                elif type(val) is bool:
+                    stack[-1] += "true" if val else "false"
+                else:
+                    stack[-1] += str(val)
+                continue
+            elif op == PRINT:
+                interpreter.output(stack[-1])
+                stack[-1] = nil
+                continue
+            elif op == INPUT:
+                if a:
+                    prompt = stack.pop()
+                    if isinstance(prompt, Thunk):
+                        prompt = prompt.value()
+                    if type(prompt) is tuple and prompt[1] == "error":
+                        stack.append(prompt)
+                        continue
+                    interpreter.output(prompt)
+                user_in = interpreter.get_input()
+                try:
+                    stack.append(str(user_in) if code[pc - 1] else int(user_in))
+                except:
+                    stack.append(user_in)
+                continue
+            elif op == ERROR:
+                interpreter.error(*consts[a])
+
+            # Only raising and returning get here. value is raised as a Brewin error (returning=False)
+            # or returned from the frame; an error nothing catches is returned too.
+            if not returning:
+                at = pc - 3
+                for start, end, handler, depth in code_object.exceptions:
+                    if start <= at < end:
+                        break
+                else:
+                    handler = -1
+                if handler >= 0:
+                    while frame.blocks > depth:
+                        env.pop_block()
+                        frame.blocks -= 1
+                    stack.clear()
+                    stack.append(value)
+                    pc = handler
+                    continue
+            while frame.blocks:
+                env.pop_block()
+                frame.blocks -= 1
+            if frame.func_node is not None:
+                active_frames.pop()
+            if frame.tail_env:
+                engine.release_call(env)
+            if frame.call_env is not None:
+                engine.release_call(frame.call_env)
+            frames.pop()
+            if not frames:
+                return value
+            frame = frames[-1]
+            code_object = frame.code_object
+            code, consts, names = code_object.code, code_object.consts, code_object.names
+            stack, env, pc = frame.stack, frame.env, frame.pc
+            stack.append(value)
+
+
+# A listing of code_object: one instruction per line (offset, opcode, a, b and what they refer to),
+# statement starts marked with ">", then the exception table
+def disassemble(code_object):
+    code = code_object.code
+    lines = [f"code {code_object.name}: {len(code) // 3} instructions, {len(code_object.consts)} consts, "
+             f"{len(code_object.names)} names"]
+    for pc in range(0, len(code), 3):
+        op, a, b = code[pc], code[pc + 1], code[pc + 2]
+        note = ""
+        if op in (LOAD_VAR, DECLARE, DEFINE, CHECK_DECLARED, STORE_STRICT, STORE_LAZY):
+            note = code_object.names[a].dict['name']
+        elif op in (LOAD_CONST, PUSH_BLOCK, SET_STRICT, ERROR, CATCH):
+            note = describe(code_object.consts[a])
+        elif op in (CALL, TAIL_CALL):
+            site = code_object.consts[a]
+            note = f"{site.func_def.dict['name']}/{site.count}"
+        elif op in (BINARY, COMPARE, UNARY):
+            note = OPERATORS[a]
+        elif op in JUMPS or op == PRINT_ARG:
+            note = f"to {a}"
+        if op in (SET_BANG, SET_STRICT):
+            note = (note + " " if note else "") + f"to {b} on error"
+        marker = ">" if pc in code_object.statement_starts else " "
+        lines.append(f"{marker}{pc:>5}  {OPCODE_NAMES[op]:<20} {a:>4} {b:>4}  {note}".rstrip())
+    for start, end, handler, depth in code_object.exceptions:
+        if handler >= 0:
+            lines.append(f"  try   {start}-{end} -> {handler}, unwinding to {depth} blocks")
+        else:
+            lines.append(f"  catch {start}-{end} -> returned")
+    return "\n".join(lines)
+
+def describe(const):
+    if const is nil:
+        return "nil"
+    if isinstance(const, Element):
+        return const.elem_type
+    return repr(const)
+
+
+# The listing of every function in a compiled ast, each followed by the Thunk code it uses
+def disassemble_program(ast):
+    listings = []
+    for func in ast.dict['functions']:
+        pending = [func.code]
+        while pending:
+            code_object = pending.pop(0)
+            listings.append(disassemble(code_object))
+            for const in code_object.consts:
+                if isinstance(const, CallSite):
+                    pending.extend(arg.code for arg in const.args)
+            pending.extend(node.dict['expression'].code for node in code_object.names if node.elem_type == "=" and not node.strict)
+    return "\n\n".join(listings)
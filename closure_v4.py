@@ -0,0 +1,530 @@
+# Closure compilation: Interpreter(engine="closure") turns every func Element, once per run, into
+# nested Python closures, one per node, with its children and operands already bound. Running the
+# program is then just calling closures; nothing looks at elem_type or node.dict anymore.
+#
+# Each compile_* mirrors the tree walker's method for that node in interpreterv4 and shares its
+# helpers (lazy_value, apply_*_operator, do_definition, the error messages), so both engines behave
+# the same. A statement closure returns what run_statement would (nil, a "return" Element, an error
+# tuple or a call's value) and an expression closure what evaluate_expression would.
+# Expression closures are also kept on their node as .closure, which is how Thunks made on this
+# engine get evaluated (Interpreter.evaluate_node).
+
+from intbase import ErrorType
+from element import Element
+from env_v4 import UNDECLARED
+
+# interpreterv4 imports this module, so these are filled in by ClosureCompiler() instead
+nil = None
+Thunk = None
+BoundCall = None
+BINARY_OPERATORS = None
+COMPARISON_OPERATORS = None
+
+
+class ClosureCompiler:
+    def __init__(self, interpreter):
+        global nil, Thunk, BoundCall, BINARY_OPERATORS, COMPARISON_OPERATORS
+        from interpreterv4 import nil, Thunk, BoundCall, BINARY_OPERATORS, COMPARISON_OPERATORS
+        self.interpreter = interpreter
+        self.statement_compilers = {
+            "vardef": self.compile_definition,
+            "=": self.compile_assignment,
+            "fcall": self.compile_func_call,
+            "return": self.compile_return_statement,
+            "if": self.compile_if_statement,
+            "for": self.compile_for_loop,
+            "raise": self.compile_raise_statement,
+            "try": self.compile_try_block,
+        }
+        self.expression_compilers = {
+            "int": self.compile_literal, "string": self.compile_literal, "bool": self.compile_literal,
+            "nil": self.compile_literal,
+            "var": self.compile_variable,
+            "+": self.compile_binary_operator, "-": self.compile_binary_operator,
+            "*": self.compile_binary_operator, "/": self.compile_binary_operator,
+            "neg": self.compile_unary_operator, "!": self.compile_unary_operator,
+            "==": self.compile_comparison_operator, "<": self.compile_comparison_operator,
+            "<=": self.compile_comparison_operator, ">": self.compile_comparison_operator,
+            ">=": self.compile_comparison_operator, "!=": self.compile_comparison_operator,
+            "&&": self.compile_binary_boolean_operator, "||": self.compile_binary_boolean_operator,
+            "fcall": self.compile_func_call,
+        }
+        self.run_func = None
+
+    # Compiles every function (func.closure runs its body, like Interpreter.run_body). Called by
+    # run() once it has reset the interpreter for the run, so closures can hold on to its env engine.
+    def compile_program(self, ast):
+        self.run_func = self.compile_run_func()
+        for func in ast.dict['functions']:
+            func.closure = self.compile_function(func)
+
+    # Interpreter.run_func: runs func_node's body, then the body of every tail call it hands back
+    def compile_run_func(self):
+        engine = self.interpreter.env_engine
+        def run_func(func_node, env):
+            tail_env = None
+            while True:
+                return_value = func_node.closure(env)
+                if tail_env is not None:
+                    engine.release_call(tail_env)
+                if type(return_value) is not BoundCall:
+                    return return_value
+                func_node = return_value.func_node
+                env = tail_env = return_value.env
+        return run_func
+
+    def compile_function(self, func_node):
+        interpreter = self.interpreter
+        active_frames = interpreter.active_frames
+        requests = interpreter.snapshot_requests
+        names = func_node.block_names
+        body = self.compile_block(func_node.dict['statements'])
+        def run_body(env):
+            if names is not None:
+                env.push_block(names)
+            active_frames.append((func_node, env))
+            if len(active_frames) > interpreter.max_call_depth:
+                interpreter.max_call_depth = len(active_frames)
+            return_value = nil
+            for statement in body:
+                if requests:
+                    interpreter.take_requested_snapshots()
+                return_value = statement(env)
+                if type(return_value) is Element and return_value.elem_type == "return":
+                    active_frames.pop()
+                    if names is not None:
+                        env.pop_block()
+                    return return_value.dict['value']
+                if type(return_value) is tuple and return_value[1] == "error":
+                    break
+            active_frames.pop()
+            if names is not None:
+                env.pop_block()
+            return return_value
+        return run_body
+
+    def compile_block(self, statements):
+        return tuple(self.compile_statement(statement) for statement in statements)
+
+    def compile_statement(self, statement_node):
+        compiler = self.statement_compilers.get(statement_node.elem_type)
+        if compiler is None:
+            return skip_statement # a bare expression statement is never evaluated
+        return compiler(statement_node)
+
+    def compile_expression(self, expression_node):
+        compiler = self.expression_compilers.get(expression_node.elem_type)
+        closure = compiler(expression_node) if compiler is not None else unsupported_expression
+        expression_node.closure = closure
+        return closure
+
+    # A closure giving what Interpreter.lazy_value would bind expression_node to
+    def compile_lazy(self, expression_node):
+        self.compile_expression(expression_node) # in case it becomes a Thunk
+        if expression_node.cheap == "literal":
+            value = self.interpreter.get_value(expression_node)
+            return lambda env: value
+        lazy_value = self.interpreter.lazy_value
+        return lambda env: lazy_value(expression_node, env)
+
+    ## STATEMENTS ##
+
+    def compile_definition(self, statement_node):
+        do_definition = self.interpreter.do_definition
+        if statement_node.redefinition is False: # analysis_v4 knows it's fine, nothing to check
+            def define(env):
+                env.declare(statement_node)
+                return nil
+            return define
+        return lambda env: do_definition(statement_node, env)
+
+    def compile_assignment(self, statement_node):
+        interpreter = self.interpreter
+        source_node = statement_node.dict['expression']
+        name = statement_node.dict['name']
+        if statement_node.strict:
+            source = self.compile_expression(source_node)
+            owner = statement_node.strict_owner
+            if statement_node.declared_strict:
+                def assign(env):
+                    if env.read(statement_node) is not UNDECLARED:
+                        value = source(env)
+                        if type(value) is tuple and value[1] == "error":
+                            return value
+                        env.write(statement_node, value)
+                        return nil
+                    interpreter.error(ErrorType.NAME_ERROR, f"variable used and not declared: {name}",)
+                return assign
+            def assign(env):
+                if env.read(statement_node) is not UNDECLARED:
+                    env.write(statement_node, source(env))
+                    if owner is not None:
+                        interpreter.count_avoided_thunk(owner)
+                    return nil
+                interpreter.error(ErrorType.NAME_ERROR, f"variable used and not declared: {name}",)
+            return assign
+        lazy = self.compile_lazy(source_node)
+        def assign(env):
+            if env.write(statement_node, lazy(env)):
+                return nil
+            interpreter.error(ErrorType.NAME_ERROR, f"variable used and not declared: {name}",)
+        return assign
+
+    def compile_return_statement(self, statement_node):
+        expression_node = statement_node.dict['expression']
+        if not expression_node:
+            return lambda env: Element("return", value=nil)
+        if statement_node.tail_call:
+            bind = self.compile_bind(expression_node)
+            return lambda env: Element("return", value=bind(env))
+        expression = self.compile_expression(expression_node)
+        return lambda env: Element("return", value=expression(env))
+
+    def compile_if_statement(self, statement_node):
+        interpreter = self.interpreter
+        requests = interpreter.snapshot_requests
+        condition = self.compile_expression(statement_node.dict['condition'])
+        then_block = (self.compile_block(statement_node.dict['statements']), statement_node.block_names)
+        else_block = (self.compile_block(statement_node.dict['else_statements'] or []), statement_node.else_block_names)
+        def run_if(env):
+            cond = condition(env)
+            if isinstance(cond, Thunk):
+                cond = cond.value()
+            if type(cond) is tuple and cond[1] == "error":
+                return cond
+            if type(cond) is not bool:
+                interpreter.error(ErrorType.TYPE_ERROR, "Condition is not of type bool",)
+            statements, names = then_block if cond else else_block
+            if names is not None:
+                env.push_block(names)
+            for statement in statements:
+                if requests:
+                    interpreter.take_requested_snapshots()
+                return_value = statement(env)
+                if type(return_value) is Element and return_value.elem_type == "return":
+                    if names is not None:
+                        env.pop_block()
+                    return return_value
+                elif return_value is not nil:
+                    if names is not None:
+                        env.pop_block()
+                    if type(return_value) is tuple and return_value[1] == "error":
+                        return return_value
+                    return Element("return", value=return_value)
+            if names is not None:
+                env.pop_block()
+            return nil
+        return run_if
+
+    def compile_for_loop(self, statement_node):
+        interpreter = self.interpreter
+        requests = interpreter.snapshot_requests
+        init = self.compile_statement(statement_node.dict['init'])
+        update = self.compile_statement(statement_node.dict['update'])
+        condition = self.compile_expression(statement_node.dict['condition'])
+        body = self.compile_block(statement_node.dict['statements'])
+        names = statement_node.block_names
+        def run_for(env):
+            if requests:
+                interpreter.take_requested_snapshots()
+            init_value = init(env)
+            if init_value is not nil:
+                return init_value # an error assigned to a `var !x`
+            while True:
+                cond = condition(env)
+                if isinstance(cond, Thunk):
+                    cond = cond.value()
+                if type(cond) is tuple and cond[1] == "error":
+                    return cond
+                if type(cond) is not bool:
+                    interpreter.error(ErrorType.TYPE_ERROR, "Condition is not of type bool",)
+                if not cond:
+                    break
+                if names is not None:
+                    env.push_block(names)
+                for statement in body:
+                    if requests:
+                        interpreter.take_requested_snapshots()
+                    return_value = statement(env)
+                    if type(return_value) is Element and return_value.elem_type == "return":
+                        if names is not None:
+                            env.pop_block()
+                        return return_value
+                    elif return_value is not nil:
+                        if names is not None:
+                            env.pop_block()
+                        if type(return_value) is tuple and return_value[1] == "error":
+                            return return_value
+                        return Element("return", value=return_value)
+                if names is not None:
+                    env.pop_block()
+                if requests:
+                    interpreter.take_requested_snapshots()
+                update_value = update(env)
+                if update_value is not nil:
+                    return update_value
+            return nil
+        return run_for
+
+    def compile_raise_statement(self, statement_node):
+        interpreter = self.interpreter
+        exception_type = self.compile_expression(statement_node.dict['exception_type'])
+        def run_raise(env):
+            exception = exception_type(env)
+            if type(exception) is tuple and exception[1] == "error":
+                return exception
+            if not isinstance(exception, str):
+                interpreter.error(ErrorType.TYPE_ERROR, f"Exception '{exception}' does not evaluate to a string.",)
+            return (exception, "error")
+        return run_raise
+
+    def compile_try_block(self, statement_node):
+        interpreter = self.interpreter
+        requests = interpreter.snapshot_requests
+        body = self.compile_block(statement_node.dict['statements'])
+        catchers = {} # exception -> compiled catch block; the first catcher for it wins
+        for catcher in statement_node.dict['catchers']:
+            if catcher.dict['exception_type'] not in catchers:
+                catchers[catcher.dict['exception_type']] = self.compile_block(catcher.dict['statements'])
+        names = statement_node.block_names
+        def run_try(env):
+            if names is not None:
+                env.push_block(names)
+            raised = None
+            for statement in body:
+                if requests:
+                    interpreter.take_requested_snapshots()
+                return_value = statement(env)
+                if type(return_value) is Element and return_value.elem_type == "return":
+                    if names is not None:
+                        env.pop_block()
+                    return return_value
+                if type(return_value) is tuple and return_value[1] == "error":
+                    raised = return_value # the catcher runs in the same scope
+                    break
+                elif return_value is not nil:
+                    if names is not None:
+                        env.pop_block()
+                    return Element("return", value=return_value)
+            if raised is None:
+                if names is not None:
+                    env.pop_block()
+                return nil
+            catch_block = catchers.get(raised[0])
+            if catch_block is None:
+                if names is not None:
+                    env.pop_block()
+                return raised
+            for statement in catch_block:
+                if requests:
+                    interpreter.take_requested_snapshots()
+                return_value = statement(env)
+                if type(return_value) is Element and return_value.elem_type == "return":
+                    if names is not None:
+                        env.pop_block()
+                    return return_value
+                elif return_value is not nil:
+                    if names is not None:
+                        env.pop_block()
+                    return Element("return", value=return_value)
+            if names is not None:
+                env.pop_block()
+            return nil
+        return run_try
+
+    ## CALLS ##
+
+    def compile_func_call(self, expression_node):
+        name = expression_node.dict['name']
+        if name == "print":
+            return self.compile_print(expression_node)
+        elif name == "inputi" or name == "inputs":
+            return self.compile_input(expression_node)
+        bind = self.compile_bind(expression_node)
+        engine = self.interpreter.env_engine
+        compiler = self
+        def call(env):
+            bound = bind(env)
+            if type(bound) is not BoundCall:
+                return bound # a bang argument was an error
+            return_value = compiler.run_func(bound.func_node, bound.env)
+            engine.release_call(bound.env)
+            return return_value
+        return call
+
+    def compile_print(self, expression_node):
+        interpreter = self.interpreter
+        args = [self.compile_expression(arg) for arg in expression_node.dict['args']]
+        def run_print(env):
+            output = ""
+            for arg in args:
+                eval = arg(env)
+                if isinstance(eval, Thunk):
+                    eval = eval.value()
+                if type(eval) is tuple and eval[1] == "error":
+                    return eval
+                if type(eval) is bool:
+                    output += "true" if eval else "false"
+                else:
+                    output += str(eval)
+            interpreter.output(output)
+            return nil
+        return run_print
+
+    def compile_input(self, expression_node):
+        interpreter = self.interpreter
+        name = expression_node.dict['name']
+        args = expression_node.dict['args']
+        if len(args) > 1:
+            def too_many(env):
+                interpreter.error(ErrorType.NAME_ERROR,f"No {name}() function found that takes > 1 parameter",)
+            return too_many
+        prompt = self.compile_expression(args[0]) if args else None
+        convert = int if name == "inputi" else str
+        def run_input(env):
+            if prompt is not None:
+                eval = prompt(env)
+                if isinstance(eval, Thunk):
+                    eval = eval.value()
+                if type(eval) is tuple and eval[1] == "error":
+                    return eval
+                interpreter.output(eval)
+            user_in = interpreter.get_input()
+            try:
+                return convert(user_in)
+            except:
+                return user_in
+        return run_input
+
+    # Interpreter.bind_call for one call site: the target is known (analysis_v4.link_program) and
+    # which arguments are bang, strict or lazy is decided here, once.
+    def compile_bind(self, expression_node):
+        interpreter = self.interpreter
+        func_def = expression_node.target
+        if func_def is None:
+            return lambda env: interpreter.get_func_def(expression_node) # raises the link error
+        args = expression_node.dict['args']
+        bang = [(i, self.compile_expression(args[i])) for param_name, i in func_def.bang_params]
+        strict = [(i, self.compile_expression(args[i])) for param_name, i in func_def.strict_params]
+        lazy = [self.compile_lazy(arg) for arg in args]
+        count = len(args)
+        owner = func_def.strict_owner
+        names = func_def.param_names
+        engine = interpreter.env_engine
+        def bind(env):
+            processed_args = engine.frame(count)
+            for i, arg in bang:
+                arg_value = arg(env)
+                if type(arg_value) is tuple and arg_value[1] == "error":
+                    engine.release(processed_args)
+                    return arg_value
+                processed_args[i] = arg_value
+            for i, arg in strict:
+                if processed_args[i] is not UNDECLARED:
+                    continue
+                arg_value = arg(env)
+                processed_args[i] = arg_value
+                interpreter.count_avoided_thunk(owner)
+                if type(arg_value) is tuple and arg_value[1] == "error":
+                    break
+            for i in range(count):
+                if processed_args[i] is UNDECLARED:
+                    processed_args[i] = lazy[i](env)
+            return BoundCall(func_def, engine.call_frames(processed_args, names))
+        return bind
+
+    ## EXPRESSIONS ##
+
+    def compile_literal(self, expression_node):
+        value = self.interpreter.get_value(expression_node)
+        return lambda env: value
+
+    def compile_variable(self, expression_node):
+        interpreter = self.interpreter
+        name = expression_node.dict['name']
+        def variable(env):
+            val = env.read(expression_node)
+            if val is UNDECLARED:
+                interpreter.error(ErrorType.NAME_ERROR, f"variable '{name}' used and not declared",)
+            if val is None:
+                interpreter.error(ErrorType.NAME_ERROR, f"variable '{name}' declared but not defined",)
+            if isinstance(val, Thunk):
+                val = val.value()
+                env.write(expression_node, val) # later reads skip the Thunk
+            return val
+        return variable
+
+    # int op int is done right here; everything else (type errors, string +, / by zero) goes
+    # through apply_binary_operator
+    def compile_binary_operator(self, expression_node):
+        op = expression_node.elem_type
+        op1 = self.compile_expression(expression_node.dict['op1'])
+        op2 = self.compile_expression(expression_node.dict['op2'])
+        apply = self.interpreter.apply_binary_operator
+        fast = BINARY_OPERATORS[op] if op != "/" else None
+        def binary(env):
+            eval1 = op1(env)
+            if type(eval1) is tuple and eval1[1] == "error":
+                return eval1
+            eval2 = op2(env)
+            if type(eval2) is tuple and eval2[1] == "error":
+                return eval2
+            if fast is not None and type(eval1) is int and type(eval2) is int:
+                return fast(eval1, eval2)
+            return apply(op, eval1, eval2)
+        return binary
+
+    def compile_unary_operator(self, expression_node):
+        op = expression_node.elem_type
+        op1 = self.compile_expression(expression_node.dict['op1'])
+        apply = self.interpreter.apply_unary_operator
+        def unary(env):
+            eval = op1(env)
+            if type(eval) is tuple and eval[1] == "error":
+                return eval
+            return apply(op, eval)
+        return unary
+
+    def compile_comparison_operator(self, expression_node):
+        op = expression_node.elem_type
+        op1 = self.compile_expression(expression_node.dict['op1'])
+        op2 = self.compile_expression(expression_node.dict['op2'])
+        apply = self.interpreter.apply_comparison_operator
+        fast = COMPARISON_OPERATORS[op]
+        def comparison(env):
+            eval1 = op1(env)
+            if type(eval1) is tuple and eval1[1] == "error":
+                return eval1
+            eval2 = op2(env)
+            if type(eval2) is tuple and eval2[1] == "error":
+                return eval2
+            if type(eval1) is int and type(eval2) is int:
+                return fast(eval1, eval2)
+            return apply(op, eval1, eval2)
+        return comparison
+
+    def compile_binary_boolean_operator(self, expression_node):
+        check = self.interpreter.check_boolean_operand
+        op1 = self.compile_expression(expression_node.dict['op1'])
+        op2 = self.compile_expression(expression_node.dict['op2'])
+        short_circuit = expression_node.elem_type == "||" # the value of op1 that decides it
+        def boolean(env):
+            eval1 = op1(env)
+            if type(eval1) is tuple and eval1[1] == "error":
+                return eval1
+            check(eval1)
+            if eval1 == short_circuit:
+                return eval1
+            eval2 = op2(env)
+            if type(eval2) is tuple and eval2[1] == "error":
+                return eval2
+            check(eval2)
+            return eval2
+        return boolean
+
+
+def skip_statement(env):
+    return nil
+
+def unsupported_expression(env):
+    return None # new (structs aren't part of this version)
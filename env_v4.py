@@ -46,3 +46,248 @@ class EnvironmentManager:
     # used when we exit a nested block to discard the environment for that block
     def pop_func(self):
         self.environment.pop()
+
+
+# Marks a symbol that had no binding when it was captured
+UNDECLARED = object()
+
+
+# Call and block frames for the lazy interpreter, addressed the way analysis_v4.resolve_function
+# lays them out: frames[level] is the list of slots for one block (level 0 a call's parameters,
+# level 1 the function body, one more per nested block) and names[level] names its slots.
+# A slot holds UNDECLARED until its vardef runs, then None (declared but not defined), then a value.
+# Accesses go through the AST node, which carries its address (a tuple of (level, slot) candidates,
+# innermost first, almost always just one), so every access is a couple of list indexes.
+# Block frames come from pool (a FramePool) when there is one and go back to it when popped.
+class Frames:
+    __slots__ = ("frames", "names", "pool")
+
+    def __init__(self, values=(), names=(), pool=None):
+        self.frames = [list(values)]
+        self.names = [names]
+        self.pool = pool
+
+    def push_block(self, names):
+        if self.pool is None:
+            self.frames.append([UNDECLARED] * len(names))
+        else:
+            self.frames.append(self.pool.frame(len(names)))
+        self.names.append(names)
+
+    def pop_block(self):
+        frame = self.frames.pop()
+        self.names.pop()
+        if self.pool is not None:
+            self.pool.release(frame)
+
+    # the current binding of a var or "=" node (None if declared but not defined), or UNDECLARED
+    def read(self, node):
+        frames = self.frames
+        for level, slot in node.address:
+            value = frames[level][slot]
+            if value is not UNDECLARED:
+                return value
+        return UNDECLARED
+
+    # rebinds what node (var or "=") refers to; False if it isn't declared
+    def write(self, node, value):
+        frames = self.frames
+        for level, slot in node.address:
+            frame = frames[level]
+            if frame[slot] is not UNDECLARED:
+                frame[slot] = value
+                return True
+        return False
+
+    # runs a vardef node in the current block
+    def declare(self, node):
+        self.frames[-1][node.slot] = None
+
+    # True if the current block already declared what vardef node declares
+    def declared_here(self, node):
+        return self.frames[-1][node.slot] is not UNDECLARED
+
+    # O(len(free_vars)): the current bindings of the expression's free variables as a tuple
+    # (UNDECLARED where there is none). captured_frames() turns it back into Frames.
+    def capture(self, expression_node):
+        frames = self.frames
+        values = []
+        for address in expression_node.free_addresses:
+            value = UNDECLARED
+            for level, slot in address:
+                value = frames[level][slot]
+                if value is not UNDECLARED:
+                    break
+            values.append(value)
+        return tuple(values)
+
+
+# Frames just big enough to evaluate expression_node with the values a capture() took. Each value
+# goes to the innermost place its name could be; undeclared ones are left out, so reading them
+# still fails the same way.
+def captured_frames(expression_node, values):
+    env = Frames.__new__(Frames)
+    env.frames = [[UNDECLARED] * size for size in expression_node.capture_shape]
+    env.names = None # only ever read from, never shown
+    env.pool = None
+    for address, value in zip(expression_node.free_addresses, values):
+        if value is not UNDECLARED and address:
+            level, slot = address[0]
+            env.frames[level][slot] = value
+    return env
+
+
+# Environment engines: what Interpreter(environment=...) uses to make environments. Each one has
+#   base()                    the environment main() runs in
+#   frame(count)              a list for a call's arguments, by parameter index (release() if unused)
+#   call_frames(args, names)  the environment for a call, and release_call(env) once it returned
+#   captured(expr, values)    an environment to evaluate expr in from what env.capture(expr) took
+# plus calls/allocated/reused counters for Interpreter.frame_report().
+
+# "frames": Frames, recycling the lists frames are made of, and the Frames objects for calls, instead of allocating
+# new ones for every call and block. This is safe because nothing outlives the block or call it
+# belongs to: Thunks capture a tuple of values (Frames.capture), never a frame, so once a block
+# is popped or a call returns, nobody else can see its frame.
+# With recycle=False it only counts, which is what frame_report() compares against.
+class FramePool:
+    def __init__(self, recycle=True):
+        self.recycle = recycle
+        self.free = {} # size -> frames of that size, every slot UNDECLARED
+        self.free_frames = [] # Frames objects without any frames in them
+        self.blank = {} # size -> tuple of UNDECLARED, to reset a frame without allocating
+        self.calls = 0
+        self.allocated = 0 # frames and Frames objects that had to be created
+        self.reused = 0
+
+    def base(self):
+        return Frames((), (), self)
+
+    def captured(self, expression_node, values):
+        return captured_frames(expression_node, values)
+
+    def frame(self, size):
+        free = self.free.get(size)
+        if free:
+            self.reused += 1
+            return free.pop()
+        self.allocated += 1
+        return [UNDECLARED] * size
+
+    def release(self, frame):
+        if not self.recycle:
+            return
+        size = len(frame)
+        blank = self.blank.get(size)
+        if blank is None:
+            blank = self.blank[size] = (UNDECLARED,) * size
+        frame[:] = blank
+        self.free.setdefault(size, []).append(frame)
+
+    # Frames for a call, with params (a frame from frame()) as level 0
+    def call_frames(self, params, names):
+        self.calls += 1
+        if self.free_frames:
+            self.reused += 1
+            env = self.free_frames.pop()
+        else:
+            self.allocated += 1
+            env = Frames((), (), self)
+            env.frames.clear()
+            env.names.clear()
+        env.frames.append(params)
+        env.names.append(names)
+        return env
+
+    # takes back everything a call_frames() env still holds once the call has returned
+    def release_call(self, env):
+        if not self.recycle:
+            return
+        while env.frames:
+            self.release(env.frames.pop())
+        env.names.clear()
+        self.free_frames.append(env)
+
+
+# Shallow binding: one dict per call from each name to the stack of its bindings (innermost last),
+# so a lookup is one probe no matter how deeply blocks are nested, and addresses aren't needed.
+# Every block records the names it declared, and popping it pops exactly those bindings.
+# Each call still gets its own dict, since a function can't see its caller's variables.
+class ShallowBindings:
+    __slots__ = ("bindings", "blocks")
+
+    def __init__(self, bindings=None):
+        self.bindings = {} if bindings is None else bindings # name -> stack of bindings
+        self.blocks = [[]] # names declared per block, innermost last
+
+    def push_block(self, names):
+        self.blocks.append([])
+
+    def pop_block(self):
+        bindings = self.bindings
+        for name in self.blocks.pop():
+            bindings[name].pop()
+
+    def read(self, node):
+        stack = self.bindings.get(node.dict['name'])
+        if stack:
+            return stack[-1]
+        return UNDECLARED
+
+    def write(self, node, value):
+        stack = self.bindings.get(node.dict['name'])
+        if not stack:
+            return False
+        stack[-1] = value
+        return True
+
+    def declare(self, node):
+        name = node.dict['name']
+        stack = self.bindings.get(name)
+        if stack is None:
+            self.bindings[name] = [None]
+        else:
+            stack.append(None)
+        self.blocks[-1].append(name)
+
+    def declared_here(self, node):
+        return node.dict['name'] in self.blocks[-1]
+
+    def capture(self, expression_node):
+        bindings = self.bindings
+        values = []
+        for name in expression_node.free_vars:
+            stack = bindings.get(name)
+            values.append(stack[-1] if stack else UNDECLARED)
+        return tuple(values)
+
+
+# "shallow": ShallowBindings. Nothing to recycle; allocated counts the binding stacks and dicts made per call.
+class ShallowEngine:
+    def __init__(self):
+        self.calls = 0
+        self.allocated = 0
+        self.reused = 0
+
+    def base(self):
+        return ShallowBindings()
+
+    def captured(self, expression_node, values):
+        return ShallowBindings({name: [value] for name, value in zip(expression_node.free_vars, values)
+                                if value is not UNDECLARED})
+
+    def frame(self, size):
+        return [UNDECLARED] * size
+
+    def release(self, frame):
+        pass
+
+    def call_frames(self, params, names):
+        self.calls += 1
+        bindings = {}
+        for name, value in zip(names, params):
+            bindings[name] = [value] # a repeated parameter name refers to the last one
+        self.allocated += 3 + len(bindings) # args list, dict, env and one stack per parameter
+        return ShallowBindings(bindings)
+
+    def release_call(self, env):
+        pass
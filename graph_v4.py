@@ -0,0 +1,145 @@
+# Snapshot of the live Thunk/environment graph, for finding out what is keeping memory alive.
+# Interpreter.graph_snapshot() (or request_graph_snapshot() while a program runs) builds one;
+# to_dot() gives Graphviz, to_json() a compact node + edge list.
+#
+# Nodes are the active calls (roots), their environments (Frames and the block frames in them, or
+# ShallowBindings), and the Thunks reachable from those. Plain values aren't nodes; they count towards their holder's size.
+#   size:     bytes of the object itself (plus its captured tuple and plain values)
+#   retained: size plus the retained size of every child nothing else in the graph points to,
+#             i.e. roughly what would be freed if this node went away
+
+import json
+import sys
+
+from env_v4 import Frames, ShallowBindings, UNDECLARED
+
+
+class GraphNode:
+    __slots__ = ("id", "kind", "label", "source", "size", "retained")
+
+    def __init__(self, id, kind, label, source, size):
+        self.id = id
+        self.kind = kind
+        self.label = label
+        self.source = source # where a Thunk came from, e.g. "x = ..." (None for everything else)
+        self.size = size
+        self.retained = size
+
+
+class ThunkGraph:
+    def __init__(self):
+        self.nodes = {} # id(object) -> GraphNode ("call0", "call1", ... for the roots)
+        self.edges = [] # (from id, to id, label)
+
+    def to_json(self):
+        return json.dumps({
+            "nodes": [{"id": node.id, "kind": node.kind, "label": node.label, "source": node.source,
+                       "size": node.size, "retained": node.retained} for node in self.nodes.values()],
+            "edges": [list(edge) for edge in self.edges],
+        }, separators=(",", ":"))
+
+    def to_dot(self):
+        lines = ["digraph thunks {", "  node [shape=box, fontname=monospace];"]
+        for node in self.nodes.values():
+            text = f"{node.kind} {node.label}"
+            if node.source:
+                text += f"\\n{node.source}"
+            text += f"\\nsize {node.size} retained {node.retained}"
+            lines.append(f'  n{node.id} [label="{escape(text)}"];')
+        for source, target, label in self.edges:
+            lines.append(f'  n{source} -> n{target} [label="{escape(label)}"];')
+        lines.append("}")
+        return "\n".join(lines)
+
+
+def escape(text):
+    return text.replace('"', '\\"')
+
+
+def snapshot_graph(interpreter):
+    from interpreterv4 import Thunk # not at the top: interpreterv4 imports this module
+    graph = ThunkGraph()
+    parents = {} # id -> number of edges into it
+    pending = []
+
+    # adds obj as a node if it is one (first time seen) and returns its id, or None for plain values.
+    # Block frames are plain lists, so they only become nodes through visit_frame.
+    def visit(obj):
+        if not isinstance(obj, (Thunk, Frames, ShallowBindings)):
+            return None
+        key = id(obj)
+        if key not in graph.nodes:
+            if isinstance(obj, Thunk):
+                expr = obj.source
+                state = "forced" if obj.evaluated else "pending"
+                source = getattr(expr, "site_label", str(expr)) if expr is not None else None
+                values = tuple(value for name, value in obj.references())
+                size = sys.getsizeof(obj) + sys.getsizeof(values) + sum(value_size(value) for value in values)
+                graph.nodes[key] = GraphNode(key, "thunk", state, source, size)
+            elif isinstance(obj, Frames):
+                graph.nodes[key] = GraphNode(key, "env", f"{len(obj.frames)} frames", None,
+                                             sys.getsizeof(obj) + sys.getsizeof(obj.frames))
+            else:
+                size = sys.getsizeof(obj) + sys.getsizeof(obj.bindings) + sum(
+                    sys.getsizeof(stack) + sum(value_size(value) for value in stack) for stack in obj.bindings.values())
+                graph.nodes[key] = GraphNode(key, "env", f"{len(obj.bindings)} names", None, size)
+            pending.append(obj)
+        return key
+
+    def visit_frame(env, level):
+        frame = env.frames[level]
+        key = id(frame)
+        graph.edges.append((id(env), key, f"level {level}"))
+        parents[key] = parents.get(key, 0) + 1
+        if key not in graph.nodes:
+            size = sys.getsizeof(frame) + sum(value_size(value) for value in frame)
+            graph.nodes[key] = GraphNode(key, "frame", f"level {level}, {len(frame)} slots", None, size)
+            for name, value in zip(env.names[level], frame):
+                if value is not UNDECLARED:
+                    link(frame, value, name)
+
+    def link(source, obj, label):
+        target = visit(obj)
+        if target is not None:
+            graph.edges.append((id(source), target, label))
+            parents[target] = parents.get(target, 0) + 1
+
+    # the roots: one node per call in progress (ids are strings, so they can't clash with id(obj))
+    for depth, (func_node, env) in enumerate(interpreter.active_frames):
+        call = f"call{depth}"
+        graph.nodes[call] = GraphNode(call, "call", f"{func_node.dict['name']}/{len(func_node.dict['args'])} depth {depth}", None, 0)
+        target = visit(env)
+        graph.edges.append((call, target, "env"))
+        parents[target] = parents.get(target, 0) + 1
+
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, Thunk):
+            for name, value in obj.references():
+                link(obj, value, name)
+        elif isinstance(obj, Frames):
+            for level in range(len(obj.frames)):
+                visit_frame(obj, level)
+        else:
+            for name, stack in obj.bindings.items():
+                for depth, value in enumerate(stack):
+                    link(obj, value, name if depth == len(stack) - 1 else f"{name} (shadowed)")
+
+    annotate_retained(graph, parents)
+    return graph
+
+
+# Thunks and frames have their own nodes; strings (and anything else plain) are part of whoever holds them
+def value_size(value):
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    return 0
+
+
+# retained = own size + retained size of the children only this node points to.
+# Children come after parents in the edge list, so walking it backwards sums bottom-up;
+# a shared child (or one on a cycle) stays with itself.
+def annotate_retained(graph, parents):
+    for source, target, label in reversed(graph.edges):
+        if parents.get(target) == 1 and target != source:
+            graph.nodes[source].retained += graph.nodes[target].retained
@@ -3,57 +3,629 @@
 
 from brewparse import *
 from intbase import *
+from env_v4 import FramePool, ShallowEngine, UNDECLARED
+from analysis_v4 import analyze_program
+from speculate_v4 import Speculator
+from graph_v4 import snapshot_graph
+from stack_v4 import StackMachine
+from closure_v4 import ClosureCompiler
+from bytecode_v4 import BytecodeVM, compile_program
+from transpile_v4 import Transpiler
 
 import sys
+import json
+import operator
+import time
+import threading
+import weakref
 sys.tracebacklimit = 0
 
-import copy
 nil = Element("nil")
 
+# Adaptive laziness (Interpreter.adaptive_value): a site whose Thunks nearly always end up forced
+# switches to evaluating eagerly, where analysis_v4 says that can't be observed (eager_safe).
+ADAPTIVE_WARMUP = 32 # Thunks a site has to create before its forcing rate is trusted
+ADAPTIVE_EAGER_RATE = 0.9 # fraction of those that must have been forced
+ADAPTIVE_SAMPLE = 16 # an eager site still makes a Thunk one time in this many, to keep checking
+
+# Operator tables for apply_binary_operator / apply_comparison_operator (type checks happen first)
+BINARY_OPERATORS = {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.floordiv}
+COMPARISON_OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+                        "==": operator.eq, "!=": operator.ne}
+
+# Deep recursion mode (Interpreter(deep_recursion=True)): the program runs on its own thread with a
+# stack_size stack and the recursion limit raised to stack_size // DEEP_STACK_PER_FRAME. That's enough
+# C stack for every Python frame even if each one was entered through C, so running out is always
+# a RecursionError (reported as a Brewin error) and never a segfault.
+DEEP_STACK_SIZE = 512 * 1024 * 1024
+DEEP_STACK_PER_FRAME = 512
+
+# What the interpreter has seen of one lazy site (an assigned expression or an argument).
+class SiteProfile:
+    __slots__ = ("mode", "base_created", "base_forced", "visits", "eager", "deopts", "create_ns",
+                 "capture_bytes", "max_depth")
+
+    def __init__(self):
+        self.mode = "lazy" # "lazy", "eager", or "deopt" (evaluating it eagerly failed: lazy for good)
+        self.base_created = 0 # Thunks created/forced at this site before the last mode switch
+        self.base_forced = 0
+        self.visits = 0 # times the site was reached while eager
+        self.eager = 0 # times it was evaluated eagerly
+        self.deopts = 0
+        self.create_ns = 0 # total time spent creating its Thunks (i.e. capturing their environment)
+        self.capture_bytes = 0 # total size of those captures
+        self.max_depth = 0 # deepest chain of Thunks forced at once starting from one of its Thunks
+
 # Source: https://www.cs.virginia.edu/~evans/cs150/book/ch13-laziness-0402.pdf (Given on campuswire)
 class Thunk:
+    __slots__ = ("_expr", "_env", "_evaluated", "_value", "_interpreter", "_speculation", "__weakref__")
+
     # expr stores the expression_node, env stores the variable scope.
-    def __init__(self, expr, environment, evaluate_expression):
+    def __init__(self, expr, environment, interpreter):
         self._expr = expr
-        self._env = [copy.deepcopy(env) for env in environment]
+        # Only capture the bindings the expression can read (free_vars comes from analysis_v4), so a
+        # live Thunk keeps its own free variables alive rather than the caller's whole scope stack.
+        # Thunks already in scope are shared rather than copied (along with the Interpreter).
+        # The capture is a tuple lined up with free_vars; it only becomes an environment again when forced.
+        self._env = environment.capture(expr)
         self._evaluated = False
         self._value = None
-        self._evaluate_expression = evaluate_expression # Pass in expression eval method from Interpreter class
-        #print(f"Initializing with environment: {self._env}")
-        #print(f"Which was deepcopied from: {environment}")
-        #print(f"{self}")
+        self._interpreter = interpreter # evaluates the expression (Interpreter.evaluate_thunk) when forced
+        self._speculation = None # future computing the same value on the speculation pool, if any
     
+    # Call-by-need: the Thunk object itself is the memo cell. Environments only ever hold references
+    # to it (capture() never copies a Thunk), so forcing it through any alias updates
+    # every other alias and the expression runs at most once.
     def value(self):
         if not self._evaluated:
-            self._value = self._evaluate_expression(self._expr, self._env)
-            self._prev_value = self._value
-            #print(f"Is now: {self._value}")
-            self._evaluated = True
+            force(self)
         return self._value
+
+    # The first leading dependency (see analysis_v4.leading_vars) that is still an unforced Thunk,
+    # or None once evaluating our own expression won't have to force any of them.
+    def pending_dependency(self):
+        values = self._env
+        for i in self._expr.leading_index:
+            val = values[i]
+            if isinstance(val, Thunk):
+                if not val._evaluated:
+                    return val
+                val = val._value
+            if val is None or val is UNDECLARED or type(val) is tuple:
+                return None # evaluation stops at this read (error), so nothing after it gets forced
+        return None
+
+    # If this Thunk tops a chain of at least two Thunks from the same foldable expression, each one
+    # holding the next in its chained operand (what `s = s + i` builds in a loop), returns
+    # (links, chained, base): the links from this one down, which operand (0/1) is the chained one,
+    # and the binding under the last link. Every link's other operand is already a plain value,
+    # so folding the chain never has to force anything but the base.
+    def fusable_chain(self):
+        expr = self._expr
+        fold = getattr(expr, "fold", None)
+        if fold is None:
+            return None
+        for chained in (0, 1):
+            kind, index = fold[chained]
+            if kind == "var" and same_site(self._env[index], expr):
+                break
+        else:
+            return None
+        other_kind, other_index = fold[1 - chained]
+        links = []
+        link = self
+        while same_site(link, expr):
+            if other_kind == "var" and plain_value(link._env[other_index]) is UNDECLARED:
+                break # its other operand still needs forcing: this link gets forced normally first
+            below = link._env[index]
+            if not isThunk(below) and plain_value(below) is UNDECLARED:
+                break # an error or undefined: normal evaluation of this link deals with it
+            links.append(link)
+            link = below
+        if len(links) < 2:
+            return None
+        return links, chained, link
+
+    def evaluate(self):
+        if self._speculation is not None:
+            value = self._interpreter.speculated_value(self._expr, self._speculation)
+            if value is not None:
+                self.resolve(value)
+                return
+        self.resolve(self._interpreter.evaluate_thunk(self._expr, self._env))
+
+    def resolve(self, value):
+        self._value = value
+        self._evaluated = True
+        # Nothing needs the captured state anymore; let it (and whatever it keeps alive) go.
+        self._expr = None
+        self._env = None
+        self._interpreter = None
+        self._speculation = None
+
+    @property
+    def evaluated(self):
+        return self._evaluated
+
+    # The expression this Thunk will evaluate (None once forced; resolve() lets go of it)
+    @property
+    def source(self):
+        return self._expr
+
+    # What this Thunk keeps alive, as (name, object) pairs: each captured binding, or ("value", value)
+    # once it has been forced. Used by graph_v4.
+    def references(self):
+        if self._evaluated:
+            return [("value", self._value)]
+        return list(zip(self._expr.free_vars, self._env))
+# A user function call with its arguments bound, not run yet (see Interpreter.bind_call).
+# Returned as the value of a tail call's return statement for run_func to run.
+class BoundCall:
+    __slots__ = ("func_node", "env")
+
+    def __init__(self, func_node, env):
+        self.func_node = func_node
+        self.env = env
+
 def isThunk(expr):
     return isinstance(expr, Thunk)
 
+# an unforced Thunk created for expr
+def same_site(val, expr):
+    return isinstance(val, Thunk) and not val._evaluated and val._expr is expr
+
+# val (or what a forced Thunk holds) if reading it can't force anything or fail; else UNDECLARED
+def plain_value(val):
+    if isinstance(val, Thunk):
+        if not val._evaluated:
+            return UNDECLARED
+        val = val._value
+    if val is None or type(val) is tuple:
+        return UNDECLARED
+    return val
+
+# Forces thunk without recursing down chains of Thunks that lead with each other, like the
+# `s = s + i` chain a loop builds. Leading dependencies are forced first from an explicit stack,
+# deepest first and in the order the expression reads them, so by the time a Thunk's expression
+# runs its leading reads are already values and the Python stack stays flat however long the chain.
+# Chains of one foldable expression skip even that and are folded in a single loop (fold_chain).
+def force(thunk):
+    interpreter, expr = thunk._interpreter, thunk._expr
+    stack = [thunk]
+    depth = 1 # deepest the chain got, for thunk_report
+    while stack:
+        top = stack[-1]
+        if top._evaluated:
+            stack.pop()
+            continue
+        chain = top.fusable_chain()
+        if chain is not None:
+            links, chained, base = chain
+            if isThunk(base) and not base._evaluated:
+                stack.append(base) # force whatever the chain starts from, then come back and fold it
+                continue
+            depth = max(depth, len(stack) + len(links) - 1)
+            stack.pop()
+            top._interpreter.fold_chain(links, chained, base.value() if isThunk(base) else base)
+            continue
+        dependency = top.pending_dependency()
+        if dependency is None:
+            stack.pop()
+            top.evaluate()
+        else:
+            stack.append(dependency)
+            if len(stack) > depth:
+                depth = len(stack)
+    interpreter.record_force_depth(expr, depth)
+
 class Interpreter(InterpreterBase):
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    # speculate=N starts Thunks for pure function calls on N worker processes (see speculate_v4)
+    # adaptive=False keeps every lazy site lazy no matter how often its Thunks get forced
+    # pool_frames=False allocates fresh frames for every call and block instead of recycling them
+    # environment picks how variables are stored (see env_v4): "frames" (lexically addressed
+    # array frames) or "shallow" (a stack of bindings per name)
+    # deep_recursion=True runs programs on a thread with a stack_size byte stack, for recursion deeper
+    # than the default Python stack allows (each Brewin call takes several Python frames)
+    # engine picks the evaluator: "tree" (this class, recursing on the Python stack), "stack"
+    # (stack_v4, which keeps its own stack on the heap, so recursion is only limited by memory),
+    # "closure" (closure_v4, which compiles each function into nested closures before running it),
+    # "bytecode" (bytecode_v4, which compiles each function to bytecode and runs that in a single-loop VM)
+    # or "python" (transpile_v4, which compiles the program to Python, cached by program hash)
+    def __init__(self, console_output=True, inp=None, trace_output=False, speculate=0, adaptive=True, pool_frames=True,
+                 environment="frames", deep_recursion=False, stack_size=DEEP_STACK_SIZE, engine="tree"):
         super().__init__(console_output, inp)   # call InterpreterBase's constructor
         # Since functions (at the top level) can be created anywhere, we'll just do a search for function definitions and assign them 'globally'
         self.func_defs = []
-        self.variable_scope_stack = [{}] # Stack to hold variable scopes
+        self.link_diagnostics = []
+        self.pool_frames = pool_frames
+        if environment not in ("frames", "shallow"):
+            raise ValueError(f"unknown environment engine {environment!r}")
+        self.environment = environment
+        if engine not in ("tree", "stack", "closure", "bytecode", "python"):
+            raise ValueError(f"unknown engine {engine!r}")
+        self.engine = engine
+        self.stack_machine = StackMachine(self) if engine == "stack" else None
+        self.closure_compiler = ClosureCompiler(self) if engine == "closure" else None
+        self.bytecode_vm = BytecodeVM(self) if engine == "bytecode" else None
+        self.transpiler = Transpiler(self) if engine == "python" else None
+        self.env_engine = self.make_env_engine()
+        self.variable_scope_stack = self.env_engine.base() # Stack to hold variable scopes
+        self.thunks_avoided = {} # "func/arity" -> Thunks strictness analysis let us skip
+        self.thunks_created = {} # expression node -> Thunks created for it
+        self.thunk_evaluations = {} # expression node -> times one of those Thunks was evaluated
+        self.speculate = speculate
+        self.speculator = None
+        self.adaptive = adaptive
+        self.site_profiles = {} # expression node -> SiteProfile
+        self.max_force_depth = 0
+        self.active_frames = [] # (func node, env) of every call in progress, outermost first
+        self.max_call_depth = 0 # most calls that were in progress at once
+        self.deep_recursion = deep_recursion
+        self.stack_size = stack_size
+        self.snapshot_requests = [] # callbacks waiting for a graph_snapshot(), see request_graph_snapshot
+        # elem_type -> handler(node, env), for run_statement and evaluate_expression
+        self.statement_handlers = {
+            "vardef": self.do_definition,
+            "=": self.do_assignment,
+            "fcall": self.do_func_call,
+            "return": self.do_return_statement,
+            "if": self.do_if_statement,
+            "for": self.do_for_loop,
+            "raise": self.do_raise_statement,
+            "try": self.do_try_block,
+        }
+        self.expression_handlers = {
+            "int": self.get_literal, "string": self.get_literal, "bool": self.get_literal, "nil": self.get_nil,
+            "var": self.get_value_of_variable,
+            "+": self.evaluate_binary_operator, "-": self.evaluate_binary_operator,
+            "*": self.evaluate_binary_operator, "/": self.evaluate_binary_operator,
+            "neg": self.evaluate_unary_operator, "!": self.evaluate_unary_operator,
+            "==": self.evaluate_comparison_operator, "<": self.evaluate_comparison_operator,
+            "<=": self.evaluate_comparison_operator, ">": self.evaluate_comparison_operator,
+            ">=": self.evaluate_comparison_operator, "!=": self.evaluate_comparison_operator,
+            "&&": self.evaluate_binary_boolean_operator, "||": self.evaluate_binary_boolean_operator,
+            "fcall": self.do_func_call,
+            "new": self.evaluate_unsupported,
+        }
+        # a bare expression statement (`x + 1;`) is never evaluated
+        for elem in self.expression_handlers:
+            self.statement_handlers.setdefault(elem, self.skip_statement)
         
     def run(self, program):
-        ast = parse_program(program) # returns list of function nodes
+        if self.deep_recursion:
+            self.run_on_deep_stack(program)
+        else:
+            self.run_program(program)
+
+    # Runs run_program on a thread of its own with a big stack and the recursion limit to match,
+    # passing whatever it raised on to the caller.
+    def run_on_deep_stack(self, program):
+        raised = []
+        def target():
+            sys.setrecursionlimit(max(limit, self.stack_size // DEEP_STACK_PER_FRAME))
+            try:
+                self.run_program(program)
+            except BaseException as e:
+                raised.append(e)
+        limit = sys.getrecursionlimit()
+        old_stack_size = threading.stack_size(self.stack_size)
+        try:
+            thread = threading.Thread(target=target, name="brewin-deep-recursion", daemon=True)
+            thread.start()
+        finally:
+            threading.stack_size(old_stack_size) # only this thread gets the big stack
+        thread.join()
+        sys.setrecursionlimit(limit)
+        if raised:
+            raise raised[0]
+
+    def run_program(self, program):
+        if self.transpiler is not None:
+            ast = self.transpiler.load(program) # parsed and analyzed once per distinct program
+        else:
+            ast = parse_program(program) # returns list of function nodes
+            analyze_program(ast) # precompute free variables etc. on the AST
+        self.thunks_avoided = {}
+        self.thunks_created = {}
+        self.thunk_evaluations = {}
+        self.site_profiles = {}
+        self.max_force_depth = 0
+        self.active_frames = []
+        self.max_call_depth = 0
+        self.env_engine = self.make_env_engine()
+        self.variable_scope_stack = self.env_engine.base()
         #self.output(ast) # always good for start of assignment
         self.func_defs = self.get_func_defs(ast)
+        self.link_diagnostics = ast.link_diagnostics
         main_func_node = self.get_main_func_node(ast)
-        result = self.run_func(main_func_node) 
+        if self.speculate:
+            self.speculator = Speculator(program, self.speculate)
+        overflow = False
+        try:
+            if self.stack_machine is not None:
+                result = self.stack_machine.run(self.stack_machine.run_func(main_func_node, self.variable_scope_stack))
+            elif self.closure_compiler is not None:
+                self.closure_compiler.compile_program(ast)
+                result = self.closure_compiler.run_func(main_func_node, self.variable_scope_stack)
+            elif self.bytecode_vm is not None:
+                compile_program(ast)
+                result = self.bytecode_vm.run_func(main_func_node, self.variable_scope_stack)
+            elif self.transpiler is not None:
+                self.transpiler.start()
+                result = self.transpiler.run_func(main_func_node, self.variable_scope_stack)
+            else:
+                result = self.run_func(main_func_node) 
+        except RecursionError:
+            overflow = True # reported below, once the stack has unwound
+        finally:
+            if self.speculator is not None:
+                self.speculator.shutdown() # whatever is still running was never needed
+                self.speculator = None
+        if overflow:
+            super().error(ErrorType.FAULT_ERROR, f"Stack overflow after {self.max_call_depth} nested calls",)
 
         # Check output status of program. - Does program result in a raised error?
         if isinstance(result, tuple) and result[1] == "error":
             exception, status = result
             super().error(ErrorType.FAULT_ERROR, f"Program resulted in raised exception: {exception}",)
         # After running program, clear env
-        self.variable_scope_stack = [{}]
+        self.variable_scope_stack = self.env_engine.base()
+
+
+    # How many Thunks were skipped per function (keyed "name/arity") because the value was
+    # certainly forced before anything observable could happen.
+    def strictness_report(self):
+        return dict(self.thunks_avoided)
+
+    def count_avoided_thunk(self, owner):
+        self.thunks_avoided[owner] = self.thunks_avoided.get(owner, 0) + 1
+
+    # Per expression site: how many Thunks were created and how many times they were evaluated.
+    # Call-by-need means evaluated <= created for every site, however often the Thunks got captured.
+    def thunk_counts(self):
+        return [{"site": str(expr), "created": created, "evaluated": self.thunk_evaluations.get(expr, 0)}
+                for expr, created in self.thunks_created.items()]
+
+    # Per lazy site: Thunks created and forced, whether it currently runs lazy/eager/deopt,
+    # how many times it was evaluated eagerly instead, and the average cost of making its Thunks.
+    def site_report(self):
+        report = []
+        for expr, profile in self.site_profiles.items():
+            created = self.thunks_created.get(expr, 0)
+            report.append({"site": str(expr), "mode": profile.mode, "created": created,
+                           "forced": self.thunk_evaluations.get(expr, 0), "eager": profile.eager,
+                           "deopts": profile.deopts,
+                           "create_us": profile.create_ns / created / 1000 if created else 0.0})
+        return report
+
+    # Where laziness costs: per assignment/argument site, the Thunks created, forced and never forced,
+    # the bytes and time their environment captures took, and the deepest chain forced from one of
+    # them. Sites come most expensive capture first. Meant to be read after run().
+    def thunk_report(self):
+        sites = []
+        for expr, profile in self.site_profiles.items():
+            created = self.thunks_created.get(expr, 0)
+            forced = self.thunk_evaluations.get(expr, 0)
+            sites.append({"site": str(expr), "kind": getattr(expr, "site_kind", "expression"),
+                          "created": created, "forced": forced, "never_forced": max(created - forced, 0),
+                          "capture_bytes": profile.capture_bytes, "capture_us": profile.create_ns / 1000,
+                          "max_chain_depth": profile.max_depth})
+        sites.sort(key=lambda site: (site["capture_bytes"], site["capture_us"]), reverse=True)
+        totals = {key: sum(site[key] for site in sites)
+                  for key in ("created", "forced", "never_forced", "capture_bytes", "capture_us")}
+        totals["max_chain_depth"] = self.max_force_depth
+        return {"sites": sites, "totals": totals}
+
+    def thunk_report_json(self, indent=2):
+        return json.dumps(self.thunk_report(), indent=indent)
+
+    def make_env_engine(self):
+        if self.environment == "shallow":
+            return ShallowEngine()
+        return FramePool(self.pool_frames)
+
+    # Calls made, the deepest they nested, and frames (or Frames objects) that had to be allocated vs.
+    # were recycled from the pool
+    def frame_report(self):
+        pool = self.env_engine
+        return {"calls": pool.calls, "max_call_depth": self.max_call_depth, "allocated": pool.allocated,
+                "reused": pool.reused, "allocations_per_call": pool.allocated / pool.calls if pool.calls else 0.0}
+
+    # Snapshot of the live Thunk/environment graph (see graph_v4): every call in progress, the scopes
+    # it can see, the Thunks those hold, and whatever those Thunks captured in turn.
+    def graph_snapshot(self):
+        return snapshot_graph(self)
+
+    # Asks a running program for a graph_snapshot() without stopping it: callback(snapshot) is called
+    # before the next statement runs, when every environment is in a consistent state.
+    # Safe to call from another thread, or from anything the interpreter calls into.
+    def request_graph_snapshot(self, callback):
+        self.snapshot_requests.append(callback)
+
+    def take_requested_snapshots(self):
+        while self.snapshot_requests:
+            callback = self.snapshot_requests.pop(0)
+            callback(self.graph_snapshot())
+
+    def record_force_depth(self, expression_node, depth):
+        profile = self.site_profile(expression_node)
+        if depth > profile.max_depth:
+            profile.max_depth = depth
+        if depth > self.max_force_depth:
+            self.max_force_depth = depth
+
+    def site_profile(self, expression_node):
+        profile = self.site_profiles.get(expression_node)
+        if profile is None:
+            profile = self.site_profiles[expression_node] = SiteProfile()
+        return profile
+
+    # What a lazy binding of expression_node should hold. Cheap expressions (analysis_v4 sets .cheap)
+    # cost less to work out now than a Thunk does, and give the same result:
+    #   literals are just their value; a variable read hands over the existing binding (a shared
+    #   Thunk is still evaluated at most once); int arithmetic over already-forced ints can't fail.
+    # Everything else gets a Thunk, which captures env on init.
+    def lazy_value(self, expression_node, env):
+        value = self.cheap_value(expression_node, env)
+        if value is not UNDECLARED:
+            return value
+        if self.adaptive and expression_node.eager_safe:
+            value = self.adaptive_value(expression_node, env)
+            if value is not UNDECLARED:
+                return value
+        return self.make_thunk(expression_node, env)
+
+    # The cheap part of lazy_value: the value, or UNDECLARED if expression_node isn't cheap right now
+    def cheap_value(self, expression_node, env):
+        cheap = expression_node.cheap
+        if cheap == "literal":
+            return self.get_value(expression_node)
+        elif cheap == "var":
+            val = env.read(expression_node)
+            if val is not UNDECLARED and val is not None:
+                if isThunk(val) and val.evaluated:
+                    return val.value()
+                return val
+            # undeclared/undefined: keep it lazy so the error only shows up if it's ever read
+        elif cheap == "arith" and self.all_forced_ints(expression_node, env):
+            return self.evaluate_expression(expression_node, env) # no calls and nothing to force
+        return UNDECLARED
+
+    # Adaptive laziness: once ADAPTIVE_WARMUP Thunks from this site have been made and nearly all of
+    # them got forced, the site goes eager, which is only done when nothing can tell: the expression
+    # is eager_safe (no effects, always finishes) and everything it reads is already a value.
+    # Returns the value, or UNDECLARED if a Thunk should be made as usual.
+    #   - An eager site still makes a Thunk now and then; if those stop getting forced it goes lazy again.
+    #   - If evaluating eagerly fails, that error belongs to whoever forces the value (maybe nobody),
+    #     so the site deopts: the failure is undone, a Thunk is made, and the site stays lazy from then on.
+    def adaptive_value(self, expression_node, env):
+        profile = self.adaptive_profile(expression_node, env)
+        if profile is None:
+            return UNDECLARED
+        state = self.error_state()
+        try:
+            value = self.evaluate_node(expression_node, env)
+        except Exception:
+            self.deopt_site(expression_node, profile, state)
+            return UNDECLARED
+        profile.eager += 1
+        return value
+
+    # The site's profile if expression_node should be evaluated eagerly this time, else None
+    def adaptive_profile(self, expression_node, env):
+        profile = self.site_profile(expression_node)
+        if profile.mode == "deopt":
+            return None
+        created = self.thunks_created.get(expression_node, 0) - profile.base_created
+        forced = self.thunk_evaluations.get(expression_node, 0) - profile.base_forced
+        if profile.mode == "lazy":
+            if created < ADAPTIVE_WARMUP or forced < ADAPTIVE_EAGER_RATE * created:
+                return None
+            self.switch_site(expression_node, profile, "eager")
+        else:
+            profile.visits += 1
+            if profile.visits % ADAPTIVE_SAMPLE == 0:
+                if created >= ADAPTIVE_WARMUP and forced < ADAPTIVE_EAGER_RATE * created:
+                    self.switch_site(expression_node, profile, "lazy")
+                return None # the sample
+        if not self.all_forced(expression_node, env):
+            return None
+        return profile
 
+    # What deopt_site puts back if an eager evaluation started now fails
+    def error_state(self):
+        return self.error_type, self.error_line, len(self.active_frames)
+
+    def deopt_site(self, expression_node, profile, state):
+        self.error_type, self.error_line, calls = state
+        del self.active_frames[calls:] # calls the error unwound through never got to pop themselves
+        profile.deopts += 1
+        self.switch_site(expression_node, profile, "deopt")
+
+    def switch_site(self, expression_node, profile, mode):
+        profile.mode = mode
+        profile.base_created = self.thunks_created.get(expression_node, 0)
+        profile.base_forced = self.thunk_evaluations.get(expression_node, 0)
+
+    # whether every free variable of expression_node is already a plain value
+    def all_forced(self, expression_node, env):
+        for val in env.capture(expression_node):
+            if plain_value(val) is UNDECLARED:
+                return False
+        return True
+
+    def all_forced_ints(self, expression_node, env):
+        for val in env.capture(expression_node):
+            if isThunk(val):
+                if not val.evaluated:
+                    return False
+                val = val.value()
+            if type(val) is not int:
+                return False
+        return True
+
+    def make_thunk(self, expression_node, env):
+        self.thunks_created[expression_node] = self.thunks_created.get(expression_node, 0) + 1
+        start = time.perf_counter_ns()
+        thunk = Thunk(expression_node, env, self)
+        profile = self.site_profile(expression_node)
+        profile.create_ns += time.perf_counter_ns() - start
+        profile.capture_bytes += sys.getsizeof(thunk._env)
+        if self.speculator is not None and hasattr(expression_node, "site_id"):
+            self.speculate_thunk(thunk)
+        return thunk
+
+    # Starts a pure call's Thunk on the speculation pool, if everything it reads is already a value
+    # (anything else would have to be forced here first, which is exactly what laziness avoids).
+    # If the Thunk is dropped without being forced, the speculation is abandoned with it (Speculator.abandon).
+    def speculate_thunk(self, thunk):
+        plain = [plain_value(val) for val in thunk._env]
+        if UNDECLARED in plain:
+            return
+        future = self.speculator.submit(thunk._expr, plain, nil)
+        if future is not None:
+            thunk._speculation = future
+            weakref.finalize(thunk, self.speculator.abandon, future)
+
+    # The value a speculated Thunk's worker came up with, or None if it has to be evaluated here
+    # after all (it never got started, or failed with an error that should be raised for real).
+    def speculated_value(self, expression_node, future):
+        value = self.speculator.result(future, nil) if self.speculator is not None else None
+        if value is not None:
+            self.thunk_evaluations[expression_node] = self.thunk_evaluations.get(expression_node, 0) + 1
+        return value
+
+    # How every Thunk gets evaluated, from the values it captured; counts evaluations for thunk_counts()
+    def evaluate_thunk(self, expression_node, captured):
+        self.thunk_evaluations[expression_node] = self.thunk_evaluations.get(expression_node, 0) + 1
+        return self.evaluate_node(expression_node, self.env_engine.captured(expression_node, captured))
+
+    # evaluate_expression, or with the compiling engines the code compiled for expression_node
+    def evaluate_node(self, expression_node, env):
+        if self.closure_compiler is not None:
+            return expression_node.closure(env)
+        if self.bytecode_vm is not None:
+            return self.bytecode_vm.evaluate(expression_node, env)
+        if self.transpiler is not None:
+            return self.transpiler.evaluate(expression_node, env)
+        return self.evaluate_expression(expression_node, env)
+
+    # Thunk fusion: evaluates a chain found by Thunk.fusable_chain bottom-up in one tight loop,
+    # instead of one evaluate_expression round trip per link. Each link gets the value (or error)
+    # it would have had if forced on its own, so aliases of links in the middle still see theirs.
+    def fold_chain(self, links, chained, acc):
+        expr = links[0]._expr
+        op = expr.elem_type
+        other_kind, other = expr.fold[1 - chained]
+        for link in reversed(links):
+            if not self.check_if_returns_raised_error(acc):
+                operand = other if other_kind == "literal" else plain_value(link._env[other])
+                if chained == 0:
+                    acc = self.apply_binary_operator(op, acc, operand)
+                else:
+                    acc = self.apply_binary_operator(op, operand, acc)
+            link.resolve(acc)
+        self.thunk_evaluations[expr] = self.thunk_evaluations.get(expr, 0) + len(links)
 
     # grabs all globally defined functions to call when needed.
     def get_func_defs(self, ast):
@@ -62,57 +634,71 @@ class Interpreter(InterpreterBase):
 
     # returns 'main' func node from the dict input.
     def get_main_func_node(self, ast):
-        # checks for function whose name is 'main'
-        for func in self.func_defs:
-            if func.dict['name'] == "main":
-                return func
+        if ast.main is not None: # found by analysis_v4.link_program
+            return ast.main
         # define error for 'main' not found.
         super().error(ErrorType.NAME_ERROR, "No main() function was found",)
 
-    # self explanatory
+    # Calls that can't work, found when the program was linked (analysis_v4.link_program), as
+    # "caller/arity: message". They are only errors if the program actually makes them.
+    def link_report(self):
+        return list(self.link_diagnostics)
+
+    # Runs func_node's body in env. A tail call (`return f(...)`, analysis_v4.annotate_tail_call) comes
+    # back as a BoundCall with its arguments already bound, and its body then runs right here in
+    # place of ours, so a chain of tail calls takes no more Python stack than one call. Frames a
+    # tail call got are released once its body is done; env belongs to the caller.
     def run_func(self, func_node, env=None):
         if env is None:
             env = self.variable_scope_stack
+        tail_env = None
+        while True:
+            return_value = self.run_body(func_node, env)
+            if tail_env is not None:
+                self.env_engine.release_call(tail_env)
+            if not isinstance(return_value, BoundCall):
+                return return_value
+            func_node = return_value.func_node
+            env = tail_env = return_value.env
+
+    def run_body(self, func_node, env):
         # statements key for sub-dict.
         ### BEGIN FUNC SCOPE ###
-        env.append({})
+        names = func_node.block_names # None: the body declares nothing, so it gets no frame
+        if names is not None:
+            env.push_block(names)
+        self.active_frames.append((func_node, env))
+        if len(self.active_frames) > self.max_call_depth:
+            self.max_call_depth = len(self.active_frames)
         #self.output(f"Beginning {func_node} scope {env}")
         return_value = nil
         for statement in func_node.dict['statements']:
             #self.output(f"Env in run_func: {env}")
             return_value = self.run_statement(statement, env)
             if isinstance(return_value, Element) and return_value.elem_type == "return":
-                env.pop() ## END FUNC SCOPE ##
+                self.active_frames.pop()
+                if names is not None:
+                    env.pop_block() ## END FUNC SCOPE ##
                 return_value = return_value.get("value")
                 return return_value
             if isinstance(return_value, tuple) and return_value[1] == "error":
                 break; # Don't run anymore statements, exit the clause immediately.
         
         ### END FUNC SCOPE ###
-        env.pop()
+        self.active_frames.pop()
+        if names is not None:
+            env.pop_block()
         return return_value # (may return (exception, status))
     
     def run_statement(self, statement_node, env=None):
         if env is None:
             env = self.variable_scope_stack
-        elem = statement_node.elem_type
+        if self.snapshot_requests:
+            self.take_requested_snapshots()
         #self.output(f"Statement: {statement_node}, in Env: {env}")
-        if elem == "vardef":
-            self.do_definition(statement_node, env)
-        elif elem == "=":
-            self.do_assignment(statement_node,env)
-        elif elem == "fcall":
-            return self.do_func_call(statement_node, env)
-        elif elem == "return":
-            return self.do_return_statement(statement_node, env)
-        elif elem == "if":
-            return self.do_if_statement(statement_node, env)
-        elif elem == "for":
-            return self.do_for_loop(statement_node, env)
-        elif elem == "raise":
-            return self.do_raise_statement(statement_node, env)
-        elif elem == "try":
-            return self.do_try_block(statement_node,env)
+        return self.statement_handlers[statement_node.elem_type](statement_node, env)
+
+    def skip_statement(self, statement_node, env):
         return nil
 
     def do_definition(self, statement_node, env=None):
@@ -121,40 +707,45 @@ class Interpreter(InterpreterBase):
         # just add to var_name_to_value dict
         target_var_name = self.get_target_variable_name(statement_node)
         #self.output(f"Attemping to define {target_var_name} in env: {env}")
-        if target_var_name in env[-1]:
+        # analysis_v4 already knows whether this is a redefinition (None: only if the try block
+        # this catch belongs to got as far as declaring it)
+        redefinition = statement_node.redefinition
+        if redefinition is None:
+            redefinition = env.declared_here(statement_node)
+        if redefinition:
             super().error(ErrorType.NAME_ERROR, f"Variable {target_var_name} defined more than once",)
-        else:
-            env[-1][target_var_name] = None
+        env.declare(statement_node)
+        return nil
         
     # env is either an environment or self.variable_scope_stack
     def do_assignment(self, statement_node, env):
         target_var_name = self.get_target_variable_name(statement_node)
         source_node = self.get_expression_node(statement_node)
-        for scope in reversed(env): 
-            if target_var_name in scope: 
-
-                scope[target_var_name] = Thunk(source_node, env, self.evaluate_expression) # Thunk deepcopys on init. now 
-                return
+        if statement_node.strict:
+            # analysis_v4 proved this gets forced before anything observable happens, so skip the Thunk
+            # (or it assigns to a `var !x`, which has no strict_owner and doesn't count as avoided)
+            if env.read(statement_node) is not UNDECLARED:
+                value = self.evaluate_expression(source_node, env)
+                # like a bang argument, an error assigned to a `var !x` is what the statement
+                # evaluates to (so it stops the block the way raise does) and x keeps its old value
+                if statement_node.declared_strict and self.check_if_returns_raised_error(value):
+                    return value
+                env.write(statement_node, value)
+                if statement_node.strict_owner is not None:
+                    self.count_avoided_thunk(statement_node.strict_owner)
+                return nil
+        elif env.write(statement_node, self.lazy_value(source_node, env)):
+            return nil
         super().error(ErrorType.NAME_ERROR, f"variable used and not declared: {target_var_name}",)
 
-    # Check if function is defined
-    def check_valid_func(self, func_call):
-        for func in self.func_defs:
-            if func.dict['name'] == func_call:
-                return True
-        return False
-
-    # Allows function overloading by first searching for func_defs for a matching name and arg length
-    def get_func_def(self, func_call, arg_len):
-        for func in self.func_defs:
-            if func.dict['name'] == func_call and len(func.dict['args']) == arg_len:
-                return func
-        # Already check if func exists before calling
-        # So, must not have correct args.
-        super().error(ErrorType.NAME_ERROR,
-                       f"Incorrect amount of arguments given: {arg_len} ",
-                       )
-    
+    # The function fcall_node calls, as resolved by analysis_v4.link_program (overloads are told
+    # apart by argument count). A call that didn't resolve raises its error now that it's made.
+    def get_func_def(self, fcall_node):
+        func_def = fcall_node.target
+        if func_def is None:
+            super().error(*fcall_node.link_error)
+        return func_def
+
     def do_func_call(self, statement_node, env=None):
         if env is None:
             env = self.variable_scope_stack
@@ -221,33 +812,54 @@ class Interpreter(InterpreterBase):
                 return user_in
         else:
             ## USER-DEFINED FUNCTION ##
-            if not self.check_valid_func(func_call):
-                super().error(ErrorType.NAME_ERROR,
-                                f"Function {func_call} was not found",
-                                )
-            func_def = self.get_func_def(func_call, len(statement_node.dict['args']))
-            ##### Start Function Call ######
-
-            #### START FUNC SCOPE ####
-            args = statement_node.dict['args'] # passed in arguments
-            params = func_def.dict['args'] # function parameters
-            processed_args = [{}]
-
-            #self.output("Testing!")
-            for i in range(0,len(params)):
-                param_name = params[i].dict['name']
-                arg_expr = args[i]
-                arg_value = Thunk(arg_expr, env, self.evaluate_expression)
-                processed_args[-1][param_name] = arg_value
-            
-            old_env = env.copy()
-            env = processed_args
-            return_value = self.run_func(func_def, env)
-            
-            #### END FUNC SCOPE ####
-            env = old_env.copy()
-            return return_value          
-            ##### End Function Call ######
+            call = self.bind_call(statement_node, env)
+            if not isinstance(call, BoundCall):
+                return call # a bang argument was an error
+            return_value = self.run_func(call.func_node, call.env)
+            self.env_engine.release_call(call.env) # nothing can see its frames anymore
+            return return_value
+
+    # Finds the function statement_node calls and binds its arguments, evaluating the strict ones.
+    # Returns the call ready to run as a BoundCall, or the error a bang argument evaluated to.
+    def bind_call(self, statement_node, env):
+        func_def = self.get_func_def(statement_node)
+        ##### Start Function Call ######
+
+        #### START FUNC SCOPE ####
+        args = statement_node.dict['args'] # passed in arguments
+        params = func_def.dict['args'] # function parameters
+        processed_args = self.env_engine.frame(len(params)) # by parameter index
+
+        # Bang params (func f(!x)) are evaluated at the call, left to right, like in an eager
+        # language: if one of them is an error, that error is what the call evaluates to.
+        for param_name, i in func_def.bang_params:
+            arg_value = self.evaluate_expression(args[i], env)
+            if self.check_if_returns_raised_error(arg_value):
+                self.env_engine.release(processed_args)
+                return arg_value
+            processed_args[i] = arg_value
+
+        # Strict params are evaluated now, in the order the callee would force them.
+        # Once one of them is an error the callee would stop there, so the rest stay lazy.
+        for param_name, i in func_def.strict_params:
+            if processed_args[i] is not UNDECLARED:
+                continue
+            arg_value = self.evaluate_expression(args[i], env)
+            processed_args[i] = arg_value
+            self.count_avoided_thunk(func_def.strict_owner)
+            if self.check_if_returns_raised_error(arg_value):
+                break
+
+        for i in range(0,len(params)):
+            if processed_args[i] is not UNDECLARED:
+                continue
+            arg_expr = args[i]
+            arg_value = self.lazy_value(arg_expr, env)
+            processed_args[i] = arg_value
+        
+        # callee gets its own frames; the caller's env is untouched
+        call_env = self.env_engine.call_frames(processed_args, func_def.param_names)
+        return BoundCall(func_def, call_env)
     
     def do_return_statement(self, statement_node ,env=None):
         if env is None:
@@ -255,6 +867,9 @@ class Interpreter(InterpreterBase):
         if not statement_node.dict['expression']:
             #return 'nil' Element
             return Element("return", value=nil)
+        if statement_node.tail_call:
+            # run_func runs the callee once we've returned, in place of this call
+            return Element("return", value=self.bind_call(statement_node.dict['expression'], env))
         eval = self.evaluate_expression(statement_node.dict['expression'], env)
         return Element("return", value=eval)
 
@@ -276,16 +891,21 @@ class Interpreter(InterpreterBase):
         else_statements = statement_node.dict['else_statements']
 
         ### BEGIN IF SCOPE ###
-        env.append({})
+        # None: the block declares nothing, so it gets no frame
+        names = statement_node.block_names if condition else statement_node.else_block_names
+        if names is not None:
+            env.push_block(names)
         if condition:
             for statement in statements:
                 return_value = self.run_statement(statement, env)     
                 if isinstance(return_value, Element) and return_value.elem_type == "return":
                     #end scope early and return
-                    env.pop()
+                    if names is not None:
+                        env.pop_block()
                     return Element("return", value=return_value.get("value"))
                 elif return_value is not nil:
-                    env.pop()
+                    if names is not None:
+                        env.pop_block()
                     if isinstance(return_value, tuple) and return_value[1] == "error":
                         return return_value # Prevents incorrect propagation of error through try block
                     #return return_value
@@ -298,26 +918,32 @@ class Interpreter(InterpreterBase):
                     
                     if isinstance(return_value, Element) and return_value.elem_type == "return":
                         #end scope early and return
-                        env.pop()
+                        if names is not None:
+                            env.pop_block()
                         return Element("return", value=return_value.get("value"))
                     elif return_value is not nil:
-                        env.pop()
+                        if names is not None:
+                            env.pop_block()
                         if isinstance(return_value, tuple) and return_value[1] == "error":
                             return return_value # Prevents incorrect propagation of error through try block
                         #return return_value
                         return Element("return", value=return_value)
         ### END IF SCOPE ###
-        env.pop()
+        if names is not None:
+            env.pop_block()
         return nil
 
     def do_for_loop(self, statement_node, env):
         # Run initializer
         init_node = statement_node.dict['init']
-        self.run_statement(init_node, env)
+        init_value = self.run_statement(init_node, env)
+        if init_value is not nil:
+            return init_value # an error assigned to a `var !x`
         update = statement_node.dict['update']
         condition = statement_node.dict['condition']
         statements = statement_node.dict['statements']
         cond = True
+        names = statement_node.block_names # None: the body declares nothing, so it gets no frame
         # Run the loop again (exits on condition false)
         while cond:
             cond = self.evaluate_expression(condition, env) 
@@ -330,7 +956,8 @@ class Interpreter(InterpreterBase):
             if not cond:
                 break
             ### BEGIN VAR SCOPE ###
-            env.append({})
+            if names is not None:
+                env.push_block(names)
 
             for statement in statements:
                 return_value = self.run_statement(statement, env)
@@ -339,18 +966,24 @@ class Interpreter(InterpreterBase):
                 if isinstance(return_value, Element) and return_value.elem_type == "return":
 
                     #end scope early and return
-                    env.pop()
+                    if names is not None:
+                        env.pop_block()
                     return Element("return", value=return_value.get("value"))
                 elif return_value is not nil:
+                    if names is not None:
+                        env.pop_block()
                     if isinstance(return_value, tuple) and return_value[1] == "error":
                         return return_value # Prevents incorrect propagation of error through try block
                     #return return_value
                     return Element("return", value=return_value)
 
             ### END VAR SCOPE ###
-            env.pop()
+            if names is not None:
+                env.pop_block()
 
-            self.run_statement(update, env)
+            update_value = self.run_statement(update, env)
+            if update_value is not nil:
+                return update_value
         return nil
         
     def do_raise_statement(self, statement_node, env):
@@ -376,13 +1009,16 @@ class Interpreter(InterpreterBase):
         catchers = statement_node.dict['catchers']
         exception,status = (None, None)
         ### BEGIN TRY-CATCH SCOPE ###
-        env.append({})
+        names = statement_node.block_names # None: the block declares nothing, so it gets no frame
+        if names is not None:
+            env.push_block(names)
         for statement in statements:
             return_value = self.run_statement(statement, env)     
             
             if isinstance(return_value, Element) and return_value.elem_type == "return":
                 #end scope early and return
-                env.pop()
+                if names is not None:
+                    env.pop_block()
                 #self.output(f"Return val is somehow an element: {return_value}")
                 return Element("return", value=return_value.get("value"))
             if isinstance(return_value, tuple) and return_value[1] == "error":
@@ -391,14 +1027,16 @@ class Interpreter(InterpreterBase):
                 if status == "error":
                     break
             elif return_value is not nil:
-                env.pop()
+                if names is not None:
+                    env.pop_block()
                 
                 return Element("return", value=return_value)
                 # if return needed, stop running statements, immediately return the value.
         
         # If final statement just returned nil, then just end the scope and return, no catch needed.
         if status != "error":
-            env.pop()
+            if names is not None:
+                env.pop_block()
             return nil
         
         ### ONLY REACH HERE IF TRY CAUSED AN ERROR ###
@@ -412,6 +1050,8 @@ class Interpreter(InterpreterBase):
 
         # Check if catcher exists for error
         if exception not in list(catch_exception_dict.keys()):
+            if names is not None:
+                env.pop_block()
             return (exception, status) # No alligned catcher for error, exit with error status
         
         # Run needed catch clause:
@@ -420,15 +1060,18 @@ class Interpreter(InterpreterBase):
             return_value = self.run_statement(statement, env)     
             if isinstance(return_value, Element) and return_value.elem_type == "return":
                 #end scope early and return
-                env.pop()
+                if names is not None:
+                    env.pop_block()
                 return Element("return", value=return_value.get("value"))
             elif return_value is not nil:
-                env.pop()
+                if names is not None:
+                    env.pop_block()
                 return Element("return", value=return_value)
                 # if return needed, stop running statements, immediately return the value.
         
         ### END TRY-CATCH SCOPE ###
-        env.pop()
+        if names is not None:
+            env.pop_block()
         return nil
 
     # Checks if eager evaluation returns 
@@ -449,21 +1092,16 @@ class Interpreter(InterpreterBase):
     def evaluate_expression(self, expression_node, env=None): # default for env if none passed in
         if env is None:
             env = self.variable_scope_stack
-        elem = expression_node.elem_type
-        if elem in ["int", "string", "bool", "nil"]:
-            return self.get_value(expression_node)
-        elif elem == "var":
-            return self.get_value_of_variable(expression_node,env)
-        elif elem in ["+", "-", "*", "/"]:
-            return self.evaluate_binary_operator(expression_node,env)
-        elif elem in ["neg", "!"]:
-            return self.evaluate_unary_operator(expression_node,env)
-        elif elem in ['==', '<', '<=', '>', '>=', '!=']:
-            return self.evaluate_comparison_operator(expression_node, env)
-        elif elem in ['&&', '||']:
-            return self.evaluate_binary_boolean_operator(expression_node, env)
-        elif elem == "fcall":
-            return self.do_func_call(expression_node, env)
+        return self.expression_handlers[expression_node.elem_type](expression_node, env)
+
+    def evaluate_unsupported(self, expression_node, env):
+        return None # new (structs aren't part of this version)
+
+    def get_literal(self, expression_node, env):
+        return expression_node.dict['val']
+
+    def get_nil(self, expression_node, env):
+        return nil
 
     def get_value(self, expression_node):
         # Returns value assigned to key 'val'
@@ -477,15 +1115,15 @@ class Interpreter(InterpreterBase):
         if expression_node == 'nil':
             return nil
         var_name = expression_node.dict['name']
-        for scope in reversed(env):
-        #for scope in reversed(self.variable_scope_stack): 
-            if var_name in scope: 
-                val = scope[var_name] 
-                if val is None:
-                    super().error(ErrorType.NAME_ERROR, f"variable '{var_name}' declared but not defined",)
-                elif isThunk(val):
-                    val = val.value() # So we dont print the thunk object + forces evaluation.
-                return val 
+        val = env.read(expression_node)
+        if val is not UNDECLARED:
+            if val is None:
+                super().error(ErrorType.NAME_ERROR, f"variable '{var_name}' declared but not defined",)
+            elif isThunk(val):
+                val = val.value() # So we dont print the thunk object + forces evaluation.
+                # Write the forced value back so later reads skip the Thunk and it can be collected.
+                env.write(expression_node, val)
+            return val 
         # if varname not found
         super().error(ErrorType.NAME_ERROR, f"variable '{var_name}' used and not declared",)
 
@@ -500,34 +1138,32 @@ class Interpreter(InterpreterBase):
             return eval2
         #self.output(expression_node)
         #self.output(f"eval1: {eval1} eval2: {eval2}")
+        return self.apply_binary_operator(expression_node.elem_type, eval1, eval2)
 
+    # operator part of evaluate_binary_operator, once both operands are values
+    def apply_binary_operator(self, op, eval1, eval2):
         # for all operators other than + (for concat), both must be of type 'int'
-        if (expression_node.elem_type != "+") and not (type(eval1) == int and type(eval2) == int):
+        if (op != "+") and not (type(eval1) == int and type(eval2) == int):
             super().error(ErrorType.TYPE_ERROR, "Arguments must be of type 'int'.",)
-        if (expression_node.elem_type == "+") and not ((type(eval1) == int and type(eval2) == int) or (type(eval1) == str and type(eval2) == str)):
+        if (op == "+") and not ((type(eval1) == int and type(eval2) == int) or (type(eval1) == str and type(eval2) == str)):
             super().error(ErrorType.TYPE_ERROR, "Types for + must be both of type int or string.",)
-        if expression_node.elem_type == "+":
-            return (eval1 + eval2)
-        elif expression_node.elem_type == "-":
-            return (eval1 - eval2)
-        elif expression_node.elem_type == "*":
-            return (eval1 * eval2)
-        elif expression_node.elem_type == "/":
-            if eval2 == 0:
-                return("div0", "error") # return divide by 0 error
-            # integer division
-            return (eval1 // eval2)
+        if op == "/" and eval2 == 0:
+            return("div0", "error") # return divide by 0 error
+        return BINARY_OPERATORS[op](eval1, eval2) # "/" is integer division
 
     def evaluate_unary_operator(self, expression_node, env):
         # can be 'neg' (-b) or  '!' for boolean
         eval = self.evaluate_expression(expression_node.dict['op1'], env)
         if self.check_if_returns_raised_error(eval):
             return eval
-        if expression_node.elem_type == "neg":
+        return self.apply_unary_operator(expression_node.elem_type, eval)
+
+    def apply_unary_operator(self, op, eval):
+        if op == "neg":
             if not (type(eval) == int):
                 super().error(ErrorType.TYPE_ERROR, "'negation' can only be used on integer values.",)
             return -(eval)
-        if expression_node.elem_type == "!":
+        if op == "!":
             if not (type(eval) == bool):
                 super().error(ErrorType.TYPE_ERROR, "'Not' can only be used on boolean values.",)
             return not (eval)
@@ -540,37 +1176,24 @@ class Interpreter(InterpreterBase):
         eval2 = self.evaluate_expression(expression_node.dict['op2'], env)
         if self.check_if_returns_raised_error(eval2):
             return eval2
+        return self.apply_comparison_operator(expression_node.elem_type, eval1, eval2)
+
+    def apply_comparison_operator(self, op, eval1, eval2):
         # != and == can compare different types.
         #self.output(f"eval1: {eval1} eval2: {eval2}")
-        if (expression_node.elem_type not in ["!=", "=="]) and not (type(eval1) == int and type(eval2) == int):
-            super().error(ErrorType.TYPE_ERROR, f"Comparison args for {expression_node.elem_type} must be of same type int.",)
-        match expression_node.elem_type:
-            case '<':
-                return (eval1 < eval2)
-            case '<=':
-                return (eval1 <= eval2)
-            case '==':
-                if not (type(eval1) == type(eval2)):
-                    return False
-                else:
-                    return (eval1 == eval2)
-            case '>=':
-                return (eval1 >= eval2)
-            case '>':
-                return (eval1 > eval2)
-            case '!=': 
-                if not (type(eval1) == type(eval2)):
-                    return True
-                else:
-                    return (eval1 != eval2)
+        if op == "==" or op == "!=":
+            if not (type(eval1) == type(eval2)):
+                return op == "!=" # values of different types are never equal
+        elif not (type(eval1) == int and type(eval2) == int):
+            super().error(ErrorType.TYPE_ERROR, f"Comparison args for {op} must be of same type int.",)
+        return COMPARISON_OPERATORS[op](eval1, eval2)
     
     def evaluate_binary_boolean_operator(self, expression_node, env):
         elem = expression_node.elem_type
         eval1 = self.evaluate_expression(expression_node.dict['op1'], env)
         if self.check_if_returns_raised_error(eval1):
             return eval1
-        if (type(eval1) is not bool):
-            super().error(ErrorType.TYPE_ERROR, f"Argument that evaluated to {eval1} must be of type bool.",)
+        self.check_boolean_operand(eval1)
         ## SHORT CIRCUITING ##
         if elem == '&&' and eval1 == False:
             return False
@@ -580,14 +1203,17 @@ class Interpreter(InterpreterBase):
         eval2 = self.evaluate_expression(expression_node.dict['op2'], env)
         if self.check_if_returns_raised_error(eval2):
             return eval2
-        if (type(eval2) is not bool):
-            super().error(ErrorType.TYPE_ERROR, f"Argument that evaluated to {eval2} must be of type bool.",)
+        self.check_boolean_operand(eval2)
 
         match elem:
             case '&&':
                 return (eval1 and eval2)
             case '||':
                 return (eval1 or eval2)
+
+    def check_boolean_operand(self, eval):
+        if (type(eval) is not bool):
+            super().error(ErrorType.TYPE_ERROR, f"Argument that evaluated to {eval} must be of type bool.",)
     # No more functions remain... for now... :)
 
 #DEBUGGING
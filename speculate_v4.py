@@ -0,0 +1,129 @@
+# Speculative forcing: Thunks for calls to pure functions (analysis_v4.annotate_purity) get
+# started on a process pool as soon as they are created, so by the time the program asks for the
+# value it may already be sitting there. Opt-in through Interpreter(speculate=N).
+#
+# Workers parse the same program text, so an fcall node is named by its site_id and the arguments
+# travel as the plain values of its free variables. A pure call can't print, read input or raise,
+# so running it early (or twice, or never) can't be observed; the worst it can do is fail with an
+# ErrorType error or blow the stack, and then the Thunk just evaluates itself locally as usual.
+
+import concurrent.futures
+import threading
+
+from brewparse import parse_program
+from analysis_v4 import analyze_program
+
+_worker = None   # (interpreter, speculable_sites) inside a worker process
+
+
+def _init_worker(program):
+    global _worker
+    from interpreterv4 import Interpreter # not at the top: interpreterv4 imports this module
+    ast = parse_program(program)
+    analyze_program(ast)
+    interpreter = Interpreter(console_output=False)
+    interpreter.func_defs = interpreter.get_func_defs(ast)
+    _worker = (interpreter, ast.speculable_sites)
+
+
+def _speculate(site_id, values):
+    from interpreterv4 import nil
+    interpreter, sites = _worker
+    env = interpreter.env_engine.captured(sites[site_id], tuple(decode(val, nil) for val in values))
+    try:
+        result = interpreter.evaluate_expression(sites[site_id], env)
+    except Exception: # ErrorType errors and RecursionError: let the main process hit it for real
+        return ("failed",)
+    return ("ok", encode(result, nil))
+
+
+# nil is compared by identity, so it crosses the process boundary as None (never a plain value)
+def encode(val, nil):
+    return None if val is nil else val
+
+def decode(val, nil):
+    return nil if val is None else val
+
+
+class Speculator:
+    def __init__(self, program, workers):
+        self.program = program
+        self.workers = workers
+        self.running = set() # futures submitted to the current pool and not finished yet
+        self.abandoned = set() # the ones among them whose Thunk was dropped without being forced
+        self.lock = threading.Lock() # finished() runs on the pool's own thread
+        self.submitted = 0
+        self.used = 0
+        self.recycled = 0 # pools replaced because only abandoned calls were keeping them busy
+        self.pool = self.start_pool()
+
+    def start_pool(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.program,))
+
+    # Starts expression_node (a speculable fcall) on the pool with its free variables bound to values,
+    # or returns None if every worker already has something to do; queueing more would only pile up
+    # work that the main process ends up cancelling once it gets there itself.
+    def submit(self, expression_node, values, nil):
+        with self.lock:
+            if len(self.running) >= self.workers:
+                if self.abandoned != self.running:
+                    return None
+                self.recycle()
+        self.submitted += 1
+        future = self.pool.submit(_speculate, expression_node.site_id, tuple(encode(val, nil) for val in values))
+        with self.lock:
+            self.running.add(future)
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.running.discard(future)
+            self.abandoned.discard(future)
+
+    # The Thunk future was started for got dropped without being forced. A call that hasn't started
+    # is cancelled; one that is running can't be, so it's remembered: once every worker is busy with
+    # such calls, submit() replaces the pool instead of waiting for calls nothing will ever read.
+    def abandon(self, future):
+        if future.cancel():
+            return
+        with self.lock:
+            if future in self.running:
+                self.abandoned.add(future)
+
+    # Terminates the current pool's workers (killing one of them breaks the whole pool anyway) and
+    # starts a new one. Called with the lock held, when everything running was abandoned.
+    def recycle(self):
+        terminate(self.pool)
+        self.pool = self.start_pool()
+        self.running = set()
+        self.abandoned = set()
+        self.recycled += 1
+
+    # The speculated value, or None if there isn't a usable one and the Thunk has to evaluate itself.
+    # A future that hasn't started yet is cancelled instead of waited for.
+    def result(self, future, nil):
+        if future.cancel():
+            return None
+        try:
+            outcome = future.result()
+        except Exception: # its pool was shut down or broke
+            return None
+        if outcome[0] != "ok":
+            return None
+        self.used += 1
+        return decode(outcome[1], nil)
+
+    # Stops everything still running: a speculated call is allowed to never finish (nothing forced
+    # it), so the workers are terminated rather than waited for.
+    def shutdown(self):
+        terminate(self.pool)
+
+
+def terminate(pool):
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
@@ -0,0 +1,518 @@
+# Explicit-stack evaluator: Interpreter(engine="stack") runs programs without using the Python call
+# stack for Brewin calls, statements or expressions, so recursion depth is only limited by memory.
+#
+# Every handler here is a generator mirroring the tree walker's method of the same name in
+# interpreterv4. Where the tree walker calls itself, a handler yields the generator for that
+# sub-task instead and gets resumed with its result (run() keeps the suspended handlers in a list).
+# Errors raised by interpreter.error() are thrown back into the handler that yielded, so a Python
+# try/except around a yield works like it does in the tree walker (adaptive deopt relies on that).
+# Thunks are forced through value() below, not Thunk.value(), which would go back to the tree walker.
+
+from intbase import ErrorType
+from element import Element
+from env_v4 import UNDECLARED
+
+# interpreterv4 imports this module, so these are filled in by StackMachine() instead
+nil = None
+Thunk = None
+BoundCall = None
+
+
+class StackMachine:
+    def __init__(self, interpreter):
+        global nil, Thunk, BoundCall
+        from interpreterv4 import nil, Thunk, BoundCall
+        self.interpreter = interpreter
+        self.statements = {
+            "vardef": self.do_definition,
+            "=": self.do_assignment,
+            "fcall": self.do_func_call,
+            "return": self.do_return_statement,
+            "if": self.do_if_statement,
+            "for": self.do_for_loop,
+            "raise": self.do_raise_statement,
+            "try": self.do_try_block,
+        }
+        self.expressions = {
+            "int": self.get_value, "string": self.get_value, "bool": self.get_value, "nil": self.get_value,
+            "var": self.get_value_of_variable,
+            "+": self.evaluate_binary_operator, "-": self.evaluate_binary_operator,
+            "*": self.evaluate_binary_operator, "/": self.evaluate_binary_operator,
+            "neg": self.evaluate_unary_operator, "!": self.evaluate_unary_operator,
+            "==": self.evaluate_comparison_operator, "<": self.evaluate_comparison_operator,
+            "<=": self.evaluate_comparison_operator, ">": self.evaluate_comparison_operator,
+            ">=": self.evaluate_comparison_operator, "!=": self.evaluate_comparison_operator,
+            "&&": self.evaluate_binary_boolean_operator, "||": self.evaluate_binary_boolean_operator,
+            "fcall": self.do_func_call,
+            "new": self.evaluate_unsupported,
+        }
+        # a bare expression statement (`x + 1;`) is never evaluated
+        for elem in self.expressions:
+            self.statements.setdefault(elem, self.skip_statement)
+        self.max_tasks = 0 # deepest the work stack got
+
+    # Runs task (a handler's generator) to completion and returns its result
+    def run(self, task):
+        stack = [task]
+        value = None
+        error = None
+        while True:
+            task = stack[-1]
+            try:
+                if error is None:
+                    task = task.send(value)
+                else:
+                    error, raised = None, error
+                    task = task.throw(raised)
+            except StopIteration as done:
+                stack.pop()
+                if not stack:
+                    return done.value
+                value = done.value
+                continue
+            except Exception as e:
+                stack.pop()
+                if not stack:
+                    raise
+                error = e
+                continue
+            stack.append(task)
+            value = None
+            if len(stack) > self.max_tasks:
+                self.max_tasks = len(stack)
+
+    # Interpreter.run_func: tail calls run here in place of the body that made them
+    def run_func(self, func_node, env):
+        tail_env = None
+        while True:
+            return_value = yield self.run_body(func_node, env)
+            if tail_env is not None:
+                self.interpreter.env_engine.release_call(tail_env)
+            if not isinstance(return_value, BoundCall):
+                return return_value
+            func_node = return_value.func_node
+            env = tail_env = return_value.env
+
+    def run_body(self, func_node, env):
+        interpreter = self.interpreter
+        names = func_node.block_names # None: the body declares nothing, so it gets no frame
+        if names is not None:
+            env.push_block(names)
+        interpreter.active_frames.append((func_node, env))
+        if len(interpreter.active_frames) > interpreter.max_call_depth:
+            interpreter.max_call_depth = len(interpreter.active_frames)
+        return_value = nil
+        for statement in func_node.dict['statements']:
+            return_value = yield self.statement(statement, env)
+            if isinstance(return_value, Element) and return_value.elem_type == "return":
+                interpreter.active_frames.pop()
+                if names is not None:
+                    env.pop_block()
+                return return_value.get("value")
+            if isinstance(return_value, tuple) and return_value[1] == "error":
+                break
+        interpreter.active_frames.pop()
+        if names is not None:
+            env.pop_block()
+        return return_value
+
+    def statement(self, statement_node, env):
+        if self.interpreter.snapshot_requests:
+            self.interpreter.take_requested_snapshots()
+        return self.statements[statement_node.elem_type](statement_node, env)
+
+    def expression(self, expression_node, env):
+        return self.expressions[expression_node.elem_type](expression_node, env)
+
+    # The value of expression_node if getting it can't call or force anything (a literal, a variable
+    # that already holds a value, or int arithmetic over those), else UNDECLARED and it has to go
+    # through expression(). Saves a generator per operand in the common case.
+    def immediate(self, expression_node, env):
+        cheap = expression_node.cheap
+        if cheap == "literal":
+            return self.interpreter.get_value(expression_node)
+        elif cheap == "var":
+            val = env.read(expression_node)
+            if isinstance(val, Thunk):
+                if not val._evaluated:
+                    return UNDECLARED
+                val = val._value
+                env.write(expression_node, val)
+            elif val is None:
+                return UNDECLARED # undefined: expression() raises the error
+            return val
+        elif cheap == "arith" and self.interpreter.all_forced_ints(expression_node, env):
+            return self.interpreter.evaluate_expression(expression_node, env)
+        return UNDECLARED
+
+    def skip_statement(self, statement_node, env):
+        return nil
+        yield
+
+    def do_definition(self, statement_node, env):
+        self.interpreter.do_definition(statement_node, env)
+        return nil
+        yield # never reached; makes this a generator like every other handler
+
+    def do_assignment(self, statement_node, env):
+        source_node = statement_node.dict['expression']
+        if statement_node.strict:
+            if env.read(statement_node) is not UNDECLARED:
+                value = self.immediate(source_node, env)
+                if value is UNDECLARED:
+                    value = yield self.expression(source_node, env)
+                if statement_node.declared_strict and self.interpreter.check_if_returns_raised_error(value):
+                    return value
+                env.write(statement_node, value)
+                if statement_node.strict_owner is not None:
+                    self.interpreter.count_avoided_thunk(statement_node.strict_owner)
+                return nil
+        else:
+            value = self.interpreter.cheap_value(source_node, env)
+            if value is UNDECLARED:
+                value = yield self.lazy_value(source_node, env)
+            if env.write(statement_node, value):
+                return nil
+        self.interpreter.error(ErrorType.NAME_ERROR, f"variable used and not declared: {statement_node.dict['name']}",)
+
+    # The rest of Interpreter.lazy_value once cheap_value() said no, with the adaptive eager
+    # evaluation done on this stack
+    def lazy_value(self, expression_node, env):
+        interpreter = self.interpreter
+        if interpreter.adaptive and expression_node.eager_safe:
+            profile = interpreter.adaptive_profile(expression_node, env)
+            if profile is not None:
+                state = interpreter.error_state()
+                try:
+                    value = yield self.expression(expression_node, env)
+                except Exception:
+                    interpreter.deopt_site(expression_node, profile, state)
+                else:
+                    profile.eager += 1
+                    return value
+        return interpreter.make_thunk(expression_node, env)
+
+    # Thunk.value(): forces thunk the way force() does (leading dependencies first, chains folded),
+    # except that each expression is evaluated on this stack.
+    def value(self, thunk):
+        if thunk._evaluated:
+            return thunk._value
+        interpreter, expr = thunk._interpreter, thunk._expr
+        stack = [thunk]
+        depth = 1
+        while stack:
+            top = stack[-1]
+            if top._evaluated:
+                stack.pop()
+                continue
+            chain = top.fusable_chain()
+            if chain is not None:
+                links, chained, base = chain
+                if isinstance(base, Thunk) and not base._evaluated:
+                    stack.append(base)
+                    continue
+                depth = max(depth, len(stack) + len(links) - 1)
+                stack.pop()
+                interpreter.fold_chain(links, chained, base.value() if isinstance(base, Thunk) else base)
+                continue
+            dependency = top.pending_dependency()
+            if dependency is not None:
+                stack.append(dependency)
+                if len(stack) > depth:
+                    depth = len(stack)
+                continue
+            stack.pop()
+            if top._speculation is not None:
+                value = interpreter.speculated_value(top._expr, top._speculation)
+                if value is not None:
+                    top.resolve(value)
+                    continue
+            top_expr = top._expr
+            interpreter.thunk_evaluations[top_expr] = interpreter.thunk_evaluations.get(top_expr, 0) + 1
+            top.resolve((yield self.expression(top_expr, interpreter.env_engine.captured(top_expr, top._env))))
+        interpreter.record_force_depth(expr, depth)
+        return thunk._value
+
+    def do_func_call(self, statement_node, env):
+        interpreter = self.interpreter
+        func_call = statement_node.dict['name']
+        args = statement_node.dict['args']
+        if func_call == "print":
+            output = ""
+            for arg in args:
+                eval = self.immediate(arg, env)
+                if eval is UNDECLARED:
+                    eval = yield self.expression(arg, env)
+                if isinstance(eval, Thunk):
+                    eval = yield self.value(eval)
+                if interpreter.check_if_returns_raised_error(eval):
+                    return eval
+                if type(eval) is bool:
+                    output += "true" if eval else "false"
+                else:
+                    output += str(eval)
+            interpreter.output(output)
+            return nil
+        elif func_call == "inputi" or func_call == "inputs":
+            if len(args) > 1:
+                interpreter.error(ErrorType.NAME_ERROR,f"No {func_call}() function found that takes > 1 parameter",)
+            elif len(args) == 1:
+                eval = self.immediate(args[0], env)
+                if eval is UNDECLARED:
+                    eval = yield self.expression(args[0], env)
+                if isinstance(eval, Thunk):
+                    eval = yield self.value(eval)
+                if interpreter.check_if_returns_raised_error(eval):
+                    return eval
+                interpreter.output(eval)
+            user_in = interpreter.get_input()
+            try:
+                return int(user_in) if func_call == "inputi" else str(user_in)
+            except:
+                return user_in
+
+        call = yield self.bind_call(statement_node, env)
+        if not isinstance(call, BoundCall):
+            return call # a bang argument was an error
+        return_value = yield self.run_func(call.func_node, call.env)
+        interpreter.env_engine.release_call(call.env)
+        return return_value
+
+    def bind_call(self, statement_node, env):
+        interpreter = self.interpreter
+        args = statement_node.dict['args']
+        func_def = interpreter.get_func_def(statement_node)
+        params = func_def.dict['args']
+        engine = interpreter.env_engine
+        processed_args = engine.frame(len(params))
+        for param_name, i in func_def.bang_params:
+            arg_value = self.immediate(args[i], env)
+            if arg_value is UNDECLARED:
+                arg_value = yield self.expression(args[i], env)
+            if interpreter.check_if_returns_raised_error(arg_value):
+                engine.release(processed_args)
+                return arg_value
+            processed_args[i] = arg_value
+        for param_name, i in func_def.strict_params:
+            if processed_args[i] is not UNDECLARED:
+                continue
+            arg_value = self.immediate(args[i], env)
+            if arg_value is UNDECLARED:
+                arg_value = yield self.expression(args[i], env)
+            processed_args[i] = arg_value
+            interpreter.count_avoided_thunk(func_def.strict_owner)
+            if interpreter.check_if_returns_raised_error(arg_value):
+                break
+        for i in range(0, len(params)):
+            if processed_args[i] is UNDECLARED:
+                arg_value = interpreter.cheap_value(args[i], env)
+                if arg_value is UNDECLARED:
+                    arg_value = yield self.lazy_value(args[i], env)
+                processed_args[i] = arg_value
+        return BoundCall(func_def, engine.call_frames(processed_args, func_def.param_names))
+
+    def do_return_statement(self, statement_node, env):
+        if not statement_node.dict['expression']:
+            return Element("return", value=nil)
+        if statement_node.tail_call:
+            return Element("return", value=(yield self.bind_call(statement_node.dict['expression'], env)))
+        value = self.immediate(statement_node.dict['expression'], env)
+        if value is UNDECLARED:
+            value = yield self.expression(statement_node.dict['expression'], env)
+        return Element("return", value=value)
+
+    # the statements of an if/else, for body or catch block, the way those run them: a return or
+    # any other non-nil statement value ends the block (an error stays an error unless wrap_errors)
+    def run_block(self, statements, env, names, wrap_errors):
+        for statement in statements:
+            return_value = yield self.statement(statement, env)
+            if isinstance(return_value, Element) and return_value.elem_type == "return":
+                if names is not None:
+                    env.pop_block()
+                return Element("return", value=return_value.get("value"))
+            elif return_value is not nil:
+                if names is not None:
+                    env.pop_block()
+                if not wrap_errors and isinstance(return_value, tuple) and return_value[1] == "error":
+                    return return_value
+                return Element("return", value=return_value)
+        return nil
+
+    def do_if_statement(self, statement_node, env):
+        interpreter = self.interpreter
+        condition = self.immediate(statement_node.dict['condition'], env)
+        if condition is UNDECLARED:
+            condition = yield self.expression(statement_node.dict['condition'], env)
+        if isinstance(condition, Thunk):
+            condition = yield self.value(condition)
+        if interpreter.check_if_returns_raised_error(condition):
+            return condition
+        if type(condition) is not bool:
+            interpreter.error(ErrorType.TYPE_ERROR, "Condition is not of type bool",)
+        names = statement_node.block_names if condition else statement_node.else_block_names
+        if names is not None:
+            env.push_block(names)
+        statements = statement_node.dict['statements'] if condition else statement_node.dict['else_statements']
+        if statements:
+            return_value = yield self.run_block(statements, env, names, False)
+            if return_value is not nil:
+                return return_value
+        if names is not None:
+            env.pop_block()
+        return nil
+
+    def do_for_loop(self, statement_node, env):
+        interpreter = self.interpreter
+        init_value = yield self.statement(statement_node.dict['init'], env)
+        if init_value is not nil:
+            return init_value # an error assigned to a `var !x`
+        update = statement_node.dict['update']
+        condition = statement_node.dict['condition']
+        statements = statement_node.dict['statements']
+        names = statement_node.block_names
+        while True:
+            cond = self.immediate(condition, env)
+            if cond is UNDECLARED:
+                cond = yield self.expression(condition, env)
+            if isinstance(cond, Thunk):
+                cond = yield self.value(cond)
+            if interpreter.check_if_returns_raised_error(cond):
+                return cond
+            if type(cond) is not bool:
+                interpreter.error(ErrorType.TYPE_ERROR, "Condition is not of type bool",)
+            if not cond:
+                break
+            if names is not None:
+                env.push_block(names)
+            return_value = yield self.run_block(statements, env, names, False)
+            if return_value is not nil:
+                return return_value
+            if names is not None:
+                env.pop_block()
+            update_value = yield self.statement(update, env)
+            if update_value is not nil:
+                return update_value
+        return nil
+
+    def do_raise_statement(self, statement_node, env):
+        exception = self.immediate(statement_node.dict['exception_type'], env)
+        if exception is UNDECLARED:
+            exception = yield self.expression(statement_node.dict['exception_type'], env)
+        if self.interpreter.check_if_returns_raised_error(exception):
+            return exception
+        if not isinstance(exception, str):
+            self.interpreter.error(ErrorType.TYPE_ERROR, f"Exception '{exception}' does not evaluate to a string.",)
+        return (exception, "error")
+
+    def do_try_block(self, statement_node, env):
+        exception, status = (None, None)
+        names = statement_node.block_names
+        if names is not None:
+            env.push_block(names)
+        for statement in statement_node.dict['statements']:
+            return_value = yield self.statement(statement, env)
+            if isinstance(return_value, Element) and return_value.elem_type == "return":
+                if names is not None:
+                    env.pop_block()
+                return Element("return", value=return_value.get("value"))
+            if isinstance(return_value, tuple) and return_value[1] == "error":
+                exception, status = return_value # the catcher runs in the same scope
+                if status == "error":
+                    break
+            elif return_value is not nil:
+                if names is not None:
+                    env.pop_block()
+                return Element("return", value=return_value)
+        if status != "error":
+            if names is not None:
+                env.pop_block()
+            return nil
+
+        # the first catcher for the exception handles it
+        for catcher in statement_node.dict['catchers']:
+            if catcher.dict['exception_type'] == exception:
+                break
+        else:
+            if names is not None:
+                env.pop_block()
+            return (exception, status)
+        return_value = yield self.run_block(catcher.dict['statements'], env, names, True)
+        if return_value is not nil:
+            return return_value
+        if names is not None:
+            env.pop_block()
+        return nil
+
+    def get_value(self, expression_node, env):
+        return self.interpreter.get_value(expression_node)
+        yield # never reached; makes this a generator like every other handler
+
+    def evaluate_unsupported(self, expression_node, env):
+        return None # new (structs aren't part of this version)
+        yield
+
+    def get_value_of_variable(self, expression_node, env):
+        val = env.read(expression_node)
+        if val is UNDECLARED:
+            self.interpreter.error(ErrorType.NAME_ERROR, f"variable '{expression_node.dict['name']}' used and not declared",)
+        if val is None:
+            self.interpreter.error(ErrorType.NAME_ERROR, f"variable '{expression_node.dict['name']}' declared but not defined",)
+        if isinstance(val, Thunk):
+            val = yield self.value(val)
+            env.write(expression_node, val) # later reads skip the Thunk
+        return val
+
+    def evaluate_binary_operator(self, expression_node, env):
+        eval1 = self.immediate(expression_node.dict['op1'], env)
+        if eval1 is UNDECLARED:
+            eval1 = yield self.expression(expression_node.dict['op1'], env)
+        if self.interpreter.check_if_returns_raised_error(eval1):
+            return eval1
+        eval2 = self.immediate(expression_node.dict['op2'], env)
+        if eval2 is UNDECLARED:
+            eval2 = yield self.expression(expression_node.dict['op2'], env)
+        if self.interpreter.check_if_returns_raised_error(eval2):
+            return eval2
+        return self.interpreter.apply_binary_operator(expression_node.elem_type, eval1, eval2)
+
+    def evaluate_unary_operator(self, expression_node, env):
+        eval = self.immediate(expression_node.dict['op1'], env)
+        if eval is UNDECLARED:
+            eval = yield self.expression(expression_node.dict['op1'], env)
+        if self.interpreter.check_if_returns_raised_error(eval):
+            return eval
+        return self.interpreter.apply_unary_operator(expression_node.elem_type, eval)
+
+    def evaluate_comparison_operator(self, expression_node, env):
+        eval1 = self.immediate(expression_node.dict['op1'], env)
+        if eval1 is UNDECLARED:
+            eval1 = yield self.expression(expression_node.dict['op1'], env)
+        if self.interpreter.check_if_returns_raised_error(eval1):
+            return eval1
+        eval2 = self.immediate(expression_node.dict['op2'], env)
+        if eval2 is UNDECLARED:
+            eval2 = yield self.expression(expression_node.dict['op2'], env)
+        if self.interpreter.check_if_returns_raised_error(eval2):
+            return eval2
+        return self.interpreter.apply_comparison_operator(expression_node.elem_type, eval1, eval2)
+
+    def evaluate_binary_boolean_operator(self, expression_node, env):
+        interpreter = self.interpreter
+        elem = expression_node.elem_type
+        eval1 = self.immediate(expression_node.dict['op1'], env)
+        if eval1 is UNDECLARED:
+            eval1 = yield self.expression(expression_node.dict['op1'], env)
+        if interpreter.check_if_returns_raised_error(eval1):
+            return eval1
+        interpreter.check_boolean_operand(eval1)
+        if elem == '&&' and eval1 == False:
+            return False
+        if elem == '||' and eval1 == True:
+            return True
+        eval2 = self.immediate(expression_node.dict['op2'], env)
+        if eval2 is UNDECLARED:
+            eval2 = yield self.expression(expression_node.dict['op2'], env)
+        if interpreter.check_if_returns_raised_error(eval2):
+            return eval2
+        interpreter.check_boolean_operand(eval2)
+        return eval1 and eval2 if elem == '&&' else eval1 or eval2
@@ -0,0 +1,115 @@
+# Adaptive laziness (Interpreter.adaptive_value): a lazy site goes eager once ADAPTIVE_WARMUP of its
+# Thunks have nearly all been forced, back to lazy when its sampled Thunks stop being forced, and
+# lazy for good (deopt) when an eager evaluation fails. site_report() shows each site's mode.
+
+import pytest
+
+from intbase import ErrorType
+from interpreterv4 import Interpreter, ADAPTIVE_WARMUP, ADAPTIVE_SAMPLE
+
+ENGINES = ["tree", "stack", "closure", "bytecode", "python"]
+
+# step(i, true) forces x right away, step(i, false) never does
+SQUARES = """
+func sq(n) { return n * n; }
+func step(i, use) {
+  var x;
+  x = sq(i);
+  if (use) { if (x < 0) { print("negative"); } }
+  return nil;
+}
+func main() {
+  var i;
+  for (i = 0; i < FORCED; i = i + 1) { step(i, true); }
+  for (i = 0; i < UNFORCED; i = i + 1) { step(i, false); }
+  print("done");
+}
+"""
+
+
+def site(interpreter, name):
+    [row] = [row for row in interpreter.site_report() if row["site"].startswith(f"fcall: name: {name},")]
+    return row
+
+
+def run_squares(engine, forced, unforced):
+    interpreter = Interpreter(console_output=False, engine=engine)
+    interpreter.run(SQUARES.replace("UNFORCED", str(unforced)).replace("FORCED", str(forced)))
+    assert interpreter.get_output() == ["done"]
+    return site(interpreter, "sq")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_site_stays_lazy_during_warmup(engine):
+    row = run_squares(engine, ADAPTIVE_WARMUP - 1, 0)
+    assert row["mode"] == "lazy"
+    assert row["created"] == row["forced"] == ADAPTIVE_WARMUP - 1
+    assert row["eager"] == 0
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_forced_site_goes_eager_after_warmup(engine):
+    row = run_squares(engine, ADAPTIVE_WARMUP + 8, 0)
+    assert row["mode"] == "eager"
+    assert row["created"] == row["forced"] == ADAPTIVE_WARMUP
+    assert row["eager"] == 8
+    assert row["deopts"] == 0
+
+
+# Once eager, every ADAPTIVE_SAMPLE-th visit makes a Thunk instead. The sample that finds
+# ADAPTIVE_WARMUP earlier samples unforced switches the site back, and from there on it's all Thunks.
+@pytest.mark.parametrize("engine", ENGINES)
+def test_eager_site_goes_back_to_lazy(engine):
+    visits = ADAPTIVE_WARMUP + 8 + 600
+    row = run_squares(engine, ADAPTIVE_WARMUP + 8, 600)
+    assert row["mode"] == "lazy"
+    assert row["forced"] == ADAPTIVE_WARMUP
+    switch_back = (ADAPTIVE_WARMUP + 1) * ADAPTIVE_SAMPLE # eager visits (after the first) up to it
+    assert row["eager"] == switch_back - ADAPTIVE_WARMUP # the first eager visit, minus the samples
+    lazy_again = visits - (ADAPTIVE_WARMUP + 1) - switch_back + 1
+    assert row["created"] == ADAPTIVE_WARMUP + ADAPTIVE_WARMUP + lazy_again
+
+
+# dec("s") fails two calls deep with a TYPE_ERROR. Evaluated eagerly, that error must vanish with the
+# deopt (nothing forces x that time), along with the calls it unwound through.
+DEOPT = """
+func sub(n) { return n - 1; }
+func dec(n) { return sub(n); }
+func step(v, use) {
+  var x;
+  x = dec(v);
+  if (use) { if (x < 0) { print("negative"); } }
+  return nil;
+}
+func main() {
+  var i;
+  for (i = 0; i < 40; i = i + 1) { step(i, true); }
+  step("s", false);
+  for (i = 0; i < 40; i = i + 1) { step(i, true); }
+  print("done");
+}
+"""
+
+
+class RecordingInterpreter(Interpreter):
+    def deopt_site(self, expression_node, profile, state):
+        self.before_deopt = (self.error_type, len(self.active_frames))
+        super().deopt_site(expression_node, profile, state)
+        self.after_deopt = (self.error_type, self.error_line, len(self.active_frames))
+        self.saved_state = state
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_eager_evaluation_deopts_the_site(engine):
+    interpreter = RecordingInterpreter(console_output=False, engine=engine)
+    interpreter.run(DEOPT)
+    assert interpreter.get_output() == ["negative", "negative", "done"]
+    error_type, frames = interpreter.before_deopt
+    assert error_type == ErrorType.TYPE_ERROR
+    assert frames > interpreter.saved_state[2] # dec and sub never popped themselves
+    assert interpreter.after_deopt == interpreter.saved_state
+    row = site(interpreter, "dec")
+    assert row["mode"] == "deopt" and row["deopts"] == 1
+    # lazy from then on: every later step makes a Thunk, and all but step("s")'s get forced
+    assert row["created"] == ADAPTIVE_WARMUP + 1 + 40
+    assert row["forced"] == row["created"] - 1
@@ -0,0 +1,71 @@
+# engine="bytecode" (bytecode_v4) has to behave exactly like the tree walker (same programs as
+# test_stack_v4), and disassemble() lists what the compiler made of a function.
+
+import pytest
+
+import bytecode_v4
+from brewparse import parse_program
+from analysis_v4 import analyze_program
+from test_stack_v4 import PROGRAMS, run
+
+
+@pytest.mark.parametrize("environment", ["frames", "shallow"])
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_bytecode_engine_matches_tree_walker(name, environment):
+    assert run(PROGRAMS[name], "bytecode", environment) == run(PROGRAMS[name], "tree", environment)
+
+
+def compiled(program):
+    ast = parse_program(program)
+    analyze_program(ast)
+    bytecode_v4.compile_program(ast)
+    return ast
+
+
+TRY_PROGRAM = """
+func f(n) { var s; s = 0; try { if (n > 1) { raise "big"; } s = n + 1; } catch "big" { return -1; } return s; }
+func main() { print(f(1)); }
+"""
+
+# ">" marks where a statement starts; the exception table comes last
+TRY_LISTING = """\
+code f/1: 20 instructions, 6 consts, 5 names
+     0  PUSH_BLOCK              0    0  ('s',)
+>    3  DECLARE                 0    0  s
+>    6  STORE_LAZY              1    0  s
+>    9  LOAD_VAR                2    0  n
+    12  LOAD_CONST              1    0  1
+    15  COMPARE                10    0  >
+    18  CONDITION              27    0  to 27
+>   21  LOAD_CONST              2    0  'big'
+    24  RAISE                   0    0
+>   27  STORE_LAZY              3    0  s
+    30  JUMP                   48    0  to 48
+    33  CATCH                   3    0  {'big': 36}
+>   36  LOAD_CONST              4    0  1
+    39  UNARY                   4    0  neg
+    42  RETURN_VALUE            0    0
+    45  JUMP                   48    0  to 48
+>   48  LOAD_VAR                4    0  s
+    51  RETURN_VALUE            0    0
+    54  LOAD_CONST              5    0  nil
+    57  RETURN_VALUE            0    0
+  try   9-30 -> 33, unwinding to 1 blocks
+  catch 36-45 -> returned"""
+
+
+def test_disassemble_function():
+    ast = compiled(TRY_PROGRAM)
+    assert bytecode_v4.disassemble(ast.dict['functions'][0].code) == TRY_LISTING
+
+
+# every function and every lazily assigned or passed expression gets its own listing
+def test_disassemble_program():
+    listing = bytecode_v4.disassemble_program(compiled(TRY_PROGRAM))
+    headers = [line for line in listing.splitlines() if line.startswith("code ")]
+    assert [header.split(":")[0] for header in headers] == \
+        ["code f/1", "code s = ...", "code s = ...", "code main/0", "code f(arg 1)"]
+    for block in listing.split("\n\n"):
+        lines = block.splitlines()
+        count = int(lines[0].split(": ")[1].split()[0])
+        assert len([line for line in lines[1:] if not line.lstrip().startswith(("try ", "catch "))]) == count
@@ -0,0 +1,12 @@
+# engine="closure" (closure_v4) has to behave exactly like the tree walker; same programs as
+# test_stack_v4, on both environments.
+
+import pytest
+
+from test_stack_v4 import PROGRAMS, run
+
+
+@pytest.mark.parametrize("environment", ["frames", "shallow"])
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_closure_engine_matches_tree_walker(name, environment):
+    assert run(PROGRAMS[name], "closure", environment) == run(PROGRAMS[name], "tree", environment)
@@ -0,0 +1,97 @@
+# graph_v4: a snapshot of a known Thunk chain (c -> b -> a, all still pending) taken mid-run.
+
+import json
+
+import pytest
+
+from interpreterv4 import Interpreter
+
+PROGRAM = """
+func main() {
+  var a; var b; var c; var t;
+  a = inputi();
+  b = a + 1;
+  c = b * 2;
+  t = inputi();
+  print(t);
+  print(c);
+}
+"""
+
+
+# snapshots the graph at the first print, when t has been forced and a, b and c haven't
+class SnapshotInterpreter(Interpreter):
+    snapshot = None
+
+    def output(self, value):
+        if self.snapshot is None:
+            self.snapshot = self.graph_snapshot()
+        super().output(value)
+
+
+def snapshot(environment):
+    interpreter = SnapshotInterpreter(console_output=False, inp=["5", "3"], environment=environment, adaptive=False)
+    interpreter.run(PROGRAM)
+    assert interpreter.get_output() == ["5", "8"]
+    return interpreter.snapshot
+
+
+def name(node):
+    return f"{node.kind} {node.source or node.label}"
+
+
+@pytest.mark.parametrize("environment", ["frames", "shallow"])
+def test_snapshot_of_thunk_chain(environment):
+    graph = snapshot(environment)
+    nodes = {name(node): node for node in graph.nodes.values()}
+    edges = {(name(graph.nodes[source]), name(graph.nodes[target]), label) for source, target, label in graph.edges}
+    assert len(edges) == len(graph.edges)
+    a, b, c = nodes["thunk a = ..."], nodes["thunk b = ..."], nodes["thunk c = ..."]
+    assert a.label == b.label == c.label == "pending"
+    call = nodes["call main/0 depth 0"]
+    assert call.id == "call0"
+
+    if environment == "frames":
+        env = nodes["env 2 frames"]
+        holder = nodes["frame level 1, 4 slots"]
+        assert edges == {
+            ("call main/0 depth 0", "env 2 frames", "env"),
+            ("env 2 frames", "frame level 0, 0 slots", "level 0"),
+            ("env 2 frames", "frame level 1, 4 slots", "level 1"),
+            ("frame level 1, 4 slots", "thunk a = ...", "a"),
+            ("frame level 1, 4 slots", "thunk b = ...", "b"),
+            ("frame level 1, 4 slots", "thunk c = ...", "c"),
+            ("thunk c = ...", "thunk b = ...", "b"),
+            ("thunk b = ...", "thunk a = ...", "a"),
+        }
+        assert env.retained == env.size + holder.retained + nodes["frame level 0, 0 slots"].retained
+    else:
+        env = holder = nodes["env 4 names"]
+        assert edges == {
+            ("call main/0 depth 0", "env 4 names", "env"),
+            ("env 4 names", "thunk a = ...", "a"),
+            ("env 4 names", "thunk b = ...", "b"),
+            ("env 4 names", "thunk c = ...", "c"),
+            ("thunk c = ...", "thunk b = ...", "b"),
+            ("thunk b = ...", "thunk a = ...", "a"),
+        }
+    # a and b are each held twice (by the scope and by the next link), so only c is retained by its scope
+    assert a.retained == a.size and b.retained == b.size and c.retained == c.size
+    assert holder.retained == holder.size + c.retained
+    assert call.size == 0 and call.retained == env.retained
+
+
+def test_snapshot_to_json_and_dot():
+    graph = snapshot("frames")
+    data = json.loads(graph.to_json())
+    assert len(data["nodes"]) == len(graph.nodes) == 7
+    assert {(node["id"], node["kind"], node["size"], node["retained"]) for node in data["nodes"]} == \
+        {(node.id, node.kind, node.size, node.retained) for node in graph.nodes.values()}
+    assert [tuple(edge) for edge in data["edges"]] == graph.edges
+
+    dot = graph.to_dot().splitlines()
+    assert dot[0] == "digraph thunks {" and dot[-1] == "}"
+    assert len([line for line in dot if " -> " in line]) == len(graph.edges)
+    assert '  ncall0 [label="call main/0 depth 0\\nsize 0 retained %d"];' % graph.nodes["call0"].retained in dot
+    c = next(node for node in graph.nodes.values() if node.source == "c = ...")
+    assert f'  n{c.id} [label="thunk pending\\nc = ...\\nsize {c.size} retained {c.retained}"];' in dot
@@ -0,0 +1,83 @@
+# Speculator (speculate_v4) with a single worker: a speculated call whose Thunk got dropped must not
+# keep that worker from taking the next speculation.
+
+import time
+
+from brewparse import parse_program
+from analysis_v4 import analyze_program
+from interpreterv4 import Interpreter, nil
+from speculate_v4 import Speculator
+
+PROGRAM = """
+func spin(n) { var i; var s; s = 0; for (i = 0; i < n; i = i + 1) { s = s + i; } return s; }
+func main() { var x; var y; x = spin(1000000000); y = spin(100); print(y); }
+"""
+
+
+def sites():
+    ast = parse_program(PROGRAM)
+    analyze_program(ast)
+    return ast.speculable_sites
+
+
+def wait_until_running(future):
+    deadline = time.monotonic() + 30
+    while not future.running() and not future.done():
+        assert time.monotonic() < deadline, "the speculation never started"
+        time.sleep(0.01)
+
+
+def test_abandoned_speculation_frees_its_worker():
+    slow, fast = sites()
+    speculator = Speculator(PROGRAM, 1)
+    try:
+        endless = speculator.submit(slow, (), nil)
+        wait_until_running(endless)
+        assert speculator.submit(fast, (), nil) is None # the only worker is busy with work someone may need
+
+        speculator.abandon(endless) # running, so cancel() can't stop it
+        assert not endless.cancelled()
+        future = speculator.submit(fast, (), nil)
+        assert future is not None
+        assert speculator.recycled == 1
+        assert speculator.result(future, nil) == 4950
+    finally:
+        speculator.shutdown()
+
+
+# drop()'s Thunk is abandoned while its worker runs it; the program doesn't wait for it either way
+def test_abandoned_speculation_in_a_program():
+    interpreter = Interpreter(console_output=False, speculate=1)
+    interpreter.run("""
+func spin(n) { var i; var s; s = 0; for (i = 0; i < n; i = i + 1) { s = s + i; } return s; }
+func drop() { var x; x = spin(1000000000); return 0; }
+func main() { var y; drop(); y = spin(100); print(y); }
+""")
+    assert interpreter.get_output() == ["4950"]
+
+
+# A call to a pure function isn't speculated if an argument prints or reads input: the worker would
+# run those effects where nobody sees them (or read the real stdin).
+def test_impure_arguments_are_not_speculated():
+    program = """
+func id(a) { return a; }
+func noisy() { print("noisy"); return 5; }
+func main() {
+  var x; var y;
+  x = id(noisy());
+  y = id(inputi("number? "));
+  print("a");
+  print(x);
+  print(y);
+}
+"""
+    ast = parse_program(program)
+    analyze_program(ast)
+    assert ast.speculable_sites == []
+    outputs = []
+    for workers in (0, 2):
+        interpreter = Interpreter(console_output=False, inp=["7"], speculate=workers)
+        interpreter.run(program)
+        outputs.append(interpreter.get_output())
+    assert outputs[0] == ["a", "noisy", "5", "number? ", "7"]
+    assert outputs[1] == outputs[0]
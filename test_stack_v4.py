@@ -0,0 +1,77 @@
+# engine="stack" (stack_v4) has to behave exactly like the tree walker: every program here runs
+# through both, and the output and error (if any) must be the same.
+
+import pytest
+
+from interpreterv4 import Interpreter
+
+PROGRAMS = {
+    "bare expression statements": """
+func f() { 5; }
+func main() { var x; x = 1; x + 1; x; "s" + 1; print(x); print(f()); }
+""",
+    "new is declared but not defined": """
+func main() { var x; x = new foo; print("after"); print(x); }
+""",
+    "try and raise": """
+func check(n) { if (n > 2) { raise "big"; } return n; }
+func main() {
+  var i;
+  for (i = 0; i < 5; i = i + 1) {
+    try { print(check(i)); } catch "big" { print("caught ", i); }
+  }
+  try { try { raise "inner"; } catch "other" { print("no"); } } catch "inner" { print("outer caught"); }
+  try { var x; x = 1 / 0; print("unforced"); print(x); } catch "div0" { print("div0 caught"); }
+  raise "uncaught";
+}
+""",
+    "return inside nested if and for": """
+func find(limit, target) {
+  var i; var j;
+  for (i = 0; i < limit; i = i + 1) {
+    for (j = 0; j < limit; j = j + 1) {
+      if (i * j == target) { if (i != j) { return i * 100 + j; } }
+    }
+  }
+  return nil;
+}
+func sign(n) { if (n < 0) { return -1; } else { if (n == 0) { return 0; } } return 1; }
+func main() { print(find(10, 12)); print(find(3, 50)); print(sign(-4), sign(0), sign(9)); }
+""",
+    "lazy forcing": """
+func loud(n) { print("forcing ", n); return n; }
+func ignore(a, b) { return b; }
+func main() {
+  var x; var y; var s; var i;
+  x = loud(1);
+  y = x + loud(2);
+  print("before");
+  print(ignore(loud(3), y));
+  print(y);
+  s = inputi();
+  for (i = 0; i < 1000; i = i + 1) { s = s + i; }
+  print(s);
+  x = 1 / 0;
+  print("never forced");
+  print(x);
+}
+""",
+    "errors as values": """
+func f(a) { return a + 1; }
+func main() { print(f("s")); }
+""",
+}
+
+
+def run(program, engine, environment="frames", inp=("3",)):
+    interpreter = Interpreter(console_output=False, inp=list(inp), engine=engine, environment=environment)
+    try:
+        interpreter.run(program)
+    except Exception as e:
+        return interpreter.get_output(), str(e)
+    return interpreter.get_output(), None
+
+
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_stack_engine_matches_tree_walker(name):
+    assert run(PROGRAMS[name], "stack") == run(PROGRAMS[name], "tree")
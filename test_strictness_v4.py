@@ -0,0 +1,80 @@
+# Strictness analysis (analysis_v4.annotate_strictness) only decides when an argument gets
+# evaluated, so a program has to print the same whether a binding was made strict or not.
+
+import pytest
+
+from interpreterv4 import Interpreter
+
+ENGINES = ["tree", "stack", "closure", "bytecode", "python"]
+UNCAUGHT_DIV0 = "ErrorType.FAULT_ERROR: Program resulted in raised exception: div0"
+
+
+def run(program, **kwargs):
+    interpreter = Interpreter(console_output=False, **kwargs)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+# a repeated parameter name refers to the last argument, strict or not
+@pytest.mark.parametrize("environment", ["frames", "shallow"])
+@pytest.mark.parametrize("engine", ENGINES)
+def test_repeated_parameter_binds_last_argument(engine, environment):
+    program = """
+func f(a, a) { return a; }
+func g(a, b, a) { print(b); return a * 10; }
+func h(a, a) { var x; x = 1; return x; }
+func main() { print(f(1, 2)); print(g(1, 2, 3)); print(h(1 / 0, 5)); }
+"""
+    assert run(program, engine=engine, environment=environment) == ["2", "2", "30", "1"]
+
+
+def test_strict_parameter_is_counted():
+    program = """
+func f(a) { return a + 1; }
+func main() { print(f(1)); print(f(2)); }
+"""
+    interpreter = Interpreter(console_output=False)
+    interpreter.run(program)
+    assert interpreter.get_output() == ["2", "3"]
+    assert interpreter.strictness_report() == {"f/1": 2}
+
+
+def run_with_error(program, engine):
+    interpreter = Interpreter(console_output=False, engine=engine)
+    try:
+        interpreter.run(program)
+    except Exception as e:
+        return interpreter.get_output(), str(e)
+    return interpreter.get_output(), None
+
+
+# A bang parameter's error is the call's result; an error assigned to a `var !x` is raised the same
+# way, right at the assignment, and leaves x as it was. A plain var just holds the error until read.
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bang_var_raises_assigned_error(engine):
+    assert run_with_error('func main() { var !x; x = 1 / 0; print("after"); }', engine) == ([], UNCAUGHT_DIV0)
+    assert run_with_error('func main() { var x; x = 1 / 0; print("after"); }', engine) == (["after"], None)
+    program = """
+func f() { var !x; x = 1 / 0; print("not reached"); return 1; }
+func g(!a) { print("not reached"); return 1; }
+func main() {
+  var !x; x = 5;
+  try { x = 1 / 0; print("not reached"); } catch "div0" { print("caught ", x); }
+  try { print(f()); } catch "div0" { print("caught f"); }
+  try { print(g(1 / 0)); } catch "div0" { print("caught g"); }
+}
+"""
+    assert run_with_error(program, engine) == (["caught 5", "caught f", "caught g"], None)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bang_var_error_in_for_init_and_update(engine):
+    program = """
+func next(i) { if (i == 2) { raise "div0"; } return i + 1; }
+func main() {
+  var !i;
+  try { for (i = 1 / 0; i < 3; i = i + 1) { print(i); } } catch "div0" { print("caught init"); }
+  try { for (i = 0; i < 5; i = next(i)) { print(i); } } catch "div0" { print("caught update ", i); }
+}
+"""
+    assert run_with_error(program, engine) == (["caught init", "0", "1", "2", "caught update 2"], None)
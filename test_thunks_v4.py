@@ -0,0 +1,109 @@
+# Call-by-need: however many names, captures and calls share a Thunk, its expression is evaluated
+# at most once. Interpreter.thunk_counts() reports created/evaluated per expression site.
+
+import json
+import sys
+
+import pytest
+
+from interpreterv4 import Interpreter
+
+ENGINES = ["tree", "stack", "closure", "bytecode", "python"]
+
+# expensive(1000) is deferred once into x, then aliased (a, b), captured by another Thunk (c),
+# and passed on through calls (use, pair, relay); the loop makes Thunks at one site it never forces.
+ALIASED = """
+func expensive(n) {
+  print("computing");
+  var i; var s; s = 0;
+  for (i = 0; i < n; i = i + 1) { s = s + i; }
+  return s;
+}
+func use(v) { return v + 1; }
+func pair(u, v) { return u + v; }
+func relay(v) { return use(v) - 1; }
+func main() {
+  var x; x = expensive(1000);
+  var a; a = x; var b; b = a;
+  var c; c = a + b;
+  var d; d = pair(x, b);
+  var i; var unused;
+  for (i = 0; i < 5; i = i + 1) { unused = expensive(i); }
+  print(use(x)); print(use(a)); print(c); print(d); print(relay(b)); print(b);
+}
+"""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_aliased_thunk_is_evaluated_once(engine):
+    interpreter = Interpreter(console_output=False, engine=engine, adaptive=False)
+    interpreter.run(ALIASED)
+    assert interpreter.get_output() == ["computing", "499501", "499501", "999000", "999000", "499500", "499500"]
+    counts = {row["site"]: row for row in interpreter.thunk_counts()}
+    for row in counts.values():
+        assert row["evaluated"] <= row["created"], row
+    expensive = counts["fcall: name: expensive, args: [int: val: 1000]"]
+    assert expensive["created"] == 1 and expensive["evaluated"] == 1
+    unused = counts["fcall: name: expensive, args: [var: name: i]"]
+    assert unused["created"] == 5 and unused["evaluated"] == 0
+
+
+# s starts out unforced (inputi), so every `s = s + 1` wraps the previous Thunk in a new one and
+# the print forces a chain a million Thunks deep; that must not depend on Python's recursion limit.
+def test_million_thunk_chain_forces_without_recursion():
+    links = 1000000
+    program = f"""
+func main() {{
+  var s; var i;
+  s = inputi();
+  for (i = 0; i < {links}; i = i + 1) {{ s = s + 1; }}
+  print(s);
+}}
+"""
+    limit = sys.getrecursionlimit()
+    interpreter = Interpreter(console_output=False, inp=["7"])
+    try:
+        interpreter.run(program)
+    except RecursionError:
+        pytest.fail("forcing the Thunk chain hit the recursion limit")
+    assert interpreter.get_output() == [str(links + 7)]
+    assert sys.getrecursionlimit() == limit
+    link = {row["site"]: row for row in interpreter.thunk_counts()}["+: op1: [var: name: s], op2: [int: val: 1]"]
+    assert link["created"] == links and link["evaluated"] == links
+
+
+# thunk_report(): per site created/forced/never_forced, and totals over all of them
+def test_thunk_report():
+    program = """
+func pick(c, a, b) { if (c) { return a; } return b; }
+func main() {
+  var x; var y; var s; var k;
+  s = inputi();
+  x = pick(true, s + 1, s * 2);
+  y = pick(false, x, s);
+  for (k = 0; k < 3; k = k + 1) { s = s + k; }
+  print(x, " ", s);
+}
+"""
+    interpreter = Interpreter(console_output=False, inp=["10"], adaptive=False)
+    interpreter.run(program)
+    assert interpreter.get_output() == ["11 13"]
+    report = interpreter.thunk_report()
+    sites = {row["site"]: row for row in report["sites"]}
+    expected = {
+        "fcall: name: inputi, args: []": ("assignment", 1, 1),
+        "fcall: name: pick, args: [bool: val: True, +: op1: [var: name: s], op2: [int: val: 1], *: op1: [var: name: s], op2: [int: val: 2]]": ("assignment", 1, 1),
+        "+: op1: [var: name: s], op2: [int: val: 1]": ("argument", 1, 1),
+        "*: op1: [var: name: s], op2: [int: val: 2]": ("argument", 1, 0),
+        "fcall: name: pick, args: [bool: val: False, var: name: x, var: name: s]": ("assignment", 1, 0),
+        "+: op1: [var: name: s], op2: [var: name: k]": ("assignment", 3, 3),
+    }
+    assert {site: (row["kind"], row["created"], row["forced"]) for site, row in sites.items()} == expected
+    for row in report["sites"]:
+        assert row["never_forced"] == row["created"] - row["forced"]
+    assert sites["+: op1: [var: name: s], op2: [var: name: k]"]["max_chain_depth"] == 3
+    totals = report["totals"]
+    assert (totals["created"], totals["forced"], totals["never_forced"]) == (8, 6, 2)
+    assert totals["capture_bytes"] == sum(row["capture_bytes"] for row in report["sites"])
+    assert [row["capture_bytes"] for row in report["sites"]] == sorted((row["capture_bytes"] for row in report["sites"]), reverse=True)
+    assert json.loads(interpreter.thunk_report_json())["totals"]["created"] == 8
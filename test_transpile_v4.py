@@ -0,0 +1,70 @@
+# engine="python" (transpile_v4) has to behave exactly like the tree walker, both the first time a
+# program runs (transpiled) and every time after that (exec'd from CODE_CACHE).
+
+import hashlib
+
+import pytest
+
+import transpile_v4
+from test_stack_v4 import PROGRAMS as STACK_PROGRAMS, run
+
+PROGRAMS = dict(STACK_PROGRAMS, **{
+    "undeclared variable": """
+func main() { var x; x = 1; print(x); print(y); }
+""",
+    "variable out of scope": """
+func main() { if (true) { var x; x = 1; print(x); } print(x); }
+""",
+    "assignment to undeclared": """
+func main() { print("before"); y = 1; print("after"); }
+""",
+    "redefinition": """
+func main() { var x; if (true) { var x; x = 2; print(x); } var x; }
+""",
+    "undefined function": """
+func f(a) { return a; }
+func main() { print(f(1)); print(f(1, 2)); }
+""",
+    "catch scope and rethrow": """
+func f(n) {
+  try { var x; x = n; if (x > 1) { raise "big"; } return x; }
+  catch "big" { print("caught in f with ", x); raise "again"; }
+}
+func main() {
+  print(f(1));
+  try { print(f(5)); } catch "again" { print("caught again"); }
+  try { raise "unmatched"; } catch "other" { print("no"); }
+}
+""",
+    "raise a non-string": """
+func main() { try { raise 5; } catch "5" { print("no"); } }
+""",
+    "input": """
+func main() {
+  var a; var b; var c;
+  a = inputi("first? ");
+  b = inputs("second? ");
+  c = inputi();
+  print(b, " ", a + c);
+}
+""",
+})
+
+INPUTS = {"input": ("word", "4", "5")} # read in the order the values get forced: b, a, c
+
+
+def cache_key(program):
+    return hashlib.sha256(program.encode()).hexdigest()
+
+
+@pytest.mark.parametrize("environment", ["frames", "shallow"])
+@pytest.mark.parametrize("name", PROGRAMS)
+def test_python_engine_matches_tree_walker(name, environment):
+    program = PROGRAMS[name]
+    inp = INPUTS.get(name, ("3",))
+    expected = run(program, "tree", environment, inp)
+    transpile_v4.CODE_CACHE.pop(cache_key(program), None)
+    assert run(program, "python", environment, inp) == expected
+    cached = transpile_v4.CODE_CACHE[cache_key(program)]
+    assert run(program, "python", environment, inp) == expected # from the cache this time
+    assert transpile_v4.CODE_CACHE[cache_key(program)] is cached
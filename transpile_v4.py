@@ -0,0 +1,577 @@
+# Python transpiler: Interpreter(engine="python") turns every Brewin function into the source of a
+# Python function, compiles that with compile() and runs it natively. The generated code does what
+# the tree walker would do for those exact nodes, with everything it can decide up front (types of
+# literals, which arguments are bang/strict/lazy, where an error goes) already decided.
+#
+# Variables still live in the interpreter's env engine, so Thunks, graph snapshots and the frame
+# pool work as before. A lazy parameter or assignment goes through Interpreter.lazy_value, which
+# only makes a Thunk when the value isn't cheap to have right away. Each expression that may end
+# up in a Thunk gets a generated function of its own, which Interpreter.evaluate_node calls.
+#
+# Raising: errors are values, as everywhere else. A statement that raises one inside a try body
+# throws Raised to the Python try/except the try became; anywhere else it returns the error from
+# the function, like run_body's break (or, in a catch block, like the return it turns into there).
+#
+# Parsing, analysis and compiling are cached by program hash (CODE_CACHE), so running the same
+# program again only execs the cached code object into a new namespace.
+
+import hashlib
+
+from brewparse import parse_program
+from analysis_v4 import analyze_program
+from intbase import ErrorType
+from env_v4 import UNDECLARED
+
+CODE_CACHE_SIZE = 64 # programs kept; the least recently run one goes first
+CODE_CACHE = {} # sha256 of the program -> TranspiledProgram
+
+PYTHON_OPERATORS = {"+": "+", "-": "-", "*": "*", "==": "==", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+class Raised(Exception):
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+class TranspiledProgram:
+    def __init__(self, ast, source, code, consts, functions, expressions):
+        self.ast = ast
+        self.source = source # the generated Python, for reading
+        self.code = code
+        self.consts = consts # name in the generated source -> object (nodes, block names)
+        self.functions = functions # func node -> name of its generated function
+        self.expressions = expressions # expression node -> name of the function that evaluates it
+
+
+# The cached TranspiledProgram for program, transpiling it first if it isn't there yet
+def load_program(program):
+    key = hashlib.sha256(program.encode()).hexdigest()
+    transpiled = CODE_CACHE.pop(key, None)
+    if transpiled is None:
+        ast = parse_program(program)
+        analyze_program(ast)
+        transpiled = Generator().program(ast)
+        while len(CODE_CACHE) >= CODE_CACHE_SIZE:
+            CODE_CACHE.pop(next(iter(CODE_CACHE)))
+    CODE_CACHE[key] = transpiled # (re)inserted last: most recently used
+    return transpiled
+
+
+class Generator:
+    def __init__(self):
+        self.lines = []
+        self.consts = {}
+        self.const_names = {} # id(object) -> its name
+        self.functions = {}
+        self.expressions = {}
+        self.pending = [] # expression nodes that need a function of their own
+        self.queued = set() # id() of every node that has been in pending
+        self.indent = 0
+        self.temps = 0
+        self.depth = 0 # blocks pushed at this point of the function
+        self.contexts = [] # ("try", depth) / ("catch", None) around the statement being generated
+
+    def program(self, ast):
+        for i, func in enumerate(ast.dict['functions']):
+            self.functions[func] = f"f{i}_{func.dict['name']}"
+        for func in ast.dict['functions']:
+            self.function(func)
+        while self.pending:
+            self.expression_function(self.pending.pop())
+        source = "\n".join(self.lines) + "\n"
+        code = compile(source, "<brewin>", "exec")
+        return TranspiledProgram(ast, source, code, self.consts, self.functions, self.expressions)
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def temp(self):
+        self.temps += 1
+        return f"t{self.temps}"
+
+    def const(self, obj):
+        name = self.const_names.get(id(obj))
+        if name is None:
+            name = f"k{len(self.consts)}"
+            self.consts[name] = obj
+            self.const_names[id(obj)] = name
+        return name
+
+    # value in a local, so it can be tested (a literal like 1.__class__ isn't valid Python)
+    def local(self, value):
+        if value.startswith("t") and value[1:].isdigit():
+            return value
+        temp = self.temp()
+        self.emit(f"{temp} = {value}")
+        return temp
+
+    # runs generate() as the body of whatever line was just emitted, with a pass if it emits nothing
+    def body(self, generate, *args):
+        self.indent += 1
+        count = len(self.lines)
+        generate(*args)
+        if len(self.lines) == count:
+            self.emit("pass")
+        self.indent -= 1
+
+    def function(self, func_node):
+        self.temps = 0
+        self.depth = 0
+        self.emit(f"def {self.functions[func_node]}(env): # {func_node.dict['name']}/{len(func_node.dict['args'])}")
+        self.indent += 1
+        if func_node.block_names is not None:
+            self.emit(f"env.push_block({self.const(func_node.block_names)})")
+            self.depth += 1
+        self.emit(f"active_frames.append(({self.const(func_node)}, env))")
+        self.emit("if len(active_frames) > interpreter.max_call_depth: interpreter.max_call_depth = len(active_frames)")
+        statements = func_node.dict['statements']
+        for i, statement in enumerate(statements):
+            self.statement(statement, "last" if i == len(statements) - 1 else "body")
+        self.return_value("nil") # ran off the end
+        self.indent -= 1
+        self.emit("")
+
+    def expression_function(self, expression_node):
+        self.temps = 0
+        self.depth = 0
+        name = f"e{len(self.expressions)}"
+        self.expressions[expression_node] = name
+        self.emit(f"def {name}(env): # {getattr(expression_node, 'site_label', expression_node.elem_type)}")
+        self.indent += 1
+        self.emit(f"return {self.expression(expression_node)}")
+        self.indent -= 1
+        self.emit("")
+
+    def block(self, statements, names):
+        if names is not None:
+            self.emit(f"env.push_block({self.const(names)})")
+            self.depth += 1
+        for statement in statements:
+            self.statement(statement, "block")
+        if names is not None:
+            self.emit("env.pop_block()")
+            self.depth -= 1
+
+    # leaves the function with value, popping the blocks it pushed on the way (run_body's return)
+    def return_value(self, value):
+        for _ in range(self.depth):
+            self.emit("env.pop_block()")
+        self.emit("active_frames.pop()")
+        self.emit(f"return {value}")
+
+    # a statement raised error: to the try body it's in, or out of the function
+    def raise_error(self, error):
+        context, depth = self.contexts[-1] if self.contexts else (None, None)
+        if context != "try":
+            self.return_value(error)
+            return
+        for _ in range(self.depth - depth):
+            self.emit("env.pop_block()")
+        self.emit(f"raise Raised({error})")
+
+    ## STATEMENTS ##
+
+    # context is where a call statement's value goes: "body" (function body), "last" (the last
+    # statement of one, whose value the function returns), "block" (if/for/try) or "discard" (for init/update)
+    def statement(self, statement_node, context):
+        self.emit("if requests: take_requested_snapshots()")
+        elem_type = statement_node.elem_type
+        if elem_type == "vardef":
+            if statement_node.redefinition is False:
+                self.emit(f"env.declare({self.const(statement_node)})")
+            else:
+                self.emit(f"do_definition({self.const(statement_node)}, env)")
+        elif elem_type == "=":
+            self.assignment(statement_node)
+        elif elem_type == "fcall":
+            value = self.call(statement_node)
+            if context == "body":
+                self.emit(f"if {value}.__class__ is tuple:")
+                self.body(self.raise_error, value)
+            elif context == "last":
+                self.return_value(value)
+            elif context == "block":
+                self.emit(f"if {value} is not nil:")
+                self.indent += 1
+                self.emit(f"if {value}.__class__ is tuple:")
+                self.body(self.raise_error, value)
+                self.emit("else:")
+                self.body(self.return_value, value)
+                self.indent -= 1
+        elif elem_type == "return":
+            expression_node = statement_node.dict['expression']
+            if not expression_node:
+                self.return_value("nil")
+            elif statement_node.tail_call:
+                self.return_value(self.call(expression_node, tail=True))
+            else:
+                self.return_value(self.expression(expression_node))
+        elif elem_type == "if":
+            self.if_statement(statement_node)
+        elif elem_type == "for":
+            self.for_loop(statement_node)
+        elif elem_type == "raise":
+            exception = self.local(self.expression(statement_node.dict['exception_type']))
+            self.emit(f"if {exception}.__class__ is not tuple: {exception} = exception_value({exception})")
+            self.raise_error(exception)
+        elif elem_type == "try":
+            self.try_block(statement_node)
+        # anything else is a bare expression statement, which is never evaluated
+
+    def assignment(self, statement_node):
+        node = self.const(statement_node)
+        message = repr(f"variable used and not declared: {statement_node.dict['name']}")
+        if statement_node.strict:
+            self.emit(f"if env.read({node}) is UNDECLARED: error(ErrorType.NAME_ERROR, {message})")
+            value = self.expression(statement_node.dict['expression'])
+            if statement_node.declared_strict:
+                # an error assigned to a `var !x` is raised, like a bang argument's error
+                value = self.local(value)
+                self.emit(f"if {value}.__class__ is tuple:")
+                self.body(self.raise_error, value)
+            self.emit(f"env.write({node}, {value})")
+            if statement_node.strict_owner is not None:
+                self.emit(f"count_avoided_thunk({statement_node.strict_owner!r})")
+        else:
+            self.emit(f"if not env.write({node}, {self.lazy(statement_node.dict['expression'])}): error(ErrorType.NAME_ERROR, {message})")
+
+    def if_statement(self, statement_node):
+        condition = self.condition(statement_node.dict['condition'])
+        self.emit(f"if {condition}.__class__ is tuple:")
+        self.body(self.raise_error, condition)
+        self.emit(f"elif {condition}:")
+        self.body(self.block, statement_node.dict['statements'], statement_node.block_names)
+        if statement_node.dict['else_statements'] is not None:
+            self.emit("else:")
+            self.body(self.block, statement_node.dict['else_statements'], statement_node.else_block_names)
+
+    def for_loop(self, statement_node):
+        self.statement(statement_node.dict['init'], "discard")
+        self.emit("while True:")
+        self.indent += 1
+        condition = self.condition(statement_node.dict['condition'])
+        self.emit(f"if {condition}.__class__ is tuple:")
+        self.body(self.raise_error, condition)
+        self.emit(f"if not {condition}: break")
+        self.block(statement_node.dict['statements'], statement_node.block_names)
+        self.statement(statement_node.dict['update'], "discard")
+        self.indent -= 1
+
+    # an if/for condition: forced, and a bool or an error
+    def condition(self, expression_node):
+        condition = self.local(self.expression(expression_node))
+        self.emit(f"if {condition}.__class__ is not bool: {condition} = condition({condition})")
+        return condition
+
+    def try_block(self, statement_node):
+        names = statement_node.block_names
+        if names is not None:
+            self.emit(f"env.push_block({self.const(names)})")
+            self.depth += 1
+        self.emit("try:")
+        self.contexts.append(("try", self.depth))
+        self.body(lambda: [self.statement(statement, "block") for statement in statement_node.dict['statements']])
+        self.contexts.pop()
+        self.emit("except Raised as raised:") # the catcher runs in the try's scope
+        self.indent += 1
+        error = self.temp()
+        self.emit(f"{error} = raised.error")
+        caught = set()
+        self.contexts.append(("catch", None))
+        for catcher in statement_node.dict['catchers']:
+            exception = catcher.dict['exception_type']
+            if exception in caught:
+                continue # the first catcher for it wins
+            self.emit(f"{'elif' if caught else 'if'} {error}[0] == {exception!r}:")
+            caught.add(exception)
+            self.body(lambda: [self.statement(statement, "block") for statement in catcher.dict['statements']])
+        self.contexts.pop()
+        if caught:
+            self.emit("else:")
+            self.indent += 1
+        if names is not None:
+            self.emit("env.pop_block()")
+            self.depth -= 1
+        self.raise_error(error) # nothing here catches it
+        if names is not None:
+            self.depth += 1
+        if caught:
+            self.indent -= 1
+        self.indent -= 1
+        if names is not None:
+            self.emit("env.pop_block()")
+            self.depth -= 1
+
+    ## EXPRESSIONS ##
+
+    # Emits whatever evaluating expression_node takes and returns a Python expression for its value
+    # (a literal, or the local it ended up in)
+    def expression(self, expression_node):
+        elem_type = expression_node.elem_type
+        if elem_type in ("int", "string", "bool"):
+            return repr(expression_node.dict['val'])
+        elif elem_type == "nil":
+            return "nil"
+        elif elem_type == "var":
+            value = self.temp()
+            node = self.const(expression_node)
+            self.emit(f"{value} = env.read({node})")
+            self.emit(f"if {value} is None or {value} is UNDECLARED or {value}.__class__ is Thunk: {value} = variable(env, {node}, {value})")
+            return value
+        elif elem_type in ("+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">="):
+            return self.binary_operator(expression_node)
+        elif elem_type in ("neg", "!"):
+            value = self.local(self.expression(expression_node.dict['op1']))
+            if elem_type == "neg":
+                self.emit(f"if {value}.__class__ is not tuple: {value} = -{value} if {value}.__class__ is int else unary('neg', {value})")
+            else:
+                self.emit(f"if {value}.__class__ is not tuple: {value} = not {value} if {value}.__class__ is bool else unary('!', {value})")
+            return value
+        elif elem_type in ("&&", "||"):
+            value = self.local(self.expression(expression_node.dict['op1']))
+            self.emit(f"if {value}.__class__ is not tuple:")
+            self.indent += 1
+            self.emit(f"if {value}.__class__ is not bool: check_boolean_operand({value})")
+            self.emit(f"if {value} is {'True' if elem_type == '&&' else 'False'}:") # else it's decided already
+            self.indent += 1
+            self.emit(f"{value} = {self.expression(expression_node.dict['op2'])}")
+            self.emit(f"if {value}.__class__ is not tuple and {value}.__class__ is not bool: check_boolean_operand({value})")
+            self.indent -= 2
+            return value
+        elif elem_type == "fcall":
+            return self.call(expression_node)
+        return "None" # new (structs aren't part of this version)
+
+    # op2 is only evaluated if op1 isn't an error; int op int is done inline, the rest by the
+    # interpreter's apply_*_operator (which is also where type errors come from)
+    def binary_operator(self, expression_node):
+        op = expression_node.elem_type
+        op1, op2 = expression_node.dict['op1'], expression_node.dict['op2']
+        value = self.temp()
+        self.emit(f"{value} = {self.expression(op1)}")
+        guarded = op1.cheap != "literal" # a literal is never an error
+        if guarded:
+            self.emit(f"if {value}.__class__ is not tuple:")
+            self.indent += 1
+        other = self.expression(op2)
+        apply = f"{'binary' if op in ('+', '-', '*', '/') else 'compare'}({op!r}, {value}, {other})"
+        if op == "/":
+            self.emit(f"{value} = {apply}")
+        elif op2.elem_type == "int":
+            self.emit(f"{value} = {value} {PYTHON_OPERATORS[op]} {other} if {value}.__class__ is int else {apply}")
+        elif op2.cheap == "literal":
+            self.emit(f"{value} = {apply}")
+        else:
+            self.emit(f"{value} = {value} {PYTHON_OPERATORS[op]} {other} if {value}.__class__ is int and {other}.__class__ is int else {apply}")
+        if guarded:
+            self.indent -= 1
+        return value
+
+    # What Interpreter.lazy_value binds for expression_node: a literal is just itself
+    def lazy(self, expression_node):
+        if expression_node.cheap == "literal":
+            return self.expression(expression_node)
+        if id(expression_node) not in self.queued:
+            self.queued.add(id(expression_node))
+            self.pending.append(expression_node)
+        return f"lazy_value({self.const(expression_node)}, env)"
+
+    # the value of a call (with tail=True, the BoundCall to return instead, or a bang argument's error)
+    def call(self, expression_node, tail=False):
+        name = expression_node.dict['name']
+        args = expression_node.dict['args']
+        if name == "print":
+            return self.print_call(args)
+        elif name == "inputi" or name == "inputs":
+            return self.input_call(name, args)
+        func_def = expression_node.target
+        if func_def is None:
+            self.emit(f"link_error({self.const(expression_node)})")
+            return "None"
+        # the same order as Interpreter.bind_call: bang arguments, strict ones, then the rest lazily
+        value = self.temp()
+        processed = self.temp()
+        self.emit(f"{processed} = frame({len(args)})")
+        opened = 0
+        bang = set()
+        for param_name, i in func_def.bang_params:
+            arg = self.local(self.expression(args[i]))
+            self.emit(f"if {arg}.__class__ is tuple:")
+            self.indent += 1
+            self.emit(f"release({processed})")
+            self.emit(f"{value} = {arg}")
+            self.indent -= 1
+            self.emit("else:")
+            self.indent += 1
+            opened += 1
+            self.emit(f"{processed}[{i}] = {arg}")
+            bang.add(i)
+        strict = [i for param_name, i in func_def.strict_params if i not in bang]
+        indent = self.indent
+        for i in strict:
+            arg = self.local(self.expression(args[i]))
+            self.emit(f"{processed}[{i}] = {arg}")
+            self.emit(f"count_avoided_thunk({func_def.strict_owner!r})")
+            if i != strict[-1]:
+                self.emit(f"if {arg}.__class__ is not tuple:") # an error leaves the rest lazy
+                self.indent += 1
+        self.indent = indent
+        for i, arg in enumerate(args):
+            if i in bang:
+                continue
+            if i in strict:
+                self.emit(f"if {processed}[{i}] is UNDECLARED: {processed}[{i}] = {self.lazy(arg)}")
+            else:
+                self.emit(f"{processed}[{i}] = {self.lazy(arg)}")
+        call_env = self.temp()
+        self.emit(f"{call_env} = call_frames({processed}, {self.const(func_def.param_names)})")
+        if tail:
+            self.emit(f"{value} = BoundCall({self.const(func_def)}, {call_env})")
+        else:
+            self.emit(f"{value} = run_func({self.functions[func_def]}, {call_env})")
+            self.emit(f"release_call({call_env})")
+        self.indent -= opened
+        return value
+
+    def print_call(self, args):
+        value = self.temp()
+        output = self.temp()
+        self.emit(f"{output} = ''")
+        for arg in args:
+            arg = self.local(self.expression(arg))
+            self.emit(f"if {arg}.__class__ is Thunk: {arg} = {arg}.value()")
+            self.emit(f"if {arg}.__class__ is tuple:")
+            self.indent += 1
+            self.emit(f"{value} = {arg}")
+            self.indent -= 1
+            self.emit("else:")
+            self.indent += 1
+            self.emit(f"{output} += show({arg})")
+        self.emit(f"output({output})")
+        self.emit(f"{value} = nil")
+        self.indent -= len(args)
+        return value
+
+    def input_call(self, name, args):
+        if len(args) > 1:
+            self.emit(f"error(ErrorType.NAME_ERROR, {f'No {name}() function found that takes > 1 parameter'!r})")
+            return "None"
+        value = self.temp()
+        convert = "int" if name == "inputi" else "str"
+        if not args:
+            self.emit(f"{value} = read_input({convert})")
+            return value
+        prompt = self.local(self.expression(args[0]))
+        self.emit(f"if {prompt}.__class__ is Thunk: {prompt} = {prompt}.value()")
+        self.emit(f"if {prompt}.__class__ is tuple:")
+        self.indent += 1
+        self.emit(f"{value} = {prompt}")
+        self.indent -= 1
+        self.emit("else:")
+        self.indent += 1
+        self.emit(f"output({prompt})")
+        self.emit(f"{value} = read_input({convert})")
+        self.indent -= 1
+        return value
+
+
+class Transpiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.program = None
+        self.namespace = None
+        self.expressions = {} # expression node -> generated function, for evaluate()
+
+    # the ast of program (from CODE_CACHE if it has been transpiled before)
+    def load(self, program):
+        self.program = load_program(program)
+        return self.program.ast
+
+    def run_func(self, func_node, env):
+        return self.namespace['run_func'](self.namespace[self.program.functions[func_node]], env)
+
+    def evaluate(self, expression_node, env):
+        return self.expressions[expression_node](env)
+
+    # runs the cached code into a namespace of its own, bound to this run of the interpreter
+    # (called once run() has reset the interpreter for the run)
+    def start(self):
+        from interpreterv4 import nil, Thunk, BoundCall # not at the top: interpreterv4 imports this module
+        interpreter = self.interpreter
+        engine = interpreter.env_engine
+        program = self.program
+        namespace = dict(program.consts)
+        bodies = {} # func node -> its generated function, for tail calls
+
+        def run_func(body, env):
+            tail_env = None
+            while True:
+                return_value = body(env)
+                if tail_env is not None:
+                    engine.release_call(tail_env)
+                if return_value.__class__ is not BoundCall:
+                    return return_value
+                body = bodies[return_value.func_node]
+                env = tail_env = return_value.env
+
+        def variable(env, node, val):
+            if val is UNDECLARED:
+                interpreter.error(ErrorType.NAME_ERROR, f"variable '{node.dict['name']}' used and not declared",)
+            if val is None:
+                interpreter.error(ErrorType.NAME_ERROR, f"variable '{node.dict['name']}' declared but not defined",)
+            val = val.value()
+            env.write(node, val) # later reads skip the Thunk
+            return val
+
+        def binary(op, eval1, eval2):
+            if eval2.__class__ is tuple:
+                return eval2
+            return interpreter.apply_binary_operator(op, eval1, eval2)
+
+        def compare(op, eval1, eval2):
+            if eval2.__class__ is tuple:
+                return eval2
+            return interpreter.apply_comparison_operator(op, eval1, eval2)
+
+        def condition(cond):
+            if cond.__class__ is Thunk:
+                cond = cond.value()
+            if cond.__class__ is not tuple and cond.__class__ is not bool:
+                interpreter.error(ErrorType.TYPE_ERROR, "Condition is not of type bool",)
+            return cond
+
+        def exception_value(exception):
+            if not isinstance(exception, str):
+                interpreter.error(ErrorType.TYPE_ERROR, f"Exception '{exception}' does not evaluate to a string.",)
+            return (exception, "error")
+
+        def show(val):
+            if val.__class__ is bool:
+                return "true" if val else "false"
+            return str(val)
+
+        def read_input(convert):
+            user_in = interpreter.get_input()
+            try:
+                return convert(user_in)
+            except:
+                return user_in
+
+        namespace.update(
+            nil=nil, Thunk=Thunk, BoundCall=BoundCall, UNDECLARED=UNDECLARED, ErrorType=ErrorType, Raised=Raised,
+            interpreter=interpreter, active_frames=interpreter.active_frames, requests=interpreter.snapshot_requests,
+            take_requested_snapshots=interpreter.take_requested_snapshots, lazy_value=interpreter.lazy_value,
+            count_avoided_thunk=interpreter.count_avoided_thunk, do_definition=interpreter.do_definition,
+            error=interpreter.error, output=interpreter.output, check_boolean_operand=interpreter.check_boolean_operand,
+            unary=interpreter.apply_unary_operator, link_error=interpreter.get_func_def,
+            frame=engine.frame, release=engine.release, call_frames=engine.call_frames, release_call=engine.release_call,
+            run_func=run_func, variable=variable, binary=binary, compare=compare, condition=condition,
+            exception_value=exception_value, show=show, read_input=read_input,
+        )
+        exec(program.code, namespace)
+        for func_node, name in program.functions.items():
+            bodies[func_node] = namespace[name]
+        self.expressions = {node: namespace[name] for node, name in program.expressions.items()}
+        self.namespace = namespace